@@ -0,0 +1,274 @@
+"""Benchmarks for the expression pipeline.
+
+This measures how parse_expression(), find_operation(), resolve_symbols()
+and the building of the variable pipelines scale, using synthetic operation
+registries (many operations, deep Module hierarchies, heavy overloading) and
+synthetic expressions of growing depth.
+
+Run them with 'python -m dat.benchmarks'; see 'python -m dat.benchmarks -h'.
+"""
+
+import gc
+import random
+import sys
+import time
+
+from dat.global_data import GlobalManager
+from dat.operations import OperationWarning
+from dat.operations.execution import find_operation, resolve_symbols
+from dat.operations.parsing import OP, parse_expression, clear_parse_cache
+from dat.utils import catch_warning
+from dat.vistrails_interface.wrappers import VariableOperation, \
+    OperationArgument
+
+from vistrails.core.modules.vistrails_module import Module
+
+
+class SyntheticDescriptor(object):
+    """Stands for the ModuleDescriptor of a synthetic Module subclass.
+    """
+    def __init__(self, module):
+        self.module = module
+        self.name = module.__name__
+        self.identifier = 'edu.poly.dat.benchmarks'
+        self.namespace = None
+        self.sigstring = '%s:%s' % (self.identifier, self.name)
+
+
+class SyntheticRegistry(object):
+    """A synthetic set of operations, used in place of the registered ones.
+
+    hierarchy_depth Module subclasses are created, each one inheriting from
+    the previous one. nb_operations two-argument operations are spread over
+    names of overloads operations each; each overload accepts different levels
+    of the hierarchy, so that dispatch has to score all of them.
+
+    Use it as a context manager to install it in the GlobalManager; the real
+    operations are restored afterwards.
+    """
+    def __init__(self, nb_operations, hierarchy_depth=10, overloads=10,
+                 seed=0):
+        rand = random.Random(seed)
+
+        self.descriptors = []
+        base = Module
+        for i in xrange(hierarchy_depth):
+            base = type('BenchModule%d' % i, (base,), {})
+            self.descriptors.append(SyntheticDescriptor(base))
+        # Results are of the most specific type, so they can be passed to any
+        # overload
+        leaf = self.descriptors[-1]
+
+        # Each overload takes a distinct pair of types, else dispatch would
+        # be ambiguous
+        pairs = [(a, b)
+                 for a in self.descriptors
+                 for b in self.descriptors]
+        overloads = min(overloads, len(pairs))
+
+        self.names = []
+        self.operations = []
+        for i in xrange((nb_operations + overloads - 1) // overloads):
+            name = 'bench_op%d' % i
+            self.names.append(name)
+            for a, b in rand.sample(pairs, overloads):
+                if len(self.operations) >= nb_operations:
+                    break
+                self.operations.append(VariableOperation(
+                    name,
+                    callback=lambda **kwargs: None,
+                    args=[OperationArgument('a', a),
+                          OperationArgument('b', b)],
+                    return_type=leaf))
+
+        self._substitution = None
+
+    def __enter__(self):
+        self._substitution = GlobalManager.substitute_operations(
+            self.operations)
+        self._substitution.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        substitution, self._substitution = self._substitution, None
+        return substitution.__exit__(exc_type, exc_value, tb)
+
+
+class SyntheticScope(object):
+    """Variables available to a synthetic expression, with their types.
+
+    Provides the get_variable() method of VistrailData that resolve_symbols()
+    uses.
+    """
+    class _Variable(object):
+        def __init__(self, name, type):
+            self.name = name
+            self.type = type
+
+    def __init__(self, types):
+        self._variables = dict(
+            (name, SyntheticScope._Variable(name, type))
+            for name, type in types.iteritems())
+
+    def get_variable(self, varname):
+        return self._variables.get(varname)
+
+
+def synthetic_expression(registry, depth, seed=0):
+    """Makes an expression nesting depth operations of the registry.
+
+    Returns the expression as a string, and the SyntheticScope of the
+    variables it uses. Each operation gets a new variable as its second
+    argument, for instance: 'r = bench_op3(bench_op1(v0, v1), v2)'.
+    """
+    rand = random.Random(seed)
+    # Variables have the most specific type, so every overload matches and
+    # has to be scored
+    leaf = registry.descriptors[-1]
+    types = {'v0': leaf}
+    expression = 'v0'
+    for i in xrange(1, depth + 1):
+        varname = 'v%d' % i
+        types[varname] = leaf
+        expression = '%s(%s, %s)' % (rand.choice(registry.names),
+                                     expression, varname)
+    return 'r = ' + expression, SyntheticScope(types)
+
+
+class Measure(object):
+    """Timing and allocations of a benchmarked stage.
+
+    time is the best wall-clock time over the repetitions, in seconds;
+    objects is the number of objects tracked by the garbage collector that
+    the stage left allocated, i.e. the size of its result (Python 2 has no
+    allocation tracer).
+    """
+    def __init__(self, time, objects):
+        self.time = time
+        self.objects = objects
+
+
+def measure(func, repeat=3):
+    """Runs a function several times and measures it.
+
+    Returns a Measure and the result of the last call.
+    """
+    best = None
+    result = None
+    for i in xrange(repeat):
+        result = None  # Don't count the previous result
+        gc.collect()
+        objects = len(gc.get_objects())
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+        gc.collect()
+        objects = len(gc.get_objects()) - objects
+    return Measure(best, objects), result
+
+
+def _dispatch_calls(expr):
+    """Lists the (name, nb_args) of the operations in an expression tree.
+    """
+    calls = []
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if node[0] == OP:
+            calls.append((node[1], len(node) - 2))
+            stack.extend(node[2:])
+    return calls
+
+
+def bench_expression(registry, depth, repeat=3):
+    """Measures the parse, dispatch and resolve stages for an expression.
+
+    Returns a dict mapping the name of each stage to its Measure.
+    """
+    expression, scope = synthetic_expression(registry, depth)
+    leaf = registry.descriptors[-1]
+    results = dict()
+
+    def parse():
+        clear_parse_cache()
+        return parse_expression(expression)
+    results['parse'], (target, expr) = measure(parse, repeat)
+
+    calls = _dispatch_calls(expr)
+
+    def dispatch():
+        for name, nb_args in calls:
+            find_operation(name, [leaf] * nb_args)
+    results['dispatch'], _ = measure(dispatch, repeat)
+
+    def resolve():
+        return resolve_symbols(scope, expr)
+    results['resolve'], _ = measure(resolve, repeat)
+
+    return results
+
+
+def bench_build(controller, depth, repeat=3):
+    """Measures building the pipeline of an expression of builtin operators.
+
+    The operators are not fused, so that one operation is applied for each
+    level of the expression, going through apply_operation(). The innermost
+    operand is a variable, so that the constants don't get folded.
+
+    This needs a running application, with controller being the current
+    controller of the VistrailManager.
+    """
+    from dat.operations.execution import BuildConstant
+    from dat.vistrail_data import VistrailManager
+
+    vistraildata = VistrailManager(controller)
+    if vistraildata.get_variable('bench_var') is None:
+        vistraildata.new_variable(
+            'bench_var', BuildConstant(1.0).execute(controller))
+
+    expression = 'r = ' + '(' * depth + 'bench_var' + ''.join(
+        ' + %d)' % (i + 2) for i in xrange(depth))
+    target, expr = parse_expression(expression)
+    op_tree = resolve_symbols(vistraildata, expr)
+
+    def build():
+        return op_tree.execute(controller)
+    return measure(build, repeat)[0]
+
+
+def run(sizes, depths, hierarchy_depth=10, overloads=10, repeat=3,
+        controller=None, out=None):
+    """Runs the benchmarks, printing a table of the results.
+
+    sizes is a list of numbers of operations in the synthetic registries,
+    depths a list of expression depths. The build stage only runs if a
+    controller is given.
+    """
+    if out is None:
+        out = sys.stdout
+
+    stages = ['parse', 'dispatch', 'resolve']
+    out.write('%8s %6s  %s\n' % (
+        'ops', 'depth',
+        ' '.join('%12s %8s' % (stage + ' (ms)', 'objects')
+                 for stage in stages)))
+    with catch_warning(OperationWarning):
+        for size in sizes:
+            registry = SyntheticRegistry(size, hierarchy_depth, overloads)
+            with registry:
+                for depth in depths:
+                    results = bench_expression(registry, depth, repeat)
+                    out.write('%8d %6d  %s\n' % (
+                        size, depth,
+                        ' '.join('%12.3f %8d' % (results[stage].time * 1000.0,
+                                                 results[stage].objects)
+                                 for stage in stages)))
+
+    if controller is not None:
+        out.write('\n%6s %12s %8s\n' % ('depth', 'build (ms)', 'objects'))
+        for depth in depths:
+            result = bench_build(controller, depth, repeat)
+            out.write('%6d %12.3f %8d\n' % (depth, result.time * 1000.0,
+                                            result.objects))
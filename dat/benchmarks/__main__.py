@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+
+
+top_level = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+if top_level not in sys.path:
+    sys.path.append(top_level)
+
+
+import dat.main  # noqa: E402
+dat.main.setup_vistrails()
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+parser = argparse.ArgumentParser(
+    prog='python -m dat.benchmarks',
+    description="Benchmarks parsing, dispatch, resolution and building of "
+                "expressions against synthetic operation registries")
+parser.add_argument('--sizes', type=int_list, default=[10, 100, 1000, 10000],
+                    help="numbers of operations in the registries, "
+                         "comma-separated")
+parser.add_argument('--depths', type=int_list, default=[1, 10, 100],
+                    help="depths of the expressions, comma-separated")
+parser.add_argument('--hierarchy-depth', type=int, default=10,
+                    help="depth of the Module hierarchy")
+parser.add_argument('--overloads', type=int, default=10,
+                    help="number of overloads for each operation name")
+parser.add_argument('--repeat', type=int, default=3,
+                    help="number of runs of each stage, the best is kept")
+parser.add_argument('--build', action='store_true',
+                    help="also benchmark building the pipelines; this starts "
+                         "the application")
+args = parser.parse_args()
+
+
+from dat.benchmarks import run  # noqa: E402
+
+
+controller = None
+if args.build:
+    from dat.tests import setup_application
+    from dat.vistrail_data import VistrailManager
+
+    app = setup_application()
+    controller = app.builderWindow.new_vistrail().get_controller()
+    VistrailManager.set_controller(controller, register=True)
+
+run(args.sizes, args.depths,
+    hierarchy_depth=args.hierarchy_depth,
+    overloads=args.overloads,
+    repeat=args.repeat,
+    controller=controller)
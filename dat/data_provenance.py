@@ -118,8 +118,7 @@ class Variable(_DataProvenanceNode):
             _DataProvenanceNode.__init__(self, **kwargs['_json'])
         except KeyError:
             variable = kwargs.pop('variable')
-            version = variable._controller.vistrail.get_version_number(
-                'dat-var-%s' % variable.name)
+            version = variable.get_version()
             _DataProvenanceNode.__init__(
                 self,
                 version=version,
@@ -136,13 +135,13 @@ class Operation(_DataProvenanceNode):
             args = {}
             if operation.usable_in_command:
                 for variable, decl_arg in izip(arg_list, operation.parameters):
-                    if variable._materialized is None:
+                    if variable.materialized_info is None:
                         # Intermediate result: write its provenance
                         args[decl_arg.name] = variable.provenance
                     else:
                         # Materialized variable: reference it instead
                         args[decl_arg.name] = Variable(
-                            variable=variable._materialized)
+                            variable=variable.materialized_info)
             _DataProvenanceNode.__init__(
                 self,
                 pkg_id=operation.package_identifier,
@@ -1,7 +1,9 @@
+import contextlib
 import warnings
 
 from dat import BaseVariableLoader
-from dat.vistrails_interface.utils import resolve_descriptor
+from dat.vistrails_interface.utils import resolve_descriptor, \
+    parent_modules
 from dat.vistrails_interface.wrappers import Plot, VariableOperation, \
     OperationArgument
 
@@ -19,11 +21,23 @@ class GlobalManager(object):
 
     It also autodiscovers the Plots and VariableLoaders from VisTrails packages
     when they are loaded, by subscribing to VisTrails's registry notifications.
+
+    The operations usable in commands are indexed by name and number of
+    arguments, so that overload resolution doesn't have to scan every
+    registered operation; the inheritance distances computed for it are cached
+    as well.
     """
     def __init__(self):
         self._plots = dict()  # (package_identifier: str, name: str) -> Plot
         self._variable_loaders = set()
         self._variable_operations = set()
+        # name: str -> {nb_args: int -> set([VariableOperation])}
+        self._operations_index = dict()
+        # Module subclass -> {Module subclass: int}
+        self._parent_modules = dict()
+        # Incremented each time an operation is added or removed, so that
+        # caches built from the operations can tell they are stale
+        self.operations_generation = 0
 
     def init(self):
         """Initial setup of the Manager.
@@ -88,13 +102,29 @@ class GlobalManager(object):
         return iter(self._variable_loaders)
     variable_loaders = property(_get_loaders)
 
+    def _index_operation(self, operation):
+        by_arity = self._operations_index.setdefault(operation.name, {})
+        by_arity.setdefault(len(operation.parameters), set()).add(operation)
+
     def _add_operation(self, operation):
         self._variable_operations.add(operation)
+        self.operations_generation += 1
+        if operation.usable_in_command:
+            self._index_operation(operation)
         get_vistrails_application().send_notification('dat_new_operation',
                                                       operation)
 
     def _remove_operation(self, operation):
         self._variable_operations.remove(operation)
+        self.operations_generation += 1
+        if operation.usable_in_command:
+            by_arity = self._operations_index[operation.name]
+            nb_args = len(operation.parameters)
+            by_arity[nb_args].discard(operation)
+            if not by_arity[nb_args]:
+                del by_arity[nb_args]
+            if not by_arity:
+                del self._operations_index[operation.name]
         get_vistrails_application().send_notification('dat_removed_operation',
                                                       operation)
 
@@ -102,6 +132,52 @@ class GlobalManager(object):
         return iter(self._variable_operations)
     variable_operations = property(_get_operations)
 
+    def get_operations_by_name(self, name):
+        """Gets the operations usable in commands that have the given name.
+
+        Returns a dict mapping a number of arguments to the set of
+        VariableOperation accepting that many arguments. It is empty if there
+        is no such operation; don't modify it.
+        """
+        return self._operations_index.get(name, {})
+
+    def get_operations(self, name, nb_args):
+        """Gets the operations with the given name and number of arguments.
+
+        Returns a set of VariableOperation; don't modify it.
+        """
+        return self._operations_index.get(name, {}).get(nb_args, frozenset())
+
+    @contextlib.contextmanager
+    def substitute_operations(self, operations):
+        """Temporarily makes these the only operations usable in commands.
+
+        The registered operations are indexed again when the block exits.
+        This is used by the benchmarks, see dat.benchmarks.
+        """
+        saved = self._operations_index
+        self._operations_index = dict()
+        for operation in operations:
+            self._index_operation(operation)
+        self.operations_generation += 1
+        try:
+            yield
+        finally:
+            self._operations_index = saved
+            self.operations_generation += 1
+
+    def parent_modules(self, mod):
+        """Cached version of parent_modules().
+
+        Maps each Module subclass that 'mod' inherits from to its distance
+        from 'mod'. This is used to score the overloads of an operation.
+        """
+        try:
+            return self._parent_modules[mod]
+        except KeyError:
+            parents = self._parent_modules[mod] = parent_modules(mod)
+            return parents
+
     def new_package(self, package_identifier, prepend=False):
         """Called when a package is loaded in VisTrails.
 
@@ -179,6 +255,10 @@ class GlobalManager(object):
         Removes the Plots and VariableLoaders associated with that package from
         the lists.
         """
+        # The package's Module subclasses are going away, and packages that
+        # get reloaded will provide new classes
+        self._parent_modules = dict()
+
         for plot in self._plots.values():
             if plot.package_identifier == package.identifier:
                 self._remove_plot(plot)
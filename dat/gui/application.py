@@ -211,6 +211,11 @@ class Application(QtGui.QApplication, NotificationDispatcher,
             'dat_controller_changed',
             self._controller_changed)
 
+        # Execute the visualizations found while the project is loading
+        self.register_notification(
+            'dat_loaded_cell',
+            self._execute_cell)
+
         # Change the current controller when another sheet is selected
         self.register_notification(
             'spreadsheet_sheet_changed',
@@ -257,21 +262,7 @@ class Application(QtGui.QApplication, NotificationDispatcher,
         if new:
             # Execute the pipelines
             for cellInfo, pipeline in vistraildata.all_cells:
-                tab = cellInfo.tab
-                error = vistrails_interface.try_execute(
-                    controller,
-                    pipeline)
-                if error is not None:
-                    from dat.gui.cellcontainer import DATCellContainer
-                    tab.setCellWidget(
-                        cellInfo.row,
-                        cellInfo.column,
-                        DATCellContainer(
-                            cellInfo=CellInformation(
-                                tab,
-                                cellInfo.row,
-                                cellInfo.column),
-                            error=error))
+                self._execute_cell(controller, cellInfo, pipeline)
 
         # Make one of these tabs current
         sh_window = spreadsheetController.findSpreadsheetWindow(
@@ -284,6 +275,23 @@ class Application(QtGui.QApplication, NotificationDispatcher,
                 tabidx = tab_controller.indexOf(tab)
                 tab_controller.setCurrentIndex(tabidx)
 
+    def _execute_cell(self, controller, cellInfo, pipeline):
+        tab = cellInfo.tab
+        error = vistrails_interface.try_execute(
+            controller,
+            pipeline)
+        if error is not None:
+            from dat.gui.cellcontainer import DATCellContainer
+            tab.setCellWidget(
+                cellInfo.row,
+                cellInfo.column,
+                DATCellContainer(
+                    cellInfo=CellInformation(
+                        tab,
+                        cellInfo.row,
+                        cellInfo.column),
+                    error=error))
+
     def _sheet_changed(self, tab):
         vistraildata = VistrailManager.from_spreadsheet_tab(tab)
         if vistraildata is not None:
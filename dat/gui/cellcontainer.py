@@ -7,7 +7,8 @@ from dat import MIMETYPE_DAT_VARIABLE, MIMETYPE_DAT_PLOT, DATRecipe, \
 from dat.gui import get_icon
 from dat.gui import typecast_dialog
 from dat.global_data import GlobalManager
-from dat.operations import apply_operation, get_typecast_operations
+from dat.operations import apply_operation, get_typecast_operations, \
+    get_typecast_chain
 from dat.utils import deferrable_via_qt
 from dat.vistrail_data import VistrailManager
 from dat import vistrails_interface
@@ -53,9 +54,9 @@ class DATCellContainer(CellContainerInterface, QtGui.QWidget):
         # Notifications
         app = get_vistrails_application()
         app.register_notification(
-            'dat_new_variable', self._variable_added)
+            'dat_renamed_variables', self._variables_renamed)
         app.register_notification(
-            'dat_removed_variable', self._variable_removed)
+            'dat_removed_variables', self._variables_removed)
         app.register_notification(
             'dragging_to_overlays', self._set_dragging)
         self._controller = app.get_controller()
@@ -138,9 +139,9 @@ class DATCellContainer(CellContainerInterface, QtGui.QWidget):
         if cellInfo is None:  # We were removed from the spreadsheet
             app = get_vistrails_application()
             app.unregister_notification(
-                'dat_new_variable', self._variable_added)
+                'dat_renamed_variables', self._variables_renamed)
             app.unregister_notification(
-                'dat_removed_variable', self._variable_removed)
+                'dat_removed_variables', self._variables_removed)
             app.unregister_notification(
                 'dragging_to_overlays', self._set_dragging)
 
@@ -155,25 +156,24 @@ class DATCellContainer(CellContainerInterface, QtGui.QWidget):
         self._overlay_scrollarea.setAttribute(
             QtCore.Qt.WA_TransparentForMouseEvents, dragging)
 
-    def _variable_added(self, controller, varname, renamed_from=None):
-        if (renamed_from is None or
-                controller != self._controller or
-                self._plot is None):
+    def _variables_renamed(self, controller, renamed):
+        if controller != self._controller or self._plot is None:
             return
+        new_varnames = set(renamed.itervalues())
         if any(
                 (param.type == RecipeParameterValue.VARIABLE and
-                 param.variable.name == varname)
+                 param.variable.name in new_varnames)
                 for params in self._parameters.itervalues()
                 for param in params):
             self._overlay.update()
 
-    def _variable_removed(self, controller, varname, renamed_to=None):
-        if (renamed_to is not None or
-                controller != self._controller or self._plot is None):
+    def _variables_removed(self, controller, varnames):
+        if controller != self._controller or self._plot is None:
             return
+        varnames = set(varnames)
         if any(
                 (param.type == RecipeParameterValue.VARIABLE and
-                 param.variable.name == varname)
+                 param.variable.name in varnames)
                 for params in self._parameters.itervalues()
                 for param in params):
             # A variable was removed!
@@ -192,9 +192,9 @@ class DATCellContainer(CellContainerInterface, QtGui.QWidget):
                 for param, values in self._parameters.iteritems():
                     for i, value in enumerate(values):
                         if (value.type == RecipeParameterValue.VARIABLE and
-                                value.variable.name == varname):
+                                value.variable.name in varnames):
                             to_remove.append((param, i))
-                for param, i in to_remove:
+                for param, i in reversed(to_remove):
                     del self._parameters[param][i]
                 for param in set(param for param, i in to_remove):
                     if not self._parameters[param]:
@@ -586,6 +586,14 @@ class DATCellContainer(CellContainerInterface, QtGui.QWidget):
         typecasts = get_typecast_operations(
             source_descriptor,
             expected_descriptor)
+        if not typecasts:
+            # No single operation does it, but several might
+            chain = get_typecast_chain(source_descriptor, expected_descriptor)
+            if chain:
+                for operation in chain:
+                    variable = apply_operation(controller, operation,
+                                               [variable])
+                return variable, chain[-1]
         choice = typecast_dialog.choose_operation(
             typecasts,
             source_descriptor, expected_descriptor,
@@ -7,7 +7,10 @@ from dat.gui import translate
 from dat.gui.generic import CategorizedListWidget, ConsoleWidget, \
     SingleLineTextEdit
 from dat.operations import is_operator, perform_operation, \
-    InvalidOperation, OperationWarning
+    perform_operations, preview_expression, InvalidOperation, \
+    OperationWarning
+from dat.operations.execution import check_expression, is_broadcast
+from dat.operations.parsing import IncrementalParser
 from dat.utils import catch_warning
 from dat.vistrail_data import VistrailManager
 
@@ -79,6 +82,17 @@ class MarkerHighlighterLineEdit(SingleLineTextEdit):
             return super(MarkerHighlighterLineEdit,
                          self).focusNextPrevChild(forward)
 
+    def insertFromMimeData(self, source):
+        # A block of several lines is a script, that the panel will run
+        if source.hasText():
+            text = str(source.text())
+            if '\n' in text.strip():
+                self.emit(self.scriptPasted, text)
+                return
+        super(MarkerHighlighterLineEdit, self).insertFromMimeData(source)
+
+    scriptPasted = QtCore.SIGNAL('scriptPasted(QString)')
+
     def focus_first_marker(self):
         text = str(self.toPlainText())
         marker = MarkerHighlighterLineEdit._marker_pattern.search(text)
@@ -136,8 +150,35 @@ class OperationPanel(QtGui.QWidget):
         self._input_line = MarkerHighlighterLineEdit()
         self.connect(self._input_line, QtCore.SIGNAL('returnPressed()'),
                      self.execute_line)
+        self.connect(self._input_line,
+                     MarkerHighlighterLineEdit.scriptPasted,
+                     lambda script: self.execute_script(str(script)))
         layout.addWidget(self._input_line)
 
+        # Shows whether the expression being typed is valid, and its type
+        self._parser = IncrementalParser()
+        self._status = QtGui.QLabel()
+        self._status.setTextFormat(QtCore.Qt.PlainText)
+        layout.addWidget(self._status)
+        self.connect(self._input_line, QtCore.SIGNAL('textChanged()'),
+                     self.check_line)
+
+        # Shows the value of the expression being typed
+        self._preview = QtGui.QLabel()
+        layout.addWidget(self._preview)
+        self._preview_timer = QtCore.QTimer(self)
+        self._preview_timer.setSingleShot(True)
+        self._preview_timer.setInterval(300)
+        self.connect(self._preview_timer, QtCore.SIGNAL('timeout()'),
+                     self.update_preview)
+        self.connect(self._input_line, QtCore.SIGNAL('textChanged()'),
+                     self._preview_timer.start)
+
+        script_button = QtGui.QPushButton(_("Run script..."))
+        self.connect(script_button, QtCore.SIGNAL('clicked()'),
+                     self.open_script)
+        layout.addWidget(script_button)
+
         layout.addWidget(QtGui.QLabel(_("Available operations:")))
 
         self._list = CategorizedListWidget()
@@ -257,6 +298,48 @@ class OperationPanel(QtGui.QWidget):
                     file=None, line=None):
         self._console.add_error(message[0])
 
+    def check_line(self):
+        _ = translate(OperationPanel)
+
+        text = str(self._input_line.text())
+        vistraildata = VistrailManager()
+        if (not text.strip() or vistraildata is None or
+                MarkerHighlighterLineEdit._marker_pattern.search(text) or
+                is_broadcast(text)):
+            self._status.setText('')
+            return
+        try:
+            target, expr_tree = self._parser.parse(text)
+            result_type, messages = check_expression(vistraildata, expr_tree)
+        except InvalidOperation, e:
+            self._status.setStyleSheet('color: #C00;')
+            self._status.setText(e.message)
+            return
+        messages.insert(0, _("Result type: {type}").format(
+            type=result_type.name))
+        self._status.setStyleSheet('')
+        self._status.setText('\n'.join(messages))
+
+    def update_preview(self):
+        _ = translate(OperationPanel)
+
+        text = str(self._input_line.text()).strip()
+        if (not text or
+                MarkerHighlighterLineEdit._marker_pattern.search(text)):
+            self._preview.setText('')
+            return
+        try:
+            with catch_warning(OperationWarning, record=True):
+                value = preview_expression(text)
+        except Exception:
+            # The expression is probably not finished, this is not an error
+            self._preview.setText('')
+            return
+        value = repr(value)
+        if len(value) > 80:
+            value = value[:77] + '...'
+        self._preview.setText(_("Value: {value}").format(value=value))
+
     def execute_line(self):
         self.execute(str(self._input_line.text()))
 
@@ -273,3 +356,27 @@ class OperationPanel(QtGui.QWidget):
                 self._input_line.setSelection(e.select[0],
                                               e.select[1] - e.select[0])
             self._console.add_error(e.message)
+
+    def open_script(self):
+        _ = translate(OperationPanel)
+        filename = QtGui.QFileDialog.getOpenFileName(
+            self, _("Run script"),
+            filter=_("DAT scripts (*.dat);;All files (*)"))
+        if not filename:
+            return
+        with open(str(filename), 'rb') as fp:
+            self.execute_script(fp.read())
+
+    def execute_script(self, script):
+        """Runs several commands at once.
+
+        The whole script is rolled back if one of them fails.
+        """
+        for line in script.splitlines():
+            if line.strip():
+                self._console.add_line(line)
+        try:
+            with catch_warning(OperationWarning, handle=self._show_error):
+                perform_operations(script)
+        except InvalidOperation, e:
+            self._console.add_error(e.message)
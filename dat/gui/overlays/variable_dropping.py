@@ -4,7 +4,7 @@ from dat.gui.overlays import Overlay
 
 from dat import MIMETYPE_DAT_VARIABLE
 from dat.gui import translate
-from dat.operations.typecasting import get_typecast_operations
+from dat.operations.typecasting import get_typecast_chain
 from dat.vistrail_data import VistrailManager
 from dat.vistrails_interface.wrappers import DataPort
 
@@ -120,9 +120,9 @@ class VariableDroppingOverlay(Overlay):
                 if issubclass(variable.type.module, port.type.module):
                     self._compatible_ports.append(COMPATIBLE)
                 else:
-                    if get_typecast_operations(
+                    if get_typecast_chain(
                             variable.type,
-                            port.type):
+                            port.type) is not None:
                         self._compatible_ports.append(TYPECASTABLE)
                     else:
                         self._compatible_ports.append(INCOMPATIBLE)
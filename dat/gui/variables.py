@@ -76,8 +76,12 @@ class VariablePanel(QtGui.QWidget):
 
         app = get_vistrails_application()
         app.register_notification('dat_new_variable', self.variable_added)
-        app.register_notification('dat_removed_variable',
-                                  self.variable_removed)
+        app.register_notification('dat_removed_variables',
+                                  self.variables_removed)
+        app.register_notification('dat_renamed_variables',
+                                  self.variables_renamed)
+        app.register_notification('dat_redefined_variable',
+                                  self.variable_redefined)
 
         for varname in self._vistraildata.variables:
             self.variable_added(self._vistraildata.controller, varname)
@@ -85,8 +89,12 @@ class VariablePanel(QtGui.QWidget):
     def unregister_notifications(self):
         app = get_vistrails_application()
         app.unregister_notification('dat_new_variable', self.variable_added)
-        app.unregister_notification('dat_removed_variable',
-                                    self.variable_removed)
+        app.unregister_notification('dat_removed_variables',
+                                    self.variables_removed)
+        app.unregister_notification('dat_renamed_variables',
+                                    self.variables_renamed)
+        app.unregister_notification('dat_redefined_variable',
+                                    self.variable_redefined)
 
     def new_variable(self):
         """Called when a button is clicked.
@@ -111,8 +119,8 @@ class VariablePanel(QtGui.QWidget):
             QtGui.QMessageBox.Ok | QtGui.QMessageBox.Cancel,
             QtGui.QMessageBox.Cancel)
         if confirm == QtGui.QMessageBox.Ok:
-            for item in selected:
-                self._vistraildata.remove_variable(str(item.text()))
+            self._vistraildata.remove_variables(
+                [str(item.text()) for item in selected])
 
     def rename_variable(self):
         """Called when a button is clicked.
@@ -151,21 +159,51 @@ class VariablePanel(QtGui.QWidget):
                 return
             varname = str(selected.text())
             self._vistraildata.rename_variable(varname, new_name)
-            # This will trigger a variable_removed then a variable_added
+            # This will trigger a variables_renamed
 
-    def variable_added(self, controller, varname, renamed_from=None):
+    def variable_added(self, controller, varname):
         if controller != self._vistraildata.controller:
             return
+        self._insert_item(varname)
+
+    def _insert_item(self, varname):
         pos = bisect(
             self._list_widget.count(),
             lambda i: str(self._list_widget.item(i).text()),
             varname)
         self._list_widget.insertItem(pos, varname)
 
-    def variable_removed(self, controller, varname, renamed_to=None):
+    def _take_items(self, varnames):
+        varnames = set(varnames)
+        for i in xrange(self._list_widget.count() - 1, -1, -1):
+            if str(self._list_widget.item(i).text()) in varnames:
+                self._list_widget.takeItem(i)
+
+    def variables_removed(self, controller, varnames):
         if controller != self._vistraildata.controller:
             return
-        for i in xrange(self._list_widget.count()):
-            if self._list_widget.item(i).text() == varname:
-                self._list_widget.takeItem(i)
-                break
+        self._list_widget.setUpdatesEnabled(False)
+        try:
+            self._take_items(varnames)
+        finally:
+            self._list_widget.setUpdatesEnabled(True)
+
+    def variables_renamed(self, controller, renamed):
+        if controller != self._vistraildata.controller:
+            return
+        self._list_widget.setUpdatesEnabled(False)
+        try:
+            self._take_items(renamed.iterkeys())
+            for varname in renamed.itervalues():
+                self._insert_item(varname)
+        finally:
+            self._list_widget.setUpdatesEnabled(True)
+
+    def variable_redefined(self, controller, varname):
+        if controller != self._vistraildata.controller:
+            return
+        # The selected variable's information changed, show the new one
+        current = self._list_widget.currentItem()
+        if current is not None and str(current.text()) == varname:
+            self.variableSelected.emit(
+                self._vistraildata.get_variable(varname))
@@ -114,9 +114,18 @@ class MainWindow(QtGui.QMainWindow):
         self.tabifyDockWidget(self._variables_dock, prov_dock)
         self._variables_dock.raise_()
 
+        # Progress of the loading of projects
+        self._loading_progress = QtGui.QProgressBar()
+        self._loading_progress.setFormat(_("Loading project... %p%"))
+        self._loading_progress.setVisible(False)
+        self.statusBar().addPermanentWidget(self._loading_progress)
+
         get_vistrails_application().register_notification(
             'dat_controller_changed',
             self._controller_changed)
+        get_vistrails_application().register_notification(
+            'dat_loading_progress',
+            self._loading_progress_changed)
 
     def _controller_changed(self, controller, new=False):
         self._variables.unregister_notifications()
@@ -131,6 +140,14 @@ class MainWindow(QtGui.QMainWindow):
         self._operations.setEnabled(is_dat_controller)
         self._plots.setEnabled(is_dat_controller)
 
+    def _loading_progress_changed(self, controller, done, total):
+        if done < total:
+            self._loading_progress.setRange(0, total)
+            self._loading_progress.setValue(done)
+            self._loading_progress.setVisible(True)
+        else:
+            self._loading_progress.setVisible(False)
+
     def newFile(self):
         builderWindow = get_vistrails_application().builderWindow
         with VistrailManager.defer_controller_change():
@@ -149,15 +166,22 @@ class MainWindow(QtGui.QMainWindow):
                     view.get_controller(),
                     register=True)
 
+    def _migrate_annotations(self, controller):
+        vistraildata = VistrailManager(controller)
+        if vistraildata is not None:
+            vistraildata.migrate_annotations()
+
     def saveFile(self):
         from vistrails.core.db.locator import DBLocator, FileLocator
         bw = get_vistrails_application().builderWindow
+        self._migrate_annotations(bw.get_current_view().controller)
         bw.get_current_view().save_vistrail(
             bw.dbDefault and DBLocator or FileLocator())
 
     def saveAsFile(self):
         from vistrails.core.db.locator import DBLocator, FileLocator
         bw = get_vistrails_application().builderWindow
+        self._migrate_annotations(bw.get_current_view().controller)
         bw.get_current_view().save_vistrail_as(
             bw.dbDefault and DBLocator or FileLocator())
 
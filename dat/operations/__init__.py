@@ -15,9 +15,14 @@ def is_operator(op_name):
     return op_name in iter('+-*/')
 
 
-from dat.operations.execution import perform_operation, apply_operation
-from dat.operations.typecasting import get_typecast_operations
+from dat.operations.execution import perform_operation, \
+    perform_operations, redefine_variable, apply_operation
+from dat.operations.preview import preview_expression  # noqa: E402
+from dat.operations.typecasting import get_typecast_operations, \
+    get_typecast_chain
 
 
 __all__ = ['InvalidOperation', 'OperationWarning',
-           'perform_operation', 'apply_operation', 'get_typecast_operations']
+           'perform_operation', 'perform_operations', 'redefine_variable',
+           'apply_operation', 'preview_expression', 'get_typecast_operations',
+           'get_typecast_chain']
@@ -1,3 +1,7 @@
+import operator
+import urllib2
+
+from dat.operations.parsing import format_slice, make_slice
 from dat.packages import Variable, VariableOperation, OperationArgument
 from dat.vistrails_interface.utils import resolve_descriptor
 
@@ -8,6 +12,14 @@ Float_desc = resolve_descriptor(Float)
 String_desc = resolve_descriptor(String)
 
 
+_operators = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+}
+
+
 def float_op(op):
     def cb(op1, op2):
         new_var = Variable(type=Float_desc)
@@ -26,7 +38,9 @@ def float_op(op):
             OperationArgument('op1', Float_desc),
             OperationArgument('op2', Float_desc),
         ],
-        return_type=Float_desc)
+        return_type=Float_desc,
+        evaluate=lambda op1, op2: _operators[op](op1, op2),
+        pure=True)
 
 
 builtin_operations = {
@@ -35,3 +49,107 @@ builtin_operations = {
     '*': [float_op('*')],
     '/': [float_op('/')],
 }
+
+
+def is_arithmetic(op):
+    """Indicates whether an operation is one of the builtin operators.
+    """
+    return op in builtin_operations.get(op.name, ())
+
+
+###############################################################################
+# Fused arithmetic
+#
+# A formula is a tree of tuples, which can be:
+#   ('input', N), the Nth input of the formula
+#   ('constant', value), a number
+#   ('op', symbol, left, right), a binary operator, symbol being one of the
+#       keys of builtin_operations
+#
+
+def evaluate_formula(formula, values):
+    """Evaluates a formula, given the values of its inputs.
+
+    The inputs are Floats, as are the ports of the module built by
+    fused_arithmetic_op().
+    """
+    if formula[0] == 'input':
+        return values[formula[1]]
+    elif formula[0] == 'constant':
+        return formula[1]
+    else:  # formula[0] == 'op':
+        return _operators[formula[1]](evaluate_formula(formula[2], values),
+                                      evaluate_formula(formula[3], values))
+
+
+def formula_source(formula):
+    """Gets the Python expression for a formula.
+
+    The inputs are named 'x0', 'x1', ...
+    """
+    if formula[0] == 'input':
+        return 'x%d' % formula[1]
+    elif formula[0] == 'constant':
+        return repr(float(formula[1]))
+    else:  # formula[0] == 'op':
+        return '(%s %s %s)' % (formula_source(formula[2]),
+                               formula[1],
+                               formula_source(formula[3]))
+
+
+def fused_arithmetic_op(formula, nb_inputs):
+    """Makes an operation computing a whole formula in a single module.
+
+    Instead of a PythonCalc module for each operator, a single PythonSource
+    module evaluates the formula, with an input port for each of its inputs.
+    """
+    code = ('from __future__ import division\n'
+            'value = %s\n' % formula_source(formula))
+
+    def cb(**kwargs):
+        new_var = Variable(type=Float_desc)
+        source = new_var.add_module(
+            'org.vistrails.vistrails.basic:PythonSource')
+        source.add_function('source', String_desc, urllib2.quote(code))
+        for i in xrange(nb_inputs):
+            source.add_port('input', 'x%d' % i, Float_desc)
+            kwargs['x%d' % i].connect_to(source, 'x%d' % i)
+        source.add_port('output', 'value', Float_desc)
+        new_var.select_output_port(source, 'value')
+        return new_var
+
+    return VariableOperation(
+        'arithmetic',
+        callback=cb,
+        args=[OperationArgument('x%d' % i, Float_desc)
+              for i in xrange(nb_inputs)],
+        return_type=Float_desc)
+
+
+def slice_op(items, type_desc):
+    """Makes an operation indexing or slicing a value.
+
+    items are those of an INDEX node of the parser. A PythonSource module
+    applies the subscript, so this works with lists, tuples and NumPy arrays.
+    The result is declared to have the same type as the operand.
+    """
+    text = format_slice(items)
+    code = 'value = array[%s]\n' % text
+
+    def cb(array):
+        new_var = Variable(type=type_desc)
+        source = new_var.add_module(
+            'org.vistrails.vistrails.basic:PythonSource')
+        source.add_function('source', String_desc, urllib2.quote(code))
+        source.add_port('input', 'array', type_desc)
+        array.connect_to(source, 'array')
+        source.add_port('output', 'value', type_desc)
+        new_var.select_output_port(source, 'value')
+        return new_var
+
+    return VariableOperation(
+        '[%s]' % text,
+        callback=cb,
+        args=[OperationArgument('array', type_desc)],
+        return_type=type_desc,
+        evaluate=lambda array: array[make_slice(items)])
@@ -1,36 +1,124 @@
+from itertools import izip
+import re
 import sys
 import warnings
 
-from dat import data_provenance
+from dat import data_provenance, variable_format_other_chars, \
+    RecipeParameterValue, DATRecipe
 from dat.global_data import GlobalManager
 from dat.operations import InvalidOperation, OperationWarning
-from dat.operations.parsing import SYMBOL, NUMBER, STRING, OP, parse_expression
+from dat.operations.parsing import SYMBOL, NUMBER, STRING, OP, INDEX, \
+    parse_expression, format_slice, parse_cache_info, is_variable_name
+from dat.utils import LRUCache
 from dat.vistrail_data import VistrailManager
 from dat import vistrails_interface
 from dat.vistrails_interface import Variable, PipelineGenerator
 
 from vistrails.core.modules.module_registry import get_module_registry
-from vistrails.core.modules.vistrails_module import Module
 
 
 class ComputeVariable(object):
-    def execute(self, controller):
+    """A node of a resolved expression.
+
+    After common subexpression elimination, a node can be shared by several
+    parents; execute() then only builds it once, so that the pipeline of the
+    new variable only contains it once.
+    """
+    def execute(self, controller, memo=None, bindings=None):
+        """Builds the Variable for this node.
+
+        memo maps the nodes that were already built to their Variable.
+
+        bindings maps variable names to the names of the variables to use in
+        their place, see perform_broadcast().
+        """
+        if memo is None:
+            memo = dict()
+        if bindings is None:
+            bindings = dict()
+        try:
+            return memo[self]
+        except KeyError:
+            result = memo[self] = self._execute(controller, memo, bindings)
+            return result
+
+    def _execute(self, controller, memo, bindings):
+        raise NotImplementedError
+
+    def key(self):
+        """Structural key of this node.
+
+        Two nodes with the same key compute the same thing.
+        """
+        raise NotImplementedError
+
+    def inputs(self):
+        """The nodes this node is computed from.
+        """
+        return []
+
+    def variables(self):
+        """The names of the existing variables this node uses.
+        """
+        names = set()
+        for node in self.inputs():
+            names.update(node.variables())
+        return names
+
+    def provenance(self, vistraildata):
+        """Builds the provenance of this node without executing it.
+
+        This is what the Variable built by execute() records; it is used for
+        lazy variables, whose pipeline doesn't exist yet.
+        """
         raise NotImplementedError
 
 
 class GetExistingVariable(ComputeVariable):
     def __init__(self, vistraildata, varname):
-        self._variable = vistraildata.get_variable(varname)
-        if self._variable is None:
+        variable = vistraildata.get_variable(varname)
+        if variable is None:
             raise InvalidOperation("Unknown variable %r" % varname)
-        self.type = self._variable.type
+        # We only keep the name, the variable is looked up on execution, so
+        # that this tree can be cached and reused
+        self.name = varname
+        self.type = variable.type
+
+    def key(self):
+        return 'variable', self.name
+
+    def _execute(self, controller, memo, bindings):
+        name = bindings.get(self.name, self.name)
+        variable = VistrailManager(controller).get_variable(name)
+        if variable is None:
+            raise InvalidOperation("Unknown variable %r" % name)
+        return _reference_variable(variable)
+
+    def variables(self):
+        return set([self.name])
+
+    def provenance(self, vistraildata):
+        variable = vistraildata.get_variable(self.name)
+        if variable.materialized:
+            return data_provenance.Variable(variable=variable)
+        else:
+            # Lazy variable: it has no version to reference yet
+            return variable.provenance
+
+
+def _reference_variable(variable_info):
+    """Reads back an existing variable to use it in a new one.
 
-    def execute(self, controller):
-        # Here we explicitely don't record that the Variable is already
-        # materialized in the workflow, because we allow the user to copy
-        # variables (i.e. enter an expression without any operation)
-        return Variable.from_workflow(self._variable,
+    Here we explicitely don't record that the Variable is already materialized
+    in the workflow, because we allow the user to copy variables (i.e. enter
+    an expression without any operation). Its provenance is a reference to
+    the existing variable instead, so that the variables derived from it can
+    be found (see redefine_variable()).
+    """
+    variable = Variable.from_workflow(variable_info,
                                       record_materialized=False)
+    variable.provenance = data_provenance.Variable(variable=variable_info)
+    return variable
 
 
 class BuildConstant(ComputeVariable):
@@ -45,7 +133,10 @@ class BuildConstant(ComputeVariable):
                 'org.vistrails.vistrails.basic',
                 'Float')
 
-    def execute(self, controller):
+    def key(self):
+        return 'constant', type(self.value), self.value
+
+    def _execute(self, controller, memo, bindings):
         generator = PipelineGenerator(controller)
         module = generator.controller.create_module_from_descriptor(self.type)
         generator.add_module(module)
@@ -57,6 +148,9 @@ class BuildConstant(ComputeVariable):
             output=(module, 'value'),
             provenance=data_provenance.Constant(constant=self.value))
 
+    def provenance(self, vistraildata):
+        return data_provenance.Constant(constant=self.value)
+
 
 class ApplyOperation(ComputeVariable):
     def __init__(self, name, args):
@@ -64,12 +158,233 @@ class ApplyOperation(ComputeVariable):
         self.type = self._op.return_type
         self._args = args
 
-    def execute(self, controller):
+    def key(self):
+        # The arguments are compared by identity, so this only detects
+        # identical subtrees once their arguments have been shared (see
+        # eliminate_common_subexpressions())
+        return 'operation', self._op, tuple(id(arg) for arg in self._args)
+
+    def _execute(self, controller, memo, bindings):
         """Recursively perform operations.
         """
-        args = [arg.execute(controller) for arg in self._args]
+        args = [arg.execute(controller, memo, bindings)
+                for arg in self._args]
         return apply_operation(controller, self._op, args)
 
+    def inputs(self):
+        return list(self._args)
+
+    def provenance(self, vistraildata):
+        args = dict()
+        if self._op.usable_in_command:
+            for param, arg in izip(self._op.parameters, self._args):
+                args[param.name] = arg.provenance(vistraildata)
+        return data_provenance.Operation(_json=dict(
+            pkg_id=self._op.package_identifier,
+            name=self._op.name,
+            args=args))
+
+
+class SliceVariable(ComputeVariable):
+    """Indexing or slicing of a variable, as in 'A[1000:5000, ::4]'.
+
+    The result has the same type as the sliced variable. If the variable was
+    loaded by a module that accepts a slice (see
+    Variable#select_slice_port()), the slice is given to that module, so
+    that only the requested region gets read; else a generic module slicing
+    the value is added to the pipeline.
+    """
+    def __init__(self, base, items):
+        self._base = base
+        self.items = items
+        self.type = base.type
+
+    def key(self):
+        return 'slice', id(self._base), self.items
+
+    def _execute(self, controller, memo, bindings):
+        from dat.operations.builtins import slice_op
+
+        if isinstance(self._base, GetExistingVariable):
+            # Get our own copy of the variable's pipeline, which we can
+            # change without affecting other uses of the variable
+            variable = self._base._execute(controller, memo, bindings)
+            if variable.push_down_slice(format_slice(self.items)):
+                variable.provenance = data_provenance.Operation(_json=dict(
+                    pkg_id=None,
+                    name='[%s]' % format_slice(self.items),
+                    args={'array': variable.provenance}))
+                return variable
+        return apply_operation(
+            controller,
+            slice_op(self.items, self.type),
+            [self._base.execute(controller, memo, bindings)])
+
+    def inputs(self):
+        return [self._base]
+
+    def provenance(self, vistraildata):
+        return data_provenance.Operation(_json=dict(
+            pkg_id=None,
+            name='[%s]' % format_slice(self.items),
+            args={'array': self._base.provenance(vistraildata)}))
+
+
+def _share_subtrees(node, nodes):
+    if isinstance(node, ApplyOperation):
+        node._args = [_share_subtrees(arg, nodes) for arg in node._args]
+    elif isinstance(node, SliceVariable):
+        node._base = _share_subtrees(node._base, nodes)
+    return nodes.setdefault(node.key(), node)
+
+
+def eliminate_common_subexpressions(op_tree):
+    """Makes identical subtrees of a resolved expression the same object.
+
+    In 'C = (A + 2) * (A + 2)', the two 'A + 2' become a single node, that
+    will be built once and connected to both ports of the multiplication.
+
+    The tree is modified in place; the new root is returned.
+    """
+    return _share_subtrees(op_tree, dict())
+
+
+class FusedArithmetic(ComputeVariable):
+    """Several builtin arithmetic operations computed by a single module.
+
+    This replaces a tree of ApplyOperation nodes for +, -, * and /, see
+    fuse_arithmetic().
+    """
+    def __init__(self, formula, inputs):
+        from dat.operations.builtins import Float_desc
+
+        self.formula = formula
+        self._inputs = inputs
+        self.type = Float_desc
+
+    def key(self):
+        return ('arithmetic', self.formula,
+                tuple(id(node) for node in self._inputs))
+
+    def _execute(self, controller, memo, bindings):
+        from dat.operations.builtins import fused_arithmetic_op
+
+        args = [node.execute(controller, memo, bindings)
+                for node in self._inputs]
+        result = apply_operation(
+            controller,
+            fused_arithmetic_op(self.formula, len(args)),
+            args)
+        # Record the provenance of the original operations, not of the fused
+        # one
+        result.provenance = _formula_provenance(
+            self.formula,
+            [variable.provenance if variable.materialized_info is None
+             else data_provenance.Variable(
+                 variable=variable.materialized_info)
+             for variable in args])
+        return result
+
+    def inputs(self):
+        return list(self._inputs)
+
+    def provenance(self, vistraildata):
+        return _formula_provenance(
+            self.formula,
+            [node.provenance(vistraildata) for node in self._inputs])
+
+
+def _formula_provenance(formula, inputs):
+    """Builds the provenance of a formula from the one of its inputs.
+    """
+    from dat.operations.builtins import builtin_operations
+
+    if formula[0] == 'input':
+        return inputs[formula[1]]
+    elif formula[0] == 'constant':
+        return data_provenance.Constant(constant=formula[1])
+    else:  # formula[0] == 'op':
+        op = builtin_operations[formula[1]][0]
+        return data_provenance.Operation(_json=dict(
+            pkg_id=op.package_identifier,
+            name=op.name,
+            args={param.name: _formula_provenance(sub, inputs)
+                  for param, sub in izip(op.parameters, formula[2:])}))
+
+
+class _ArithmeticFuser(object):
+    def __init__(self, op_tree):
+        self._refcounts = dict()  # ComputeVariable -> int
+        self._count(op_tree)
+        self._fused = dict()  # ComputeVariable -> ComputeVariable
+
+    def _count(self, node):
+        self._refcounts[node] = self._refcounts.get(node, 0) + 1
+        if self._refcounts[node] == 1:
+            if isinstance(node, ApplyOperation):
+                for arg in node._args:
+                    self._count(arg)
+            elif isinstance(node, SliceVariable):
+                self._count(node._base)
+
+    def fuse(self, node):
+        from dat.operations.builtins import is_arithmetic
+
+        try:
+            return self._fused[node]
+        except KeyError:
+            pass
+
+        replacement = node
+        if isinstance(node, ApplyOperation):
+            inputs = []
+            nb_ops = [0]
+            if is_arithmetic(node._op):
+                formula = self._build_formula(node, True, inputs, nb_ops)
+            if nb_ops[0] >= 2:
+                replacement = FusedArithmetic(formula, inputs)
+            else:
+                node._args = [self.fuse(arg) for arg in node._args]
+        elif isinstance(node, SliceVariable):
+            node._base = self.fuse(node._base)
+        self._fused[node] = replacement
+        return replacement
+
+    def _build_formula(self, node, root, inputs, nb_ops):
+        from dat.operations.builtins import is_arithmetic
+
+        # Shared nodes are not inlined, they get computed on their own and
+        # are inputs of the formula
+        if (isinstance(node, ApplyOperation) and is_arithmetic(node._op) and
+                (root or self._refcounts[node] == 1)):
+            nb_ops[0] += 1
+            return ('op', node._op.name,
+                    self._build_formula(node._args[0], False, inputs, nb_ops),
+                    self._build_formula(node._args[1], False, inputs, nb_ops))
+        elif (isinstance(node, BuildConstant) and
+                not isinstance(node.value, basestring)):
+            return 'constant', node.value
+        else:
+            node = self.fuse(node)
+            try:
+                i = inputs.index(node)
+            except ValueError:
+                i = len(inputs)
+                inputs.append(node)
+            return 'input', i
+
+
+def fuse_arithmetic(op_tree):
+    """Replaces trees of builtin arithmetic operations with a single node.
+
+    In 'x = a*b + c*d - e/f', the five operators get evaluated by a single
+    module instead of one PythonCalc module per operator. Constants are
+    written directly in the formula.
+
+    The tree is modified in place; the new root is returned.
+    """
+    return _ArithmeticFuser(op_tree).fuse(op_tree)
+
 
 def resolve_symbols(vistraildata, expr):
     if expr[0] == SYMBOL:
@@ -82,21 +397,147 @@ def resolve_symbols(vistraildata, expr):
         # Find the right operation, comparing argument number and types
         name = expr[1]
         args = [resolve_symbols(vistraildata, arg) for arg in expr[2:]]
-        if all(isinstance(arg, BuildConstant) for arg in args):
-            if name == '+':
-                return BuildConstant(args[0].value + args[1].value)
-            elif name == '-':
-                return BuildConstant(args[0].value - args[1].value)
-            elif name == '*':
-                return BuildConstant(args[0].value * args[1].value)
-            elif name == '/':
-                return BuildConstant(args[0].value / args[1].value)
-        return ApplyOperation(name, args)
-
-
-def perform_operation(expression, controller=None):
+        if name == '_':
+            # Unary minus: 0 - arg
+            name, args = '-', [BuildConstant(0.0), args[0]]
+        if (name == '+' and
+                all(isinstance(arg, BuildConstant) and
+                    isinstance(arg.value, basestring)
+                    for arg in args)):
+            # String concatenation
+            return BuildConstant(args[0].value + args[1].value)
+        return fold_constants(ApplyOperation(name, args))
+    elif expr[0] == INDEX:
+        return SliceVariable(resolve_symbols(vistraildata, expr[1]), expr[2])
+
+
+def fold_constants(node):
+    """Computes an operation when all its operands are constants.
+
+    This is only possible for operations declared pure, that have a Python
+    implementation (this includes the builtin arithmetic operators). The
+    node is returned unchanged if it can't be folded; the operation will then
+    be added to the pipeline, and report the error when executed, if any.
+    """
+    op = node._op
+    if (not op.pure or
+            not all(isinstance(arg, BuildConstant) for arg in node._args)):
+        return node
+    try:
+        value = op.evaluate(**dict(
+            (param.name, arg.value)
+            for param, arg in izip(op.parameters, node._args)))
+    except Exception:
+        return node
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        value = float(value)
+    elif not isinstance(value, basestring):
+        return node
+    constant = BuildConstant(value)
+    # The result shouldn't be less specific than what the operation declared,
+    # or other operations might get chosen for it
+    if not issubclass(constant.type.module, op.return_type.module):
+        return node
+    return constant
+
+
+def _referenced_variables(expr, names):
+    if expr[0] == SYMBOL:
+        names.add(expr[1])
+    elif expr[0] == OP:
+        for arg in expr[2:]:
+            _referenced_variables(arg, names)
+    elif expr[0] == INDEX:
+        _referenced_variables(expr[1], names)
+    return names
+
+
+# (expr_tree, ((varname, type), ...)) -> (ComputeVariable, [warning])
+_resolve_cache = LRUCache(maxsize=256)
+_resolve_cache_generation = None
+
+
+def compile_expression(vistraildata, expr):
+    """Cached version of resolve_symbols().
+
+    The resolved tree only depends on the expression and on the types of the
+    variables it references, which are used as the key. The cache is dropped
+    when operations are added or removed.
+    """
+    global _resolve_cache_generation
+    if _resolve_cache_generation != GlobalManager.operations_generation:
+        _resolve_cache.clear()
+        _resolve_cache_generation = GlobalManager.operations_generation
+
+    var_types = []
+    for varname in sorted(_referenced_variables(expr, set())):
+        variable = vistraildata.get_variable(varname)
+        if variable is None:
+            raise InvalidOperation("Unknown variable %r" % varname)
+        var_types.append((varname, variable.type))
+    key = expr, tuple(var_types)
+
+    cached = _resolve_cache.get(key)
+    if cached is not None:
+        op_tree, caught = cached
+    else:
+        # Record the warnings (i.e. ambiguous overloads) so they can be
+        # emitted again each time this tree is used
+        op_tree = None
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always', OperationWarning)
+                op_tree = fuse_arithmetic(eliminate_common_subexpressions(
+                    resolve_symbols(vistraildata, expr)))
+        finally:
+            if op_tree is None:
+                _emit_warnings(caught)
+        _resolve_cache[key] = op_tree, caught
+    _emit_warnings(caught)
+    return op_tree
+
+
+def check_expression(vistraildata, expr_tree):
+    """Type-checks an expression, without building anything.
+
+    Returns the type of the result and the list of the warning messages (i.e.
+    ambiguous overloads). Raises InvalidOperation for unknown variables or
+    operations.
+    """
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', OperationWarning)
+        op_tree = compile_expression(vistraildata, expr_tree)
+    return op_tree.type, [str(warning.message) for warning in caught]
+
+
+def _emit_warnings(caught):
+    for warning in caught:
+        warnings.warn(warning.message, category=warning.category)
+
+
+def cache_info():
+    """Returns the statistics of the expression caches.
+
+    Returns a dict with a CacheInfo for 'parse' (expression string to tree)
+    and 'resolve' (tree and variable types to ComputeVariable).
+    """
+    return {'parse': parse_cache_info(),
+            'resolve': _resolve_cache.info()}
+
+
+def perform_operation(expression, controller=None, lazy=False):
     """Perform a variable operation from the given string.
+
+    If the target name contains a wildcard, this is a broadcast statement,
+    see perform_broadcast().
+
+    If lazy is True, the pipeline of the new variable is only created when it
+    is first used (see VistrailData#new_lazy_variable()).
     """
+    if is_broadcast(expression):
+        perform_broadcast(expression, controller)
+        return
+
     # First, parse the expressions
     target, expr_tree = parse_expression(expression)
 
@@ -106,58 +547,484 @@ def perform_operation(expression, controller=None):
     vistraildata = VistrailManager(controller)
     if vistraildata.get_variable(target) is not None:
         raise InvalidOperation("Target variable %r already exists" % target)
-    op_tree = resolve_symbols(vistraildata, expr_tree)
+    op_tree = compile_expression(vistraildata, expr_tree)
 
     # Build the new variable
-    variable = op_tree.execute(controller)
-    vistraildata.new_variable(target, variable)
-
-
-def _fill_parent_modules_map(mod, parents, level):
-    # Recursively walks the inheritance tree of 'mod', adding it to the map if
-    # Module is a parent
-    # Returns True if Module is a parent, so that the caller can add it to the
-    # map and return True itself
-    top_hit = False
-    for parent in mod.__bases__:
-        if parent == Module:
-            parents[mod] = level
-            return True
+    if lazy:
+        vistraildata.new_lazy_variable(target, op_tree)
+    else:
+        variable = op_tree.execute(controller)
+        vistraildata.new_variable(target, variable)
+
+
+class _PendingVariable(object):
+    """Stands for a variable that a script will create.
+    """
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+
+
+class _ScriptScope(object):
+    """The variables visible from a statement of a script.
+
+    These are the variables of the vistrail, plus the ones created by the
+    statements of the script that come before it.
+    """
+    def __init__(self, vistraildata):
+        self._vistraildata = vistraildata
+        self._pending = dict()
+
+    def add(self, varname, type):
+        self._pending[varname] = _PendingVariable(varname, type)
+
+    def get_variable(self, varname):
+        try:
+            return self._pending[varname]
+        except KeyError:
+            return self._vistraildata.get_variable(varname)
+
+
+def parse_script(script):
+    """Parses a script, i.e. a list of statements, one on each line.
+
+    Empty lines and lines starting with '#' are ignored.
+
+    Returns a list of (lineno, target, expr_tree).
+    """
+    statements = []
+    targets = dict()  # varname -> lineno
+    for lineno, line in enumerate(script.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            target, expr_tree = parse_expression(line)
+        except InvalidOperation, e:
+            raise InvalidOperation("Line %d: %s" % (lineno, e.message))
+        if target in targets:
+            raise InvalidOperation(
+                "Line %d: variable %r is already assigned on line %d" % (
+                    lineno, target, targets[target]))
+        targets[target] = lineno
+        statements.append((lineno, target, expr_tree))
+    return statements
+
+
+def order_statements(statements):
+    """Sorts the statements of a script so that variables are created first.
+
+    A statement can use a variable created anywhere in the script; it will be
+    executed after the statement creating it. The order of the script is
+    kept otherwise.
+    """
+    targets = dict((target, (lineno, target, expr_tree))
+                   for lineno, target, expr_tree in statements)
+    ordered = []
+    done = set()
+    visiting = set()
+
+    def visit(statement):
+        lineno, target, expr_tree = statement
+        if target in done:
+            return
+        if target in visiting:
+            raise InvalidOperation(
+                "Line %d: circular dependency on variable %r" % (
+                    lineno, target))
+        visiting.add(target)
+        for varname in sorted(_referenced_variables(expr_tree, set())):
+            if varname in targets:
+                visit(targets[varname])
+        visiting.discard(target)
+        done.add(target)
+        ordered.append(statement)
+
+    for statement in statements:
+        visit(statement)
+    return ordered
+
+
+def perform_operations(script, controller=None, lazy=False):
+    """Performs all the statements of a script, as a single transaction.
+
+    Every statement is parsed and type-checked before anything is created, and
+    the new variables are only announced once all of them have been built. If
+    a statement fails, the variables created by the previous ones are removed.
+
+    If lazy is True, the variables are created as lazy variables, and only the
+    ones that get used will be added to the vistrail.
+
+    Returns the list of the names of the new variables, in creation order.
+    """
+    statements = order_statements(parse_script(script))
+
+    controller, root_version, output_module_id = (
+        Variable._get_variables_root(controller))
+    vistraildata = VistrailManager(controller)
+
+    # Resolve everything first, using the types of the variables the script
+    # will create for the statements that use them
+    scope = _ScriptScope(vistraildata)
+    compiled = []
+    for lineno, target, expr_tree in statements:
+        if vistraildata.get_variable(target) is not None:
+            raise InvalidOperation(
+                "Line %d: target variable %r already exists" % (
+                    lineno, target))
+        try:
+            op_tree = compile_expression(scope, expr_tree)
+        except InvalidOperation, e:
+            raise InvalidOperation("Line %d: %s" % (lineno, e.message))
+        scope.add(target, op_tree.type)
+        compiled.append((lineno, target, op_tree))
+
+    # Build the new variables
+    with vistraildata.transaction():
+        for lineno, target, op_tree in compiled:
+            if lazy:
+                vistraildata.new_lazy_variable(target, op_tree)
+                continue
+            try:
+                variable = op_tree.execute(controller)
+            except InvalidOperation, e:
+                raise InvalidOperation("Line %d: %s" % (lineno, e.message))
+            vistraildata.new_variable(target, variable)
+
+    return [target for lineno, target, op_tree in compiled]
+
+
+_broadcast_pattern = re.compile(
+    r'"(?:[^\\"]|\\\\|\\")*"|'  # strings are left alone
+    r'(%(c)s+\*%(c)s*|\*%(c)s+)' % {'c': variable_format_other_chars})
+
+
+def is_broadcast(expression):
+    """Indicates whether a statement is a broadcast, see perform_broadcast().
+
+    This is the case if its target contains a wildcard; an expression without
+    a target isn't one.
+    """
+    target, equal, value = expression.partition('=')
+    return bool(equal) and '*' in target
+
+
+def perform_broadcast(expression, controller=None):
+    """Performs an operation on every variable matching a pattern.
+
+    'norm_* = normalize(raw_*)' creates norm_a from raw_a, norm_b from raw_b,
+    and so on. Each '*' in the expression matches part of a variable name;
+    the variables used together are those matched by the same text. In such
+    a statement, a multiplication has to be written with spaces around the
+    operator.
+
+    The expression is only resolved once for each combination of argument
+    types, and the new variables are created in a single transaction.
+
+    Returns the list of the names of the new variables.
+    """
+    equal = expression.find('=')
+    target_pattern = expression[:equal].strip()
+    if target_pattern.count('*') != 1:
+        raise InvalidOperation("The target of a broadcast should contain a "
+                               "single '*'")
+
+    controller, root_version, output_module_id = (
+        Variable._get_variables_root(controller))
+    vistraildata = VistrailManager(controller)
+
+    # Replace the patterns with placeholder names and parse the result
+    placeholders = dict()  # pattern: str -> placeholder: str
+    existing = set(vistraildata.variables)
+
+    def replace(match):
+        pattern = match.group(1)
+        if pattern is None:
+            return match.group(0)
+        if pattern not in placeholders:
+            i = len(placeholders)
+            name = '@glob%d' % i
+            while name in existing:
+                i += 1
+                name = '@glob%d' % i
+            existing.add(name)
+            placeholders[pattern] = name
+        return placeholders[pattern]
+    template = _broadcast_pattern.sub(replace, expression[equal + 1:])
+    if not placeholders:
+        raise InvalidOperation("Broadcast expression contains no pattern")
+    target, expr_tree = parse_expression('@target = ' + template)
+
+    # Match the patterns against the variables: text -> {pattern: varname}
+    stems = None
+    for pattern in placeholders:
+        prefix, suffix = pattern.split('*')
+        matches = dict()
+        for varname in vistraildata.variables:
+            if (len(varname) > len(prefix) + len(suffix) and
+                    varname.startswith(prefix) and varname.endswith(suffix)):
+                matches[varname[len(prefix):len(varname) - len(suffix)]] = (
+                    varname)
+        if stems is None:
+            stems = dict((stem, {pattern: varname})
+                         for stem, varname in matches.iteritems())
         else:
-            if _fill_parent_modules_map(parent, parents, level + 1):
-                parents[mod] = level
-                top_hit = True
-    return top_hit
+            for stem in stems.keys():
+                if stem in matches:
+                    stems[stem][pattern] = matches[stem]
+                else:
+                    del stems[stem]
+    if not stems:
+        raise InvalidOperation("No variables match %s" % ", ".join(
+            sorted(placeholders)))
+
+    # Resolve the expression once for each combination of types
+    patterns = sorted(placeholders)
+    op_trees = dict()  # (type, ...) -> ComputeVariable
+    targets = []
+    for stem in sorted(stems):
+        varname = target_pattern.replace('*', stem)
+        if not is_variable_name(varname):
+            raise InvalidOperation("Invalid target variable name %r" %
+                                   varname)
+        if vistraildata.get_variable(varname) is not None:
+            raise InvalidOperation("Target variable %r already exists" %
+                                   varname)
+
+        signature = tuple(
+            vistraildata.get_variable(stems[stem][pattern]).type
+            for pattern in patterns)
+        if signature not in op_trees:
+            scope = _ScriptScope(vistraildata)
+            for pattern, vartype in izip(patterns, signature):
+                scope.add(placeholders[pattern], vartype)
+            op_trees[signature] = compile_expression(scope, expr_tree)
+        targets.append((varname, stem, op_trees[signature]))
+
+    # Build the new variables, binding the placeholders to the actual ones
+    # through the bindings (see GetExistingVariable)
+    with vistraildata.transaction():
+        for varname, stem, op_tree in targets:
+            bindings = dict()
+            for pattern, placeholder in placeholders.iteritems():
+                bindings[placeholder] = stems[stem][pattern]
+            variable = op_tree.execute(controller, bindings=bindings)
+            vistraildata.new_variable(varname, variable)
+
+    return [varname for varname, stem, op_tree in targets]
 
 
-def parent_modules(mod):
-    """Get the parent Modules of a Module subclass.
+class _CannotRebuild(Exception):
+    pass
 
-    Returns a dict mapping each Module subclass to an int, that goes up from 0
-    (for the given 'mod') to the class that directly inherits Module.
+
+def _references(provenance, versions):
+    """Indicates whether a provenance tree references one of these versions.
+    """
+    if isinstance(provenance, data_provenance.Variable):
+        return provenance['version'] in versions
+    elif isinstance(provenance, data_provenance.Operation):
+        return any(_references(arg, versions)
+                   for arg in provenance['args'].itervalues())
+    return False
+
+
+def _rebuild(vistraildata, provenance, versions):
+    """Builds a Variable again from its provenance.
+
+    versions maps the versions of the redefined variables to their new
+    VariableInformation; the references to these are replaced.
     """
-    parents = dict()
-    _fill_parent_modules_map(mod, parents, 0)
-    return parents
+    from dat.operations.builtins import builtin_operations, slice_op
+
+    controller = vistraildata.controller
+    if isinstance(provenance, data_provenance.Variable):
+        variable = versions.get(provenance['version'])
+        if variable is None:
+            tag = controller.vistrail.get_tag(provenance['version'])
+            if not tag or not tag.startswith('dat-var-'):
+                raise _CannotRebuild
+            variable = vistraildata.get_variable(tag[8:])
+            if variable is None:
+                raise _CannotRebuild
+        try:
+            return _reference_variable(variable)
+        except Exception:
+            raise _CannotRebuild
+    elif isinstance(provenance, data_provenance.Constant):
+        return BuildConstant(provenance['constant']).execute(controller)
+    elif (isinstance(provenance, data_provenance.Operation) and
+            provenance['pkg_id'] is None and
+            provenance['name'].startswith('[')):
+        # Slicing, the name is the slice as it was written
+        items = parse_expression('x = x%s' % provenance['name'])[1][2]
+        variable = _rebuild(vistraildata, provenance['args']['array'],
+                            versions)
+        try:
+            return apply_operation(controller,
+                                   slice_op(items, variable.type),
+                                   [variable])
+        except InvalidOperation:
+            raise _CannotRebuild
+    elif isinstance(provenance, data_provenance.Operation):
+        args = provenance['args']
 
+        def accept(op):
+            return (getattr(op, 'package_identifier', None) ==
+                    provenance['pkg_id'] and
+                    [param.name for param in op.parameters] == names)
 
-def find_operation(name, args):
+        # The order of the parameters is taken from one of the candidates;
+        # the overloads of an operation usually have the same parameter names
+        candidates = (
+            list(GlobalManager.get_operations_by_name(
+                provenance['name']).get(len(args), ())) +
+            builtin_operations.get(provenance['name'], []))
+        for op in candidates:
+            names = [param.name for param in op.parameters]
+            if set(names) == set(args) and accept(op):
+                break
+        else:
+            raise _CannotRebuild
+        # The arguments can have new types, so the overload is chosen again
+        arg_list = [_rebuild(vistraildata, args[name], versions)
+                    for name in names]
+        try:
+            op = find_operation(provenance['name'],
+                                [arg.type for arg in arg_list],
+                                accept)
+            return apply_operation(controller, op, arg_list)
+        except InvalidOperation:
+            raise _CannotRebuild
+    else:  # Loader: we don't know how to run it again
+        raise _CannotRebuild
+
+
+def _automatic_typecast(controller, variable,
+                        source_descriptor, expected_descriptor):
+    """Typecasts a variable without asking the user.
+
+    Used as the typecast function for update_pipeline() when regenerating
+    plots; the shortest sequence of typecast operations is used.
+    """
+    from dat.operations.typecasting import get_typecast_chain
+
+    chain = get_typecast_chain(source_descriptor, expected_descriptor)
+    if not chain:
+        raise vistrails_interface.UpdateError(
+            "Can't typecast %s to %s" % (source_descriptor.name,
+                                         expected_descriptor.name))
+    for operation in chain:
+        variable = apply_operation(controller, operation, [variable])
+    return variable, chain[-1]
+
+
+def redefine_variable(expression, controller=None):
+    """Changes the definition of an existing variable.
+
+    A new version of the variable's pipeline is created from the expression.
+    Then the variables derived from it (found through the references in their
+    data provenance) are built again from their provenance, and the plots
+    that use any of these variables are updated and executed again.
+
+    Returns the list of the names of the variables that were redefined.
+    """
+    target, expr_tree = parse_expression(expression)
+
+    controller, root_version, output_module_id = (
+        Variable._get_variables_root(controller))
+    vistraildata = VistrailManager(controller)
+    if vistraildata.get_variable(target) is None:
+        raise InvalidOperation("Unknown variable %r" % target)
+    if target in _referenced_variables(expr_tree, set()):
+        raise InvalidOperation("Variable %r can't be defined from itself" %
+                               target)
+    op_tree = compile_expression(vistraildata, expr_tree)
+
+    # Build the new version of the variable
+    versions = dict()  # old version: int -> VariableInformation
+    old_version = vistraildata.get_variable(target).get_version()
+    versions[old_version] = vistraildata.redefine_variable(
+        target, op_tree.execute(controller))
+    redefined = [target]
+
+    # Rebuild the derived variables, until there are no more references to
+    # the old versions
+    stale = set()  # variables that can't be rebuilt, warned about once
+    changed = True
+    while changed:
+        changed = False
+        for varname in sorted(vistraildata.variables):
+            variable = vistraildata.get_variable(varname)
+            if (varname in redefined or varname in stale or
+                    not variable.materialized or
+                    not _references(variable.provenance, versions)):
+                continue
+            try:
+                new_variable = _rebuild(vistraildata, variable.provenance,
+                                        versions)
+            except _CannotRebuild:
+                stale.add(varname)
+                warnings.warn("Can't rebuild variable %r from its provenance, "
+                              "it still uses the previous definition" %
+                              varname,
+                              category=OperationWarning)
+                continue
+            old_version = variable.get_version()
+            versions[old_version] = vistraildata.redefine_variable(
+                varname, new_variable)
+            redefined.append(varname)
+            changed = True
+
+    # Update the plots using these variables
+    replaced = dict((variable.name, variable)
+                    for variable in versions.itervalues())
+    for cellInfo, pipeline in list(vistraildata.all_cells):
+        parameters = dict()
+        for port_name, values in pipeline.recipe.parameters.iteritems():
+            parameters[port_name] = [
+                RecipeParameterValue(variable=replaced[value.variable.name])
+                if (value.type == RecipeParameterValue.VARIABLE and
+                    value.variable.name in replaced)
+                else value
+                for value in values]
+        recipe = DATRecipe(pipeline.recipe.plot, parameters)
+        if recipe == pipeline.recipe:
+            continue
+        try:
+            new_pipeline = vistrails_interface.update_pipeline(
+                controller, pipeline, recipe, typecast=_automatic_typecast)
+        except vistrails_interface.UpdateError, e:
+            warnings.warn("Couldn't update a plot using a redefined "
+                          "variable: %s" % e,
+                          category=OperationWarning)
+            continue
+        vistraildata.created_pipeline(cellInfo, new_pipeline)
+        vistrails_interface.try_execute(controller, new_pipeline)
+
+    return redefined
+
+
+def find_operation(name, args, accept=None):
     """Choose the operation with the given name that accepts these arguments.
+
+    If accept is given, only the operations for which it returns True are
+    considered.
     """
     from dat.operations.builtins import builtin_operations
 
     # Initial list of considered operations: correct name
-    operations = set([
-        op
-        for op in GlobalManager.variable_operations
-        if op.name == name and op.usable_in_command])
-    operations.update(builtin_operations.get(name, []))
-    if not operations:
+    by_arity = GlobalManager.get_operations_by_name(name)
+    builtins = builtin_operations.get(name, [])
+    if not by_arity and not builtins:
         raise InvalidOperation("There is no operation %r" % name)
-    operations = set([
-        op
-        for op in operations
-        if len(op.parameters) == len(args)])
+    # Correct number of arguments
+    operations = set(by_arity.get(len(args), ()))
+    operations.update(op
+                      for op in builtins
+                      if len(op.parameters) == len(args))
+    if accept is not None:
+        operations = set(op for op in operations if accept(op))
     if not operations:
         raise InvalidOperation("There is no operation %r with %d arguments" % (
                                name, len(args)))
@@ -167,7 +1034,7 @@ def find_operation(name, args):
         retained_operations = set()
         current_score = sys.maxint
         # All base classes
-        bases = parent_modules(actual.module)
+        bases = GlobalManager.parent_modules(actual.module)
         for op in operations:
             for desc in op.parameters[i].types:
                 expected = desc.module
@@ -1,8 +1,9 @@
 import re
 from tdparser import Lexer, Token, LexerError, Error
+from tdparser.topdown import Parser
 
 from dat import variable_format
-from dat.utils import iswhitespace
+from dat.utils import iswhitespace, LRUCache
 
 from dat.operations import InvalidOperation
 
@@ -11,6 +12,7 @@ SYMBOL = 1
 NUMBER = 2
 STRING = 3
 OP = 4
+INDEX = 5  # (INDEX, expr, items), each item is an int or (start, stop, step)
 
 
 class Symbol(Token):
@@ -131,17 +133,139 @@ class Comma(Token):
     regexp = r','
 
 
+def _slice_bound(expr):
+    if expr[0] != NUMBER or expr[1] != int(expr[1]):
+        raise InvalidOperation("Only integer constants can be used as "
+                               "indices")
+    return int(expr[1])
+
+
+class LeftBracket(Token):
+    regexp = r'\['
+    lbp = 100  # Left binding power: highest, like function calls
+
+    def led(self, left, context):
+        # Indexing or slicing, as in A[1000:5000, ::4]
+        items = []
+        while True:
+            bounds = []
+            while True:
+                if isinstance(context.current_token,
+                              (Colon, Comma, RightBracket)):
+                    bounds.append(None)
+                else:
+                    bounds.append(_slice_bound(context.expression()))
+                if not isinstance(context.current_token, Colon):
+                    break
+                context.consume(expect_class=Colon)
+            if len(bounds) == 1:
+                if bounds[0] is None:
+                    raise InvalidOperation("Missing index")
+                items.append(bounds[0])
+            elif len(bounds) <= 3:
+                items.append(tuple(bounds + [None] * (3 - len(bounds))))
+            else:
+                raise InvalidOperation("Invalid slice")
+            if not isinstance(context.current_token, Comma):
+                break
+            context.consume(expect_class=Comma)
+        context.consume(expect_class=RightBracket)
+        return (INDEX, left, tuple(items))
+
+
+class RightBracket(Token):
+    regexp = r'\]'
+
+
+class Colon(Token):
+    regexp = r':'
+
+
+def format_slice(items):
+    """Formats the items of an INDEX node as they would be written.
+
+    For instance, (0, (1000, 5000, None), (None, None, 4)) gives
+    '0,1000:5000,::4'.
+    """
+    def format_bound(bound):
+        return '' if bound is None else '%d' % bound
+
+    formatted = []
+    for item in items:
+        if isinstance(item, tuple):
+            start, stop, step = item
+            text = '%s:%s' % (format_bound(start), format_bound(stop))
+            if step is not None:
+                text += ':%d' % step
+            formatted.append(text)
+        else:
+            formatted.append('%d' % item)
+    return ','.join(formatted)
+
+
+def make_slice(items):
+    """Makes the Python key corresponding to the items of an INDEX node.
+
+    The result can be used to index a list or a NumPy array.
+    """
+    key = tuple(slice(*item) if isinstance(item, tuple) else item
+                for item in items)
+    if len(key) == 1:
+        return key[0]
+    return key
+
+
 lexer = Lexer()
 lexer.register_tokens(
     Symbol, Number, String,
     Addition, Substraction, Multiplication, Division,
-    LeftParen, RightParen, Comma)
+    LeftParen, RightParen, Comma,
+    LeftBracket, RightBracket, Colon)
 
 
 _variable_format = re.compile('^' + variable_format + '$')
 
 
+# expression: str -> (target: str, expr_tree: tuple)
+# The trees are tuples, so they can be shared safely
+_parse_cache = LRUCache(maxsize=256)
+
+
+def is_variable_name(name):
+    """Indicates whether a string is a valid variable name.
+    """
+    return _variable_format.match(name) is not None
+
+
+def clear_parse_cache():
+    """Empties the cache of parse_expression().
+    """
+    _parse_cache.clear()
+
+
+def parse_cache_info():
+    """Returns the CacheInfo of the cache of parse_expression().
+    """
+    return _parse_cache.info()
+
+
 def parse_expression(expression):
+    """Parses an expression, returning the target name and expression tree.
+
+    The results are cached, so that replaying the same expressions doesn't
+    lex them again.
+    """
+    result = _parse_cache.get(expression)
+    if result is None:
+        result = _parse_cache[expression] = _parse_expression(expression)
+    return result
+
+
+def _split_target(expression):
+    """Finds the target variable name of an expression.
+
+    Returns the target and the position of the '=' sign.
+    """
     equal = expression.find('=')
     if equal == -1:
         raise InvalidOperation("Missing target variable name",
@@ -161,7 +285,12 @@ def parse_expression(expression):
                 raise InvalidOperation("Invalid target variable name",
                                        None,
                                        (0, right))
-        expression = expression[equal + 1:]
+    return target, equal
+
+
+def _parse_expression(expression):
+    target, equal = _split_target(expression)
+    expression = expression[equal + 1:]
     try:
         return target, lexer.parse(expression)
     except LexerError, e:
@@ -171,3 +300,105 @@ def parse_expression(expression):
                                        equal + 1 + len(expression)))
     except Error:
         raise InvalidOperation("Error while parsing expression")
+
+
+class IncrementalParser(object):
+    """Parses the successive versions of an expression being edited.
+
+    The tokens of the previous text are kept along with their positions. When
+    the text changes, lexing starts again a little before the first modified
+    character, and stops as soon as it reaches the start of a token in the
+    unmodified end of the text: since lexing from a position only depends on
+    the text that follows, the remaining tokens are the same, only shifted.
+
+    The expression tree is then built from the token list, which doesn't
+    involve any regular expression; it is only done if the tokens changed.
+    """
+    # Number of characters the token regexps can look past the end of their
+    # match (for instance, '3.' only becomes a Number if a digit follows)
+    _LOOKAHEAD = 2
+
+    def __init__(self):
+        self._text = ''
+        self._tokens = []  # [(start: int, end: int, Token)]
+        self._result = None
+
+    def parse(self, expression):
+        """Parses the new version of the expression.
+
+        Returns (target, expr_tree) like parse_expression(), or raises
+        InvalidOperation.
+        """
+        target, equal = _split_target(expression)
+        text = expression[equal + 1:]
+        try:
+            if text != self._text or self._result is None:
+                tokens = self._relex(text)
+                changed = (self._result is None or
+                           [(type(t), t.text) for s, e, t in tokens] !=
+                           [(type(t), t.text) for s, e, t in self._tokens])
+                self._tokens = tokens
+                self._text = text
+                if changed:
+                    self._result = None
+                    parser = Parser([t for s, e, t in tokens] +
+                                    [lexer.end_token()])
+                    self._result = parser.parse()
+        except LexerError, e:
+            self._result = None
+            raise InvalidOperation("Error while parsing expression",
+                                   None,
+                                   select=(equal + 1 + e.position,
+                                           equal + 1 + len(text)))
+        except Error:
+            raise InvalidOperation("Error while parsing expression")
+        return target, self._result
+
+    def _relex(self, text):
+        old_text, old_tokens = self._text, self._tokens
+
+        # Find the modified region
+        prefix = 0
+        length = min(len(text), len(old_text))
+        while prefix < length and text[prefix] == old_text[prefix]:
+            prefix += 1
+        suffix = 0
+        while (suffix < length - prefix and
+                text[-1 - suffix] == old_text[-1 - suffix]):
+            suffix += 1
+        delta = len(text) - len(old_text)
+
+        # Keep the tokens that can't have been affected
+        keep = 0
+        while (keep < len(old_tokens) and
+                old_tokens[keep][1] + self._LOOKAHEAD <= prefix):
+            keep += 1
+        tokens = old_tokens[:keep]
+        pos = tokens[-1][1] if tokens else 0
+
+        # Tokens of the unmodified suffix: old start -> index
+        resync = dict((start, i)
+                      for i, (start, end, token) in enumerate(old_tokens)
+                      if start >= len(old_text) - suffix)
+
+        while pos < len(text):
+            i = resync.get(pos - delta)
+            if i is not None:
+                tokens.extend((start + delta, end + delta, token)
+                              for start, end, token in old_tokens[i:])
+                break
+            best_class = best_match = None
+            for token_class, match in lexer.tokens.matching_tokens(text, pos):
+                if best_match is None or match.end() > best_match.end():
+                    best_class, best_match = token_class, match
+            if best_class is not None and best_match.end() > pos:
+                tokens.append((pos, best_match.end(),
+                               best_class(best_match.group(0))))
+                pos = best_match.end()
+            elif text[pos] in lexer.blank_chars:
+                pos += 1
+            else:
+                raise LexerError(
+                    "Invalid character %s in %s" % (text[pos], text[pos:]),
+                    position=pos)
+        return tokens
@@ -0,0 +1,106 @@
+"""Evaluation of expressions without building pipelines.
+
+A resolved expression (tree of ComputeVariable) can be evaluated directly
+from the values of the variables it uses: builtin arithmetic, fused or not,
+slicing, and operations that provide an 'evaluate' function are computed in
+Python.
+Only the other operations need their pipeline to be built and executed.
+
+The preview is computed while the user is typing, so it must not change the
+vistrail: lazy variables are not materialized for it, and the current version
+of the controller is restored after building a pipeline.
+"""
+
+from dat.operations import InvalidOperation
+from dat.operations.execution import GetExistingVariable, BuildConstant, \
+    ApplyOperation, FusedArithmetic, SliceVariable, compile_expression
+from dat.operations.parsing import parse_expression, make_slice
+from dat.vistrail_data import VistrailManager
+from dat.vistrails_interface import get_variable_value
+
+
+def _check_materialized(node, vistraildata):
+    """Raises InvalidOperation if a node uses a lazy variable.
+
+    Its value can't be previewed without materializing it.
+    """
+    for varname in sorted(node.variables()):
+        if not vistraildata.get_variable(varname).materialized:
+            raise InvalidOperation("Preview not available: variable %r "
+                                   "wasn't computed yet" % varname)
+
+
+def _execute(node, vistraildata):
+    """Builds the pipeline of a node and executes it.
+
+    The current version of the controller is restored afterwards.
+    """
+    controller = vistraildata.controller
+    if not controller.vistrail.has_tag_str('dat-vars'):
+        raise InvalidOperation("Preview not available")
+    _check_materialized(node, vistraildata)
+    version = controller.current_version
+    try:
+        return get_variable_value(node.execute(controller))
+    finally:
+        controller.change_selected_version(version)
+
+
+def evaluate(node, vistraildata, memo=None):
+    """Computes the value of a node of a resolved expression.
+
+    memo maps the nodes that were already evaluated to their value.
+    """
+    from dat.operations.builtins import evaluate_formula
+
+    if memo is None:
+        memo = dict()
+    try:
+        return memo[node]
+    except KeyError:
+        pass
+
+    if isinstance(node, GetExistingVariable):
+        _check_materialized(node, vistraildata)
+        value = vistraildata.get_variable_value(node.name)
+    elif isinstance(node, BuildConstant):
+        value = node.value
+    elif isinstance(node, FusedArithmetic):
+        value = evaluate_formula(
+            node.formula,
+            [evaluate(arg, vistraildata, memo) for arg in node._inputs])
+    elif isinstance(node, SliceVariable):
+        value = evaluate(node._base, vistraildata, memo)[
+            make_slice(node.items)]
+    elif (isinstance(node, ApplyOperation) and
+            node._op.evaluate is not None):
+        value = node._op.evaluate(**dict(
+            (param.name, evaluate(arg, vistraildata, memo))
+            for param, arg in zip(node._op.parameters, node._args)))
+    else:
+        # No direct implementation: build the pipeline and execute it
+        value = _execute(node, vistraildata)
+    memo[node] = value
+    return value
+
+
+def preview_expression(expression, controller=None):
+    """Computes the value of an expression, without creating a variable.
+
+    The expression can be a full 'target = expr' command, the target is then
+    ignored.
+    """
+    if '=' not in expression:
+        expression = 'preview = ' + expression
+    target, expr_tree = parse_expression(expression)
+
+    vistraildata = VistrailManager(controller)
+    if vistraildata is None:
+        raise InvalidOperation("No current vistrail")
+    op_tree = compile_expression(vistraildata, expr_tree)
+    try:
+        return evaluate(op_tree, vistraildata)
+    except InvalidOperation:
+        raise
+    except (ArithmeticError, IndexError, TypeError, ValueError), e:
+        raise InvalidOperation("Error while evaluating expression: %s" % e)
@@ -1,6 +1,124 @@
 from dat.global_data import GlobalManager
 
 
+class TypecastGraph(object):
+    """The graph of the typecasts between module types.
+
+    Every VariableOperation usable in commands that has a single parameter
+    is an edge of this graph, from each of the types accepted for this
+    parameter to its return type.
+
+    Queries are cached by (source descriptor, expected descriptor); the
+    caches are dropped when an operation is added or removed.
+    """
+    def __init__(self):
+        self._generation = None
+        self._reset()
+
+    def _reset(self):
+        self._generation = GlobalManager.operations_generation
+        self._casts = [
+            operation
+            for operation in GlobalManager.variable_operations
+            if (operation.usable_in_command and
+                len(operation.parameters) == 1)]
+        # Module subclass -> [VariableOperation]
+        self._applicable = dict()
+        # (ModuleDescriptor, ModuleDescriptor) -> [VariableOperation]
+        self._direct = dict()
+        # (ModuleDescriptor, ModuleDescriptor) -> [VariableOperation] or None
+        self._chains = dict()
+
+    def _check_generation(self):
+        if self._generation != GlobalManager.operations_generation:
+            self._reset()
+
+    def _get_applicable(self, module):
+        """Gets the single-parameter operations accepting the given type.
+        """
+        try:
+            return self._applicable[module]
+        except KeyError:
+            operations = self._applicable[module] = [
+                operation
+                for operation in self._casts
+                if any(issubclass(module, desc.module)
+                       for desc in operation.parameters[0].types)]
+            return operations
+
+    def get_operations(self, source_descriptor, expected_descriptor):
+        """Gets the operations typecasting from a type to another in one step.
+        """
+        self._check_generation()
+        key = source_descriptor, expected_descriptor
+        try:
+            return self._direct[key]
+        except KeyError:
+            valid = self._direct[key] = [
+                operation
+                for operation in self._get_applicable(source_descriptor.module)
+                if issubclass(operation.return_type.module,
+                              expected_descriptor.module)]
+            return valid
+
+    def get_chain(self, source_descriptor, expected_descriptor):
+        """Gets a shortest sequence of operations typecasting between types.
+
+        Returns a list of VariableOperation to apply in order, which is empty
+        if no typecast is needed, or None if there is no way to do it.
+        """
+        self._check_generation()
+        key = source_descriptor, expected_descriptor
+        try:
+            return self._chains[key]
+        except KeyError:
+            pass
+
+        expected = expected_descriptor.module
+        source = source_descriptor.module
+
+        # Breadth-first search on the types, from the source type
+        chain = None
+        if issubclass(source, expected):
+            chain = []
+        else:
+            previous = {source: None}  # Module -> (Module, VariableOperation)
+            open_list = [source]
+            while open_list and chain is None:
+                new_open_list = []
+                for module in open_list:
+                    for operation in self._get_applicable(module):
+                        result = operation.return_type.module
+                        if result in previous:
+                            continue
+                        previous[result] = module, operation
+                        if issubclass(result, expected):
+                            # Found it: walk back to the source
+                            chain = []
+                            while previous[result] is not None:
+                                result, operation = previous[result]
+                                chain.append(operation)
+                            chain.reverse()
+                            break
+                        new_open_list.append(result)
+                    if chain is not None:
+                        break
+                open_list = new_open_list
+
+        self._chains[key] = chain
+        return chain
+
+
+_typecast_graph = None
+
+
+def _get_typecast_graph():
+    global _typecast_graph
+    if _typecast_graph is None:
+        _typecast_graph = TypecastGraph()
+    return _typecast_graph
+
+
 def get_typecast_operations(source_descriptor, expected_descriptor):
     """Finds the operations that can typecast from a module type to another.
 
@@ -11,23 +129,24 @@ def get_typecast_operations(source_descriptor, expected_descriptor):
 
     Might return an empty list.
     """
-    valid = []
+    return list(_get_typecast_graph().get_operations(source_descriptor,
+                                                     expected_descriptor))
 
-    for operation in GlobalManager.variable_operations:
-        if not operation.usable_in_command:
-            continue
-        # TODO : propose wizards here?
-        if len(operation.parameters) != 1:
-            continue
 
-        if not any(issubclass(source_descriptor.module, desc.module)
-                   for desc in operation.parameters[0].types):
-            continue
+def get_typecast_chain(source_descriptor, expected_descriptor):
+    """Finds a sequence of operations typecasting a module type to another.
 
-        if not issubclass(operation.return_type.module,
-                          expected_descriptor.module):
-            continue
+    This will find typecasts that need several operations, for example A -> B
+    then B -> C when there is no direct way to turn A into C. The shortest
+    sequence is returned, as a list of VariableOperation that should be
+    applied in order.
 
-        valid.append(operation)
-
-    return valid
+    Returns an empty list if source_descriptor is already compatible with
+    expected_descriptor, and None if no sequence of operations can do the
+    conversion.
+    """
+    chain = _get_typecast_graph().get_chain(source_descriptor,
+                                            expected_descriptor)
+    if chain is None:
+        return None
+    return list(chain)
@@ -111,7 +111,40 @@ overload_custom_4 = VariableOperation(
     return_type=Module)
 
 
-_modules = [ModA, ModB, ModC, ModD, ModE]
+class ModF(Module):
+    pass
+
+
+typecast_a_to_e = VariableOperation(
+    'a_to_e',
+    callback=nop,
+    args=[
+        OperationArgument('op', ModA),
+    ],
+    return_type=ModE)
+
+typecast_e_to_f = VariableOperation(
+    'e_to_f',
+    callback=nop,
+    args=[
+        OperationArgument('op', ModE),
+    ],
+    return_type=ModF)
+
+
+pure_len = VariableOperation(
+    'pure_len',
+    callback=nop,
+    args=[
+        OperationArgument('text', String),
+        OperationArgument('factor', Float),
+    ],
+    return_type=Float,
+    evaluate=lambda text, factor: len(text) * factor,
+    pure=True)
+
+
+_modules = [ModA, ModB, ModC, ModD, ModE, ModF]
 
 
 _variable_operations = [
@@ -124,4 +157,9 @@ _variable_operations = [
     overload_custom_2,
     overload_custom_3,
     overload_custom_4,
+
+    typecast_a_to_e,
+    typecast_e_to_f,
+
+    pure_len,
 ]
@@ -1,4 +1,5 @@
-from dat.packages import Variable, CustomVariableLoader
+from dat.packages import Variable, CustomVariableLoader, \
+    VariableOperation, OperationArgument
 
 import vistrails.core.modules.basic_modules as basic
 import vistrails.packages.pythonCalc.init as pythoncalc
@@ -21,3 +22,25 @@ class MyVariableLoader(CustomVariableLoader):
 
 _variable_loaders = {
     MyVariableLoader: "MyVariableLoader"}
+
+
+def passthrough(type):
+    def callback(value):
+        var = Variable(type=type)
+        mod = var.add_module(type)
+        value.connect_to(mod, 'value')
+        var.select_output_port(mod, 'value')
+        return var
+    return VariableOperation(
+        'passthrough',
+        callback=callback,
+        args=[
+            OperationArgument('value', type),
+        ],
+        return_type=type)
+
+
+_variable_operations = [
+    passthrough(basic.Float),
+    passthrough(basic.String),
+]
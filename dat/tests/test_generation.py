@@ -156,6 +156,62 @@ class Test_generation(unittest.TestCase):
         call = (['Hello, world!'], dict())
         self.assertEqual(result.calls, [call])
 
+    def test_redefine_derived(self):
+        """Tests that redefining a variable rebuilds the ones derived from it.
+        """
+        from dat.operations.execution import perform_operation, \
+            redefine_variable
+
+        controller = self.vt_controller()
+        vistraildata = VistrailManager(controller)
+        loader = Test_generation._loaders.get('MyVariableLoader')
+        vistraildata.new_variable('a', loader.load())
+        perform_operation('b = a', controller)
+        perform_operation('c = a * 2', controller)
+        old_c = vistraildata.get_variable('c').get_version()
+
+        redefined = CallRecorder()
+        self._application.register_notification('dat_redefined_variable',
+                                                redefined)
+        try:
+            self.assertEqual(redefine_variable('a = 3', controller),
+                             ['a', 'b', 'c'])
+        finally:
+            self._application.unregister_notification(
+                'dat_redefined_variable', redefined)
+        self.assertEqual(redefined.calls, [
+            ([controller, 'a'], dict()),
+            ([controller, 'b'], dict()),
+            ([controller, 'c'], dict())])
+        a = vistraildata.get_variable('a')
+        c = vistraildata.get_variable('c')
+        self.assertNotEqual(c.get_version(), old_c)
+        self.assertEqual(
+            controller.vistrail.get_tag(c.get_version()), 'dat-var-c')
+        self.assertEqual(c.provenance['args']['op1']['version'],
+                         a.get_version())
+        self.assertEqual(vistraildata.get_variable_value('b'), 3.0)
+        self.assertEqual(vistraildata.get_variable_value('c'), 6.0)
+
+    def test_redefine_overloaded(self):
+        """Tests rebuilding with the overload matching the new operand type.
+        """
+        from dat.operations.execution import perform_operation, \
+            redefine_variable
+
+        controller = self.vt_controller()
+        vistraildata = VistrailManager(controller)
+        loader = Test_generation._loaders.get('MyVariableLoader')
+        vistraildata.new_variable('a', loader.load())
+        perform_operation('p = passthrough(a)', controller)
+        self.assertIs(vistraildata.get_variable('p').type.module, basic.Float)
+
+        self.assertEqual(redefine_variable('a = "text"', controller),
+                         ['a', 'p'])
+        self.assertIs(vistraildata.get_variable('p').type.module,
+                      basic.String)
+        self.assertEqual(vistraildata.get_variable_value('p'), 'text')
+
 
 class Test_variable_creation(unittest.TestCase):
     def test_var_type(self):
@@ -206,6 +262,24 @@ class Test_variable_creation(unittest.TestCase):
             mod1.connect_outputport_to('value', mod3, 'value')
         self.assertTrue("same Variable" in cm.exception.args[0])
 
+    def test_push_down_slice(self):
+        # The loader is the output module: it gets the slice, once
+        var = Variable(type=basic.String)
+        loader = var.add_module('org.vistrails.vistrails.basic:String')
+        var.select_slice_port(loader, 'value')
+        var.select_output_port(loader, 'value')
+        self.assertTrue(var.push_down_slice('0:10'))
+        self.assertFalse(var.push_down_slice('2:4'))
+
+        # The loader is upstream of another module: no push down
+        var = Variable(type=basic.String)
+        loader = var.add_module('org.vistrails.vistrails.basic:String')
+        var.select_slice_port(loader, 'value')
+        other = var.add_module('org.vistrails.vistrails.basic:String')
+        loader.connect_outputport_to('value', other, 'value')
+        var.select_output_port(other, 'value')
+        self.assertFalse(var.push_down_slice('0:10'))
+
     def test_get_var_type(self):
         locator = XMLFileLocator(os.path.join(
             os.path.dirname(__file__),
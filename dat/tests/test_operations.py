@@ -6,10 +6,17 @@
 import re
 import unittest
 
-from dat.operations.execution import parent_modules, find_operation
+from dat.global_data import GlobalManager
+from dat.operations.execution import find_operation, ApplyOperation, \
+    BuildConstant, GetExistingVariable, FusedArithmetic, \
+    eliminate_common_subexpressions, fuse_arithmetic
 from dat.operations.parsing import InvalidOperation, parse_expression, \
     SYMBOL, NUMBER, STRING, OP, String
+from dat.operations.typecasting import get_typecast_operations, \
+    get_typecast_chain
 import dat.tests
+from dat.tests import FakeObj
+from dat.vistrails_interface.utils import parent_modules
 
 from vistrails.core.modules.module_registry import get_module_registry
 from vistrails.core.packagemanager import get_package_manager
@@ -98,6 +105,117 @@ class Test_operation_parsing(unittest.TestCase):
         self.assertIn("Error while parsing", cm.exception.message)
         self.assertEqual(cm.exception.select, (7, 9))
 
+    def test_parser_slicing(self):
+        """Tests the indexing and slicing syntax.
+        """
+        from dat.operations.parsing import INDEX, format_slice, make_slice
+
+        target, expr = parse_expression('s = A[1000:5000, ::4] * a[-1]')
+        self.assertEqual(target, 's')
+        self.assertEqual(
+            expr,
+            (OP, '*',
+                (INDEX, (SYMBOL, 'A'), ((1000, 5000, None),
+                                        (None, None, 4))),
+                (INDEX, (SYMBOL, 'a'), (-1,))))
+        self.assertEqual(format_slice(expr[2][2]), '1000:5000,::4')
+        self.assertEqual(make_slice(expr[2][2]),
+                         (slice(1000, 5000), slice(None, None, 4)))
+        self.assertEqual(make_slice(expr[3][2]), -1)
+        self.assertEqual(range(10)[make_slice(((2, None, 3),))], [2, 5, 8])
+
+        for expr in ['s = A[]', 's = A[1.5]', 's = A[b]', 's = A[1:2:3:4]']:
+            with self.assertRaises(InvalidOperation):
+                parse_expression(expr)
+
+    def test_parser_cache(self):
+        """Tests that parsed expressions are cached.
+        """
+        from dat.operations.execution import cache_info
+
+        expr = 'cached_var = 2 * (cached_a + 4)'
+        first = parse_expression(expr)
+        hits = cache_info()['parse'].hits
+        self.assertIs(parse_expression(expr), first)
+        self.assertEqual(cache_info()['parse'].hits, hits + 1)
+
+        # Errors are not cached
+        for i in xrange(2):
+            with self.assertRaises(InvalidOperation):
+                parse_expression('cached_var = 3 +')
+
+    def test_incremental_parser(self):
+        """Tests re-parsing an expression as it is being edited.
+        """
+        from dat.operations.parsing import IncrementalParser
+
+        parser = IncrementalParser()
+        for expr in ['x = a + 3',
+                     'x = a + 3.',        # incomplete number
+                     'x = a + 3.5',
+                     'x = a + 3.5 * (b',  # missing parenthesis
+                     'x = a + 3.5 * (bc)',
+                     'x = a + "3 5" * (bc)',
+                     'y = ab+"3 5" * (bc)',
+                     'y = ab+"3 5" * (b c)',
+                     'y = ab+3 5" * (bc)']:
+            try:
+                expected = parse_expression(expr)
+            except InvalidOperation:
+                with self.assertRaises(InvalidOperation):
+                    parser.parse(expr)
+            else:
+                self.assertEqual(parser.parse(expr), expected)
+
+    def test_script(self):
+        """Tests parsing and ordering the statements of a script.
+        """
+        from dat.operations.execution import parse_script, order_statements
+
+        statements = parse_script(
+            '# comment\n'
+            'c = a + b\n'
+            '\n'
+            '  a = 4\n'
+            'b = a * 2\n')
+        self.assertEqual([(lineno, target)
+                          for lineno, target, expr_tree in statements],
+                         [(2, 'c'), (4, 'a'), (5, 'b')])
+        self.assertEqual([target
+                          for lineno, target, expr_tree
+                          in order_statements(statements)],
+                         ['a', 'b', 'c'])
+
+        with self.assertRaises(InvalidOperation) as cm:
+            parse_script('a = 2\nb = 3 +')
+        self.assertTrue(cm.exception.message.startswith('Line 2: '))
+        with self.assertRaises(InvalidOperation):
+            parse_script('a = 2\na = 3')
+        with self.assertRaises(InvalidOperation):
+            order_statements(parse_script('a = b + 1\nb = a + 1'))
+
+    def test_broadcast_patterns(self):
+        """Tests finding the wildcards of a broadcast statement.
+        """
+        from dat.operations.execution import _broadcast_pattern
+
+        def patterns(expr):
+            return [m.group(1)
+                    for m in _broadcast_pattern.finditer(expr)
+                    if m.group(1) is not None]
+
+        self.assertEqual(patterns('normalize(raw_*)'), ['raw_*'])
+        self.assertEqual(patterns('*_x * 2 + y_* - "a*b"'), ['*_x', 'y_*'])
+        self.assertEqual(patterns('a * b'), [])
+
+    def test_is_broadcast(self):
+        from dat.operations.execution import is_broadcast
+
+        self.assertTrue(is_broadcast('norm_* = normalize(raw_*)'))
+        self.assertFalse(is_broadcast('c = a * 2'))
+        # No target: not a broadcast, parse_expression() reports the error
+        self.assertFalse(is_broadcast('a*2'))
+
     def test_invalid_parens(self):
         with self.assertRaises(InvalidOperation):
             parse_expression('new_var = 3 + (5*7')
@@ -139,6 +257,45 @@ class Test_operations(unittest.TestCase):
             parent_modules(pkg.ModC),
             {pkg.ModC: 0, pkg.ModB: 1, pkg.ModA: 2})
 
+    def test_parent_modules_cache(self):
+        import dat.tests.pkg_test_operations.init as pkg
+
+        parents = GlobalManager.parent_modules(pkg.ModC)
+        self.assertEqual(parents, parent_modules(pkg.ModC))
+        self.assertIs(GlobalManager.parent_modules(pkg.ModC), parents)
+
+    def test_operations_index(self):
+        import dat.tests.pkg_test_operations.init as pkg
+
+        self.assertEqual(
+            GlobalManager.get_operations('overload_custom', 2),
+            set([pkg.overload_custom_1, pkg.overload_custom_2,
+                 pkg.overload_custom_3, pkg.overload_custom_4]))
+        self.assertEqual(
+            GlobalManager.get_operations('overload_custom', 1),
+            set())
+        self.assertEqual(
+            GlobalManager.get_operations_by_name('overload_std').keys(),
+            [2])
+
+        GlobalManager._remove_operation(pkg.overload_std_2)
+        try:
+            self.assertEqual(
+                GlobalManager.get_operations('overload_std', 2),
+                set([pkg.overload_std_1, pkg.overload_std_3,
+                     pkg.overload_std_4]))
+        finally:
+            GlobalManager._add_operation(pkg.overload_std_2)
+
+        with GlobalManager.substitute_operations([pkg.overload_std_1]):
+            self.assertEqual(
+                GlobalManager.get_operations('overload_std', 2),
+                set([pkg.overload_std_1]))
+            self.assertFalse(
+                GlobalManager.get_operations_by_name('overload_custom'))
+        self.assertEqual(
+            len(GlobalManager.get_operations('overload_std', 2)), 4)
+
     def test_operation_resolution(self):
         import dat.tests.pkg_test_operations.init as pkg
 
@@ -180,3 +337,193 @@ class Test_operations(unittest.TestCase):
                 'overload_custom',
                 [gd(pkg.ModD), gd(pkg.ModD)]),
             pkg.overload_custom_1)
+
+    def test_typecasts(self):
+        import dat.tests.pkg_test_operations.init as pkg
+
+        reg = get_module_registry()
+        gd = reg.get_descriptor
+
+        self.assertEqual(
+            get_typecast_operations(gd(pkg.ModC), gd(pkg.ModE)),
+            [pkg.typecast_a_to_e])
+        self.assertEqual(
+            get_typecast_operations(gd(pkg.ModC), gd(pkg.ModF)),
+            [])
+
+        self.assertEqual(
+            get_typecast_chain(gd(pkg.ModC), gd(pkg.ModA)),
+            [])
+        self.assertEqual(
+            get_typecast_chain(gd(pkg.ModC), gd(pkg.ModF)),
+            [pkg.typecast_a_to_e, pkg.typecast_e_to_f])
+        self.assertIsNone(
+            get_typecast_chain(gd(pkg.ModF), gd(pkg.ModA)))
+
+    def test_constant_folding(self):
+        """Tests that operations on constants are computed when resolving.
+        """
+        from dat.operations.builtins import Float_desc
+        from dat.operations.execution import resolve_symbols
+
+        vistraildata = FakeObj(
+            get_variable=lambda name: FakeObj(name=name, type=Float_desc))
+
+        def resolve(expr):
+            return resolve_symbols(vistraildata, parse_expression(expr)[1])
+
+        tree = resolve('x = "ab" + "cd"')
+        self.assertIsInstance(tree, BuildConstant)
+        self.assertEqual(tree.value, 'abcd')
+
+        tree = resolve('x = -(2 + 3)')
+        self.assertIsInstance(tree, BuildConstant)
+        self.assertEqual(tree.value, -5.0)
+
+        tree = resolve('x = pure_len("abc", 2) * a')
+        self.assertIsInstance(tree, ApplyOperation)
+        self.assertIsInstance(tree._args[0], BuildConstant)
+        self.assertEqual(tree._args[0].value, 6.0)
+
+        # Negating a variable is a subtraction
+        tree = resolve('x = -a')
+        self.assertIsInstance(tree, ApplyOperation)
+        self.assertEqual(tree._op.name, '-')
+        self.assertEqual(tree._args[0].value, 0.0)
+
+    def test_common_subexpressions(self):
+        def subtree():
+            return ApplyOperation('+', [BuildConstant(2.0),
+                                        BuildConstant(3.0)])
+
+        tree = ApplyOperation('*', [subtree(), subtree()])
+        tree = eliminate_common_subexpressions(tree)
+        left, right = tree._args
+        self.assertIs(left, right)
+        # Different constants are kept apart, identical ones are shared
+        self.assertIsNot(left._args[0], left._args[1])
+        other = eliminate_common_subexpressions(
+            ApplyOperation('-', [BuildConstant(2.0), BuildConstant(2.0)]))
+        self.assertIs(other._args[0], other._args[1])
+
+    def test_preview(self):
+        """Tests evaluating an expression without building pipelines.
+        """
+        from dat.operations.builtins import Float_desc
+        from dat.operations.preview import evaluate
+
+        values = dict(a=3.0, b=5.0)
+        vistraildata = FakeObj(
+            get_variable=lambda name: FakeObj(name=name, type=Float_desc,
+                                              materialized=name in values),
+            get_variable_value=lambda name: values[name])
+        a = GetExistingVariable(vistraildata, 'a')
+        b = GetExistingVariable(vistraildata, 'b')
+
+        # (a + b) / 2
+        tree = ApplyOperation('/', [
+            ApplyOperation('+', [a, b]),
+            BuildConstant(2.0)])
+        self.assertEqual(evaluate(tree, vistraildata), 4.0)
+        # Same, fused
+        self.assertEqual(evaluate(fuse_arithmetic(tree), vistraildata), 4.0)
+
+        # Lazy variables are not computed for a preview
+        lazy = GetExistingVariable(vistraildata, 'lazy')
+        with self.assertRaises(InvalidOperation):
+            evaluate(ApplyOperation('+', [a, lazy]), vistraildata)
+
+    def test_expression_provenance(self):
+        """Tests building the provenance of an expression without running it.
+        """
+        from dat import data_provenance
+        from dat.operations.builtins import Float_desc
+
+        lazy_provenance = data_provenance.Constant(constant=5.0)
+        vistraildata = FakeObj(
+            get_variable=lambda name: FakeObj(
+                name=name, type=Float_desc, materialized=False,
+                provenance=lazy_provenance))
+        b = GetExistingVariable(vistraildata, 'b')
+        tree = ApplyOperation('+', [b, BuildConstant(2.0)])
+        self.assertEqual(tree.variables(), set(['b']))
+
+        provenance = tree.provenance(vistraildata)
+        self.assertEqual(provenance['name'], '+')
+        # A lazy variable has no version yet, its provenance is inlined
+        self.assertIs(provenance['args']['op1'], lazy_provenance)
+        self.assertEqual(provenance['args']['op2']['constant'], 2.0)
+
+    def test_provenance_references(self):
+        """Tests finding the variables a provenance tree references.
+        """
+        from dat import data_provenance
+        from dat.operations.execution import _references
+
+        provenance = data_provenance.Operation(_json=dict(
+            pkg_id='edu.poly.dat.test_operations',
+            name='overload_std',
+            args={
+                'first': data_provenance.Constant(constant=4.0),
+                'second': data_provenance.Operation(_json=dict(
+                    pkg_id='edu.poly.dat.test_operations',
+                    name='nested',
+                    args={'arg': data_provenance.Variable(_json=dict(
+                        version=12))}))}))
+        self.assertTrue(_references(provenance, set([12])))
+        self.assertFalse(_references(provenance, set([11, 13])))
+        self.assertFalse(_references(None, set([12])))
+
+    def test_fuse_arithmetic(self):
+        from dat.operations.builtins import Float_desc, evaluate_formula, \
+            formula_source
+
+        vistraildata = FakeObj(
+            get_variable=lambda name: FakeObj(name=name, type=Float_desc))
+        a = GetExistingVariable(vistraildata, 'a')
+        b = GetExistingVariable(vistraildata, 'b')
+
+        # A single operator is left alone
+        tree = fuse_arithmetic(ApplyOperation('+', [a, b]))
+        self.assertIsInstance(tree, ApplyOperation)
+
+        # a * b + 2 - a
+        tree = ApplyOperation('-', [
+            ApplyOperation('+', [
+                ApplyOperation('*', [a, b]),
+                BuildConstant(2.0)]),
+            a])
+        tree = fuse_arithmetic(tree)
+        self.assertIsInstance(tree, FusedArithmetic)
+        self.assertEqual(tree._inputs, [a, b])
+        self.assertEqual(
+            tree.formula,
+            ('op', '-',
+                ('op', '+',
+                    ('op', '*', ('input', 0), ('input', 1)),
+                    ('constant', 2.0)),
+                ('input', 0)))
+        self.assertEqual(formula_source(tree.formula),
+                         '(((x0 * x1) + 2.0) - x0)')
+        self.assertEqual(evaluate_formula(tree.formula, [3.0, 5.0]), 14.0)
+
+    def test_fuse_shared(self):
+        from dat.operations.builtins import Float_desc
+
+        vistraildata = FakeObj(
+            get_variable=lambda name: FakeObj(name=name, type=Float_desc))
+        a = GetExistingVariable(vistraildata, 'a')
+
+        # (a + 1) * (a + 1) / 3: 'a + 1' is shared, so it is an input
+        shared = ApplyOperation('+', [a, BuildConstant(1.0)])
+        tree = ApplyOperation('/', [
+            ApplyOperation('*', [shared, shared]),
+            BuildConstant(3.0)])
+        tree = fuse_arithmetic(tree)
+        self.assertIsInstance(tree, FusedArithmetic)
+        self.assertEqual(tree._inputs, [shared])
+        self.assertEqual(
+            tree.formula,
+            ('op', '/',
+                ('op', '*', ('input', 0), ('input', 0)),
+                ('constant', 3.0)))
@@ -11,7 +11,7 @@ from PyQt4 import QtCore
 import dat.tests
 from dat.tests import CallRecorder
 from dat.utils import bisect, iswhitespace, catch_warning, \
-    deferrable_via_qt, deferred_result
+    deferrable_via_qt, deferred_result, LRUCache
 
 
 class Test_utils(unittest.TestCase):
@@ -55,6 +55,30 @@ class Test_bisect(unittest.TestCase):
                          10)  # 100 / 9 = 11, 100 / 10 = 10
 
 
+class Test_LRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3
+        # 'b' was the least recently used
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_counters(self):
+        cache = LRUCache(maxsize=5)
+        self.assertIsNone(cache.get('a'))
+        cache['a'] = 1
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.info(), (2, 1, 5, 1))
+        cache.clear()
+        self.assertEqual(cache.info(), (2, 1, 5, 0))
+
+
 class MyWarning(UserWarning):
     pass
 
@@ -3,11 +3,16 @@
 """
 
 
+import os
+import shutil
+import tempfile
 import unittest
+import warnings
 
-from dat import RecipeParameterValue, DATRecipe
+from dat import RecipeParameterValue, DATRecipe, PipelineInformation
 from dat.global_data import GlobalManager
-from dat.tests import FakeObj
+from dat.tests import CallRecorder, FakeObj
+import dat.vistrail_data
 from dat.vistrail_data import VistrailData
 
 
@@ -74,6 +79,14 @@ class Test_annotations(unittest.TestCase):
             ),
         }
 
+    RECIPE = (
+        '{"params":{'
+        '"param1":["v",[["var1",[1,2]],["var2",[5]]]],'
+        '"param2":["c",[["test\'\\";b=c,r\\u00e9mi",[4]]]],'
+        '"param3":["v",[["var3",[3]]]]},'
+        '"plot":["tests.dat.vistrail_data","My Plot"],'
+        '"v":2}')
+
     def test_build_recipe(self):
         """Tests the _build_recipe_annotation() method.
         """
@@ -81,14 +94,7 @@ class Test_annotations(unittest.TestCase):
             VistrailData._build_recipe_annotation(
                 self.recipe,
                 self.conn_map),
-            'tests.dat.vistrail_data,My Plot'
-            ';param1=v='
-            'var1:1,2|'
-            'var2:5'
-            ';param2=c='
-            'test%27%22%3Bb%3Dc%2Cr%C3%A9mi:4'
-            ';param3=v='
-            'var3:3')
+            self.RECIPE)
 
     def test_read_recipe(self):
         """Tests the _read_annotation() method.
@@ -96,6 +102,33 @@ class Test_annotations(unittest.TestCase):
         # Patch GlobalManager
         old_get_plot = GlobalManager.get_plot
 
+        def get_plot(pkg_id, name):
+            if name != 'My Plot' or pkg_id != 'tests.dat.vistrail_data':
+                self.fail()
+            return self.plot
+
+        GlobalManager.get_plot = get_plot
+        try:
+            self.assertEqual(
+                VistrailData._read_recipe_annotation(
+                    self.vistraildata,
+                    self.RECIPE),
+                (self.recipe, self.conn_map))
+            self.assertEqual(
+                VistrailData._read_recipe_annotation(
+                    self.vistraildata,
+                    self.RECIPE.replace('"v":2', '"v":3')),
+                (None, None))
+        finally:
+            # Restore GlobalManager
+            GlobalManager.get_plot = old_get_plot
+
+    def test_read_recipe_v1(self):
+        """Tests reading a recipe in the old format.
+        """
+        # Patch GlobalManager
+        old_get_plot = GlobalManager.get_plot
+
         def get_plot(pkg_id, name):
             if name != 'My Plot' or pkg_id != 'tests.dat.vistrail_data':
                 self.fail()
@@ -119,13 +152,385 @@ class Test_annotations(unittest.TestCase):
             # Restore GlobalManager
             GlobalManager.get_plot = old_get_plot
 
+    def test_recipe_variables(self):
+        """Tests the _recipe_variables() method, used for the reverse index.
+        """
+        self.assertEqual(
+            VistrailData._recipe_variables(self.recipe),
+            set(['var1', 'var2', 'var3']))
+
     def test_build_portmap(self):
         """Tests the _build_portmap_annotation() method.
         """
         self.assertEqual(
             VistrailData._build_portmap_annotation(
                 self.port_map),
-            'param1='
-            '1,port1:2,port2'
-            ';param3='
-            '3,port3')
+            '{"ports":{'
+            '"param1":[[1,"port1"],[2,"port2"]],'
+            '"param3":[[3,"port3"]]},'
+            '"v":2}')
+
+    def test_read_portmap(self):
+        """Tests the _read_portmap_annotation() method, in both formats.
+        """
+        expected = {
+            'param1': [(1, 'port1'), (2, 'port2')],
+            'param3': [(3, 'port3')],
+        }
+        self.assertEqual(
+            VistrailData._read_portmap_annotation(
+                '{"ports":{'
+                '"param1":[[1,"port1"],[2,"port2"]],'
+                '"param3":[[3,"port3"]]},'
+                '"v":2}'),
+            expected)
+        self.assertEqual(
+            VistrailData._read_portmap_annotation(
+                'param1='
+                '1,port1:2,port2'
+                ';param3='
+                '3,port3'),
+            expected)
+
+    def test_cell_annotation(self):
+        """Tests building and reading the cell location annotation.
+        """
+        self.assertEqual(
+            VistrailData._build_cell_annotation(2, 0, 3),
+            '2,0,3')
+        self.assertEqual(
+            VistrailData._read_cell_annotation('2,0,3'),
+            (2, 0, 3))
+        self.assertIsNone(VistrailData._read_cell_annotation('2,0'))
+        self.assertIsNone(VistrailData._read_cell_annotation('a,0,3'))
+
+    def test_infer_steps(self):
+        """Tests carrying a recipe down to a child version.
+        """
+        parentInfo = PipelineInformation(1, self.recipe, self.conn_map,
+                                         self.port_map)
+        module_ids = set([1, 2, 3, 10])
+        connection_ids = set([1, 2, 3, 4, 5])
+
+        # The connection of var2 is deleted, a module is replaced
+        VistrailData._apply_operations(
+            [FakeObj(vtType='delete', what='connection', objectId=5),
+             FakeObj(vtType='change', what='module', oldObjId=10, newObjId=11),
+             FakeObj(vtType='add', what='function', objectId=5)],
+            module_ids, connection_ids)
+        self.assertEqual(module_ids, set([1, 2, 3, 11]))
+        self.assertEqual(connection_ids, set([1, 2, 3, 4]))
+        pipelineInfo = VistrailData._derive_pipelineinfo(
+            parentInfo, 2, module_ids, connection_ids)
+        self.assertEqual(pipelineInfo.version, 2)
+        self.assertEqual(
+            pipelineInfo.recipe.parameters['param1'],
+            (RecipeParameterValue(variable=self.var1),))
+        self.assertEqual(pipelineInfo.conn_map['param1'], ((1, 2),))
+        self.assertEqual(pipelineInfo.port_map, parentInfo.port_map)
+
+        # A plot port's module is deleted
+        VistrailData._apply_operations(
+            [FakeObj(vtType='delete', what='module', objectId=3)],
+            module_ids, connection_ids)
+        self.assertIsNone(VistrailData._derive_pipelineinfo(
+            pipelineInfo, 3, module_ids, connection_ids))
+
+
+class Test_cache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp(prefix='dat_test_')
+        filename = os.path.join(self._tmpdir, 'test.vt.dat-cache')
+
+        annotations = [
+            FakeObj(id=1, action_id=2, key='dat-var-type', value='a:b'),
+            FakeObj(id=2, action_id=3, key='dat-recipe', value='{}')]
+        self.vistrail = FakeObj(
+            actionMap={1: FakeObj(prevId=0), 2: FakeObj(prevId=1),
+                       3: FakeObj(prevId=1)},
+            action_annotations=annotations)
+        self.vistraildata = VistrailData.__new__(VistrailData)
+        self.vistraildata._controller = FakeObj(vistrail=self.vistrail)
+        self.vistraildata._cache_filename = lambda: filename
+        self.vistraildata._variables = {
+            'var1': FakeObj(get_version=lambda: 2, type_known=True,
+                            type=FakeObj(sigstring='a:b'),
+                            structural_hash='abcd', materialized=True),
+            'var2': FakeObj(get_version=lambda: 4, type_known=False,
+                            structural_hash=None, materialized=True),
+            'lazy': FakeObj(get_version=self.fail, type_known=True,
+                            type=FakeObj(sigstring='a:b'),
+                            structural_hash=None, materialized=False)}
+        self.vistraildata._pending_variables = dict()
+        self.vistraildata._spreadsheet_tabs = {1: 'tab'}
+        self.vistraildata._spreadsheet_tabs_rev = {'tab': 1}
+        self.vistraildata._cell_to_version = {
+            FakeObj(tab='tab', row=1, column=0): 3}
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_cache(self):
+        """Tests writing and reading the sidecar cache.
+        """
+        self.assertIsNone(self.vistraildata._read_cache())
+        self.vistraildata.write_cache()
+        cache = self.vistraildata._read_cache()
+        self.assertEqual(
+            sorted(cache['variables']),
+            [('var1', 2, 'a:b', 'abcd'), ('var2', 4, None, None)])
+        self.assertEqual(cache['cells'], {(1, 0, 1): 3})
+
+        # Changing the vistrail invalidates the cache
+        self.vistrail.action_annotations.append(
+            FakeObj(id=3, action_id=3, key='dat-cell', value='1,0,1'))
+        self.assertIsNone(self.vistraildata._read_cache())
+
+    def test_stale_cache(self):
+        """Tests that the cache is only used while the vistrail is unchanged.
+        """
+        self.vistraildata.write_cache()
+        self.assertIsNotNone(self.vistraildata._read_cache())
+
+        # Replacing an annotation appends a new one, with a new id
+        annotations = self.vistrail.action_annotations
+        annotations[:] = [annotations[1], FakeObj(
+            id=3, action_id=2, key='dat-var-type', value='c:d')]
+        self.assertIsNone(self.vistraildata._read_cache())
+        self.vistraildata.write_cache()
+        self.assertIsNotNone(self.vistraildata._read_cache())
+
+        # So does adding an action
+        self.vistrail.actionMap[5] = FakeObj(prevId=3)
+        self.assertIsNone(self.vistraildata._read_cache())
+
+        # A cache in another format is ignored
+        self.vistraildata.write_cache()
+        old_format = VistrailData._CACHE_FORMAT
+        VistrailData._CACHE_FORMAT = old_format + 1
+        try:
+            self.assertIsNone(self.vistraildata._read_cache())
+        finally:
+            VistrailData._CACHE_FORMAT = old_format
+
+
+class Test_loading(unittest.TestCase):
+    def test_load_steps(self):
+        """Tests the steps of the progressive loading.
+        """
+        vistraildata = VistrailData.__new__(VistrailData)
+        vistraildata._pending_variables = {'var1': (2, None)}
+        vistraildata._variables = {'var1': FakeObj(type_known=False)}
+        vistraildata._untyped = []
+        vistraildata._data_provenance = {2: 'prov'}
+        vistraildata._unread_recipes = set([5, 6])
+        vistraildata._version_to_pipeline = dict()
+        vistraildata._annotations = {VistrailData._CELL_KEY: {5: '0,1,1'}}
+        backfills = CallRecorder()
+        vistraildata._schedule_backfill = backfills
+        located = []
+
+        def load_pipeline(version):
+            vistraildata._unread_recipes.discard(version)
+            vistraildata._version_to_pipeline[version] = FakeObj(
+                version=version)
+        vistraildata._load_pipeline = load_pipeline
+        vistraildata._locate_pipeline = lambda p: located.append(p.version)
+
+        self.assertEqual(list(vistraildata._load_steps()),
+                         [(1, 3), (2, 3), (3, 3), (4, 4)])
+        self.assertEqual(vistraildata._pending_variables, {})
+        self.assertEqual(vistraildata._variables['var1'].provenance, 'prov')
+        self.assertEqual(vistraildata._untyped, ['var1'])
+        self.assertEqual(len(backfills.calls), 1)
+        self.assertEqual(vistraildata._unread_recipes, set())
+        # Only the pipeline without a location annotation gets located
+        self.assertEqual(located, [6])
+
+
+class Test_bulk(unittest.TestCase):
+    def setUp(self):
+        class FakeVariable(object):
+            materialized = True
+
+            def __init__(self, name, version):
+                self.name = name
+                self.version = version
+                self.structural_hash = None
+
+            def get_version(self):
+                return self.version
+
+            def rename(self, new_varname):
+                self.name = new_varname
+
+        self.var1 = FakeVariable('var1', 11)
+        self.var2 = FakeVariable('var2', 12)
+        self.var3 = FakeVariable('var3', 13)
+        recipe = DATRecipe(
+            FakeObj(name='My Plot', package_identifier='tests.dat'),
+            {'param1': (RecipeParameterValue(variable=self.var1),
+                        RecipeParameterValue(variable=self.var2))})
+        pipeline = PipelineInformation(
+            20, recipe, {'param1': ((1,), (2,))}, {'param1': ((3, 'p'),)})
+
+        self.prune = CallRecorder()
+        vistraildata = self.vistraildata = VistrailData.__new__(VistrailData)
+        vistraildata._controller = FakeObj(prune_versions=self.prune)
+        vistraildata._variables = dict(var1=self.var1, var2=self.var2,
+                                       var3=self.var3)
+        vistraildata._pending_variables = dict()
+        vistraildata._hash_index = dict()
+        vistraildata._unread_recipes = set()
+        vistraildata._version_to_pipeline = dict()
+        vistraildata._variable_to_versions = dict()
+        vistraildata._version_to_cells = dict()
+        vistraildata._cell_to_version = dict()
+        vistraildata._cell_to_pipeline = dict()
+        vistraildata._transaction = None
+        vistraildata._data_provenance = dict()
+        vistraildata._add_pipeline(pipeline)
+
+        self.annotations = []
+        vistraildata._set_annotation = (
+            lambda version, key, value: self.annotations.append(
+                (version, key, value)))
+
+        self.notifications = CallRecorder()
+        self._old_get_app = dat.vistrail_data.get_vistrails_application
+        dat.vistrail_data.get_vistrails_application = lambda: FakeObj(
+            send_notification=self.notifications)
+
+    def tearDown(self):
+        dat.vistrail_data.get_vistrails_application = self._old_get_app
+
+    def test_remove_variables(self):
+        """Tests removing several variables at once.
+        """
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            self.vistraildata.remove_variables(['var1', 'var3'])
+        self.assertEqual(set(self.vistraildata._variables), set(['var2']))
+        self.assertEqual(len(self.prune.calls), 1)
+        self.assertEqual(sorted(self.prune.calls[0][0][0]), [11, 13])
+        self.assertEqual(self.notifications.calls, [
+            (['dat_removed_variables', self.vistraildata._controller,
+              ['var1', 'var3']], {})])
+        self.assertEqual(self.vistraildata._version_to_pipeline, {})
+        self.assertEqual(self.vistraildata._variable_to_versions, {})
+        self.assertEqual(
+            sorted(key for version, key, value in self.annotations),
+            ['dat-cell', 'dat-ports', 'dat-recipe'])
+
+    def test_rename_variables(self):
+        """Tests renaming several variables at once.
+        """
+        renamed = {'var1': 'new1', 'var2': 'new2'}
+        self.vistraildata.rename_variables(renamed)
+        self.assertEqual(set(self.vistraildata._variables),
+                         set(['new1', 'new2', 'var3']))
+        self.assertEqual(self.var1.name, 'new1')
+        self.assertEqual(self.vistraildata._variable_to_versions,
+                         {'new1': set([20]), 'new2': set([20])})
+        # The recipe is only written once
+        self.assertEqual(len(self.annotations), 1)
+        self.assertEqual(self.annotations[0][:2], (20, 'dat-recipe'))
+        self.assertEqual(self.notifications.calls, [
+            (['dat_renamed_variables', self.vistraildata._controller,
+              renamed], {})])
+
+        self.assertRaises(ValueError, self.vistraildata.rename_variables,
+                          {'new1': 'var3'})
+        self.assertRaises(ValueError, self.vistraildata.rename_variables,
+                          {'new1': 'a', 'new2': 'a'})
+
+    def test_materialize_dependents(self):
+        """Tests that lazy variables are built before their sources change.
+        """
+        materialize = CallRecorder(lambda: 14)
+        self.vistraildata._variables['lazy'] = FakeObj(
+            name='lazy', materialized=False, sources=set(['var1']),
+            structural_hash=None, get_version=materialize,
+            remove=lambda: None)
+
+        self.vistraildata.rename_variables({'var2': 'new2'})
+        self.assertEqual(materialize.calls, [])
+        self.vistraildata.rename_variables({'var1': 'new1'})
+        self.assertEqual(materialize.calls, [([], {})])
+
+        # A lazy variable removed along with its source is left alone
+        materialize.calls = []
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            self.vistraildata.remove_variables(['new1', 'lazy'])
+        self.assertEqual(materialize.calls, [])
+
+    def _new_variable(self, varname, version):
+        materialized = FakeObj(
+            name=varname, materialized=True, provenance=None,
+            structural_hash=varname, type=FakeObj(sigstring='a:b'),
+            get_version=lambda: version, remove=CallRecorder())
+        self.vistraildata.new_variable(
+            varname, FakeObj(materialize=lambda name: materialized))
+        return materialized
+
+    def test_transaction(self):
+        """Tests that notifications are sent when a transaction ends.
+        """
+        with self.vistraildata.transaction():
+            self._new_variable('new1', 21)
+            with self.vistraildata.transaction():
+                self._new_variable('new2', 22)
+            # The nested transaction is merged into this one
+            self.assertEqual(self.notifications.calls, [])
+        self.assertEqual(self.notifications.calls, [
+            (['dat_new_variable', self.vistraildata._controller, 'new1'],
+             {}),
+            (['dat_new_variable', self.vistraildata._controller, 'new2'],
+             {})])
+        self.assertIsNone(self.vistraildata._transaction)
+
+    def test_transaction_rollback(self):
+        """Tests that a failing transaction removes the variables it created.
+        """
+        created = []
+        with self.assertRaises(ValueError):
+            with self.vistraildata.transaction():
+                created.append(self._new_variable('new1', 21))
+                created.append(self._new_variable('new2', 22))
+                raise ValueError
+        self.assertEqual(set(self.vistraildata._variables),
+                         set(['var1', 'var2', 'var3']))
+        for variable in created:
+            self.assertEqual(len(variable.remove.calls), 1)
+        self.assertEqual(self.vistraildata._data_provenance, {})
+        # The annotations set on the new versions were removed
+        self.assertEqual(
+            [(version, key)
+             for version, key, value in self.annotations
+             if value is None],
+            [(22, 'dat-data-provenance'), (22, 'dat-var-hash'),
+             (22, 'dat-var-type'),
+             (21, 'dat-data-provenance'), (21, 'dat-var-hash'),
+             (21, 'dat-var-type')])
+        # Observers never heard about them
+        self.assertEqual(self.notifications.calls, [])
+        self.assertIsNone(self.vistraildata._transaction)
+
+    def test_duplicate_warning(self):
+        """Tests that creating a variable identical to another one warns.
+        """
+        self.vistraildata._hash_index = dict()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            materialized = self._new_variable('new1', 21)
+            self.assertEqual(caught, [])
+            self.vistraildata.new_variable(
+                'new2', FakeObj(materialize=lambda name: FakeObj(
+                    name=name, materialized=True, provenance=None,
+                    structural_hash=materialized.structural_hash,
+                    type=FakeObj(sigstring='a:b'),
+                    get_version=lambda: 22)))
+        self.assertEqual(len(caught), 1)
+        self.assertIn("'new1'", str(caught[0].message))
+        self.assertEqual(self.vistraildata.get_duplicates('new2'), ['new1'])
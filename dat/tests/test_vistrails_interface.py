@@ -131,6 +131,30 @@ class Test_vistrails_interface(unittest.TestCase):
         test_delete([3, 6, 7], [2, 4],
                     depth=2)
 
+    def test_structural_hash(self):
+        """Tests the structural_hash() function.
+        """
+        from dat.vistrails_interface.utils import structural_hash
+
+        controller, modules = self.make_pipeline()
+
+        def h(i):
+            return structural_hash(controller.current_pipeline,
+                                   modules[i].id)
+
+        # Same structure, different module ids
+        self.assertEqual(h(0), h(2))
+        self.assertEqual(h(3), h(4))
+        self.assertEqual(h(10), h(11))
+        self.assertNotEqual(h(3), h(6))
+        self.assertNotEqual(h(3), h(9))
+
+        # Functions are part of the structure
+        controller.update_function(modules[0], 'value', ['test'])
+        self.assertNotEqual(h(0), h(2))
+        self.assertNotEqual(h(3), h(4))
+        self.assertEqual(h(10), h(11))
+
     def test_find_modules_by_type(self):
         """Tests the find_modules_by_type() function.
         """
@@ -168,6 +192,33 @@ class Test_vistrails_interface(unittest.TestCase):
                 [Boolean]),
             [])
 
+    def test_operation_log(self):
+        """Tests sharing operation logs between pipeline generators.
+        """
+        from dat.vistrails_interface.pipelines import OperationLog
+
+        a = OperationLog()
+        a.extend([('change', 1), ('change', 2)])
+        b = OperationLog()
+        b.append(('change', 3))
+        b.append_log(a)
+        a.append(('change', 4))  # not in b's snapshot of a
+        c = OperationLog()
+        c.append_log(a)
+        c.append_log(b)  # shares a with the first reference
+        c.append(('change', 5))
+        self.assertEqual([op[1] for op in b.flatten()], [3, 1, 2])
+        self.assertEqual([op[1] for op in c.flatten()], [1, 2, 4, 3, 5])
+
+        # Deeply nested logs don't hit the recursion limit
+        log = a
+        for i in xrange(5000):
+            new_log = OperationLog()
+            new_log.append_log(log)
+            new_log.append(('change', i + 6))
+            log = new_log
+        self.assertEqual(len(log.flatten()), 5003)
+
     def test_describe_update(self):
         """Tests the describe_dat_update() function.
         """
@@ -228,3 +279,36 @@ class Test_vistrails_interface(unittest.TestCase):
                 ['a'],
                 ['b']),
             "Changed DAT parameters")
+
+    def test_lazy_variable(self):
+        """Tests that lazy variables are only materialized when needed.
+        """
+        from dat.tests import CallRecorder, FakeObj
+        from dat.vistrails_interface import Variable
+
+        controller = FakeObj(
+            vistrail=FakeObj(get_version_number=CallRecorder(lambda t: 42)),
+            prune_versions=CallRecorder())
+        materialize = CallRecorder()
+        variable = Variable.LazyVariableInformation(
+            'lazy_var', controller, None, materialize)
+        self.assertFalse(variable.materialized)
+
+        # Renaming doesn't touch the vistrail
+        variable.rename('other_var')
+        self.assertEqual(variable.name, 'other_var')
+        self.assertEqual(controller.vistrail.get_version_number.calls, [])
+
+        # The pipeline is created the first time it is needed
+        self.assertEqual(variable.get_version(), 42)
+        self.assertEqual(variable.get_version(), 42)
+        self.assertEqual(materialize.calls, [([variable], {})])
+        self.assertTrue(variable.materialized)
+        self.assertEqual(controller.vistrail.get_version_number.calls[0],
+                         (['dat-var-other_var'], {}))
+
+        # Removing an unused variable doesn't touch the vistrail either
+        unused = Variable.LazyVariableInformation(
+            'unused', controller, None, materialize)
+        unused.remove()
+        self.assertEqual(controller.prune_versions.calls, [])
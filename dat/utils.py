@@ -1,3 +1,4 @@
+import collections
 import functools
 from itertools import izip
 import string
@@ -35,6 +36,53 @@ def iswhitespace(s):
     return all(c in _whitespace for c in s)
 
 
+CacheInfo = collections.namedtuple('CacheInfo',
+                                   ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class LRUCache(object):
+    """Mapping that only keeps the most recently used entries.
+
+    get() counts hits and misses, which are reported by info() in the same
+    format as functools.lru_cache's cache_info() in Python 3.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        """Drops all the entries, but not the hit/miss counters.
+        """
+        self._data.clear()
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self._data))
+
+
 class catch_warning(object):
     """Context manager that intercepts a specific category of warnings.
 
@@ -1,5 +1,8 @@
 import contextlib
 import itertools
+import json
+import os
+import time
 import urllib2
 import uuid
 import warnings
@@ -8,10 +11,16 @@ import weakref
 from dat import RecipeParameterValue, DATRecipe, PipelineInformation
 from dat import data_provenance
 from dat.global_data import GlobalManager
+from dat.utils import LRUCache
 from dat.vistrails_interface import Variable, get_pipeline_location, \
-    get_upgraded_pipeline
+    get_variable_value
+from dat.vistrails_interface.utils import resolve_descriptor
+
+from PyQt4 import QtCore
 
 from vistrails.core.application import get_vistrails_application
+from vistrails.core.db.locator import XMLFileLocator, ZIPFileLocator
+from vistrails.core.modules.module_registry import ModuleRegistryException
 from vistrails.core.vistrail.vistrailvariable import VistrailVariable
 from vistrails.core.system import vistrails_default_file_type
 from vistrails.packages.spreadsheet.spreadsheet_cell import CellInformation
@@ -44,8 +53,28 @@ class VistrailData(object):
     #           actionId="PIPELINEVERSION"
     #           key="dat-ports"
     #           value="<portmap>" />
+    #   <actionAnnotation
+    #           actionId="PIPELINEVERSION"
+    #           key="dat-cell"
+    #           value="ROW,COL,SHEET" />
+    #
+    # Where <recipe> is a JSON object (with added whitespace for clarity):
+    #   {"v": 2,
+    #    "plot": ["plot_package", "PlotName"],
+    #    "params": {
+    #        "param1": ["v", [["varname1", [CONN1, CONN2]],
+    #                         ["varname2", [CONN3], "cast_op"]]],
+    #        "param2": ["c", [["value2", [CONN4]]]]}}
     #
-    # Where <recipe> has the format (with added whitespace for clarity):
+    # And <portmap>:
+    #   {"v": 2,
+    #    "ports": {
+    #        "param1": [[ID1, "PORT1"], [ID2, "PORT2"], [ID3, "PORT3"]],
+    #        "param2": [[ID4, "PORT4"]]}}
+    #
+    # "v" is the version of the format. Version 1, written by older versions
+    # of DAT, is still read (files get migrated when saved from DAT). Its
+    # <recipe> has the format (with added whitespace for clarity):
     #   plot_package,PlotName;
     #       param1=v=
     #           varname1:CONN1,CONN2|
@@ -69,47 +98,98 @@ class VistrailData(object):
     #     of the parameters set to this port
     #   * value<N> is the string representation of a constant
     #   * cast_op is the name of the variable operation used for typecasting
+    #   * ROW and COL with the 0-based position of the cell showing the
+    #     pipeline, and SHEET with the id of its sheet (the number in the
+    #     'dat-sheet-<N>' vistrail variable holding the sheet's name)
     #
     # Parameters which are not set are simply omitted from the list
+    _ANNOTATION_FORMAT = 2
+    _CACHE_FORMAT = 2
     _RECIPE_KEY = 'dat-recipe'
     _PORTMAP_KEY = 'dat-ports'
     _DATA_PROVENANCE_KEY = 'dat-data-provenance'
+    _HASH_KEY = 'dat-var-hash'
+    _TYPE_KEY = 'dat-var-type'
+    _CELL_KEY = 'dat-cell'
 
     @staticmethod
     def _build_recipe_annotation(recipe, conn_map):
         """Builds the recipe annotation value from the recipe and conn_map.
         """
-        value = '%s,%s' % (recipe.plot.package_identifier, recipe.plot.name)
-        for param, param_values in sorted(recipe.parameters.iteritems(),
-                                          key=lambda (k, v): k):
+        params = dict()
+        for param, param_values in recipe.parameters.iteritems():
             if not param_values:
                 continue
-            value += ';%s=' % param
             if param_values[0].type == RecipeParameterValue.CONSTANT:
                 if len(param_values) != 1:
                     raise ValueError
-                value += 'c='
+                kind = 'c'
             else:  # param_values[0].type == RecipeParameterValue.VARIABLE:
-                value += 'v='
+                kind = 'v'
 
-            for i, param_val, conn_list in itertools.izip(
-                    itertools.count(), param_values, conn_map[param]):
-                if i != 0:
-                    value += '|'
+            values = []
+            for param_val, conn_list in itertools.izip(param_values,
+                                                       conn_map[param]):
                 if param_val.type == RecipeParameterValue.CONSTANT:
-                    value += urllib2.quote(param_val.constant, safe='')
+                    value = [param_val.constant, list(conn_list)]
                 else:  # param_val.type == RecipeParameterValue.VARIABLE
-                    value += param_val.variable.name
+                    value = [param_val.variable.name, list(conn_list)]
                     if param_val.typecast is not None:
-                        value += ',%s' % param_val.typecast
-                value += ':' + ','.join(
-                    '%d' % conn_id
-                    for conn_id in conn_list)
-        return value
+                        value.append(param_val.typecast)
+                values.append(value)
+            params[param] = [kind, values]
+        return json.dumps(
+            {'v': VistrailData._ANNOTATION_FORMAT,
+             'plot': [recipe.plot.package_identifier, recipe.plot.name],
+             'params': params},
+            sort_keys=True, separators=(',', ':'))
 
     @staticmethod
     def _read_recipe_annotation(vistraildata, value):
         """Reads (recipe, conn_map) from an annotation value.
+
+        Returns (None, None) if the value can't be read.
+        """
+        if not value.startswith('{'):
+            return VistrailData._read_recipe_annotation_v1(vistraildata,
+                                                           value)
+        try:
+            data = json.loads(value)
+            if data['v'] != VistrailData._ANNOTATION_FORMAT:
+                raise ValueError  # Written by a newer version
+            plot = GlobalManager.get_plot(*[str(n) for n in data['plot']])
+            parameters = dict()
+            conn_map = dict()
+            for param, (kind, values) in data['params'].iteritems():
+                plist = []
+                cplist = []
+                for val in values:
+                    if kind == 'c':
+                        constant = val[0]
+                        if isinstance(constant, unicode):
+                            constant = constant.encode('utf-8')
+                        plist.append(RecipeParameterValue(constant=constant))
+                    elif kind == 'v':
+                        variable = vistraildata.get_variable(str(val[0]))
+                        if len(val) == 3:
+                            plist.append(RecipeParameterValue(
+                                variable=variable,
+                                typecast=str(val[2])))
+                        else:
+                            plist.append(RecipeParameterValue(
+                                variable=variable))
+                    else:
+                        raise ValueError
+                    cplist.append(tuple(int(conn_id) for conn_id in val[1]))
+                parameters[str(param)] = tuple(plist)
+                conn_map[str(param)] = tuple(cplist)
+            return DATRecipe(plot, parameters), conn_map
+        except (KeyError, IndexError, ValueError, TypeError):
+            return None, None
+
+    @staticmethod
+    def _read_recipe_annotation_v1(vistraildata, value):
+        """Reads (recipe, conn_map) from an annotation in the old format.
         """
         def read_connlist(connlist):
             return tuple(int(conn_id) for conn_id in connlist.split(','))
@@ -161,22 +241,35 @@ class VistrailData(object):
     def _build_portmap_annotation(port_map):
         """Builds the port_map annotation value.
         """
-        value = []
-
-        for param, port_list in sorted(port_map.iteritems(),
-                                       key=lambda (k, v): k):
-            if not port_list:
-                continue
-
-            value.append('%s=' % param + ':'.join(
-                '%d,%s' % (mod_id, portname)
-                for mod_id, portname in port_list))
-
-        return ';'.join(value)
+        ports = dict((param, [list(port) for port in port_list])
+                     for param, port_list in port_map.iteritems()
+                     if port_list)
+        return json.dumps(
+            {'v': VistrailData._ANNOTATION_FORMAT, 'ports': ports},
+            sort_keys=True, separators=(',', ':'))
 
     @staticmethod
     def _read_portmap_annotation(value):
         """Reads port_map from an annotation value.
+
+        Returns None if the value can't be read.
+        """
+        if not value.startswith('{'):
+            return VistrailData._read_portmap_annotation_v1(value)
+        try:
+            data = json.loads(value)
+            if data['v'] != VistrailData._ANNOTATION_FORMAT:
+                raise ValueError  # Written by a newer version
+            return dict(
+                (str(param), [(int(mod_id), str(port_name))
+                              for mod_id, port_name in port_list])
+                for param, port_list in data['ports'].iteritems())
+        except (KeyError, ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def _read_portmap_annotation_v1(value):
+        """Reads port_map from an annotation in the old format.
         """
         try:
             port_map = dict()
@@ -205,86 +298,384 @@ class VistrailData(object):
         """
         self._controller = controller
         self._spreadsheet_tabs = None  # id: int -> spreadsheet_tab
+        self._spreadsheet_tabs_rev = dict()  # spreadsheet_tab -> id: int
 
         self._variables = dict()
-        self._data_provenance = dict()  # version: int -> provenance
+        # version: int -> provenance, filled from the annotations on demand
+        self._data_provenance = dict()
 
         self._cell_to_version = dict()  # CellInformation -> int
         self._version_to_pipeline = dict()  # int -> PipelineInformation
         # CellInformation -> PipelineInformation
         self._cell_to_pipeline = dict()
 
+        # Reverse index, to find the pipelines and cells using a variable
+        # without going through every recipe
+        self._variable_to_versions = dict()  # varname: str -> set([int])
+        self._version_to_cells = dict()  # int -> set([CellInformation])
+
         self._failed_infer_calls = set()  # [version: int]
 
+        # Variables whose type and provenance haven't been read yet, see
+        # _complete_variable()
+        # varname: str -> (version: int, type: str)
+        self._pending_variables = dict()
+
+        # Variables whose type has to be read from their pipeline
+        self._untyped = []  # [varname: str]
+
+        # Pipelines whose location was read from the annotation, to be checked
+        # against the pipeline in the background
+        self._unverified_cells = []  # [version: int]
+
+        # Names of the variables created in the current transaction, or None
+        self._transaction = None
+
+        # structural hash or version -> value
+        self._value_cache = LRUCache(maxsize=16)
+
+        # Variables with identical pipelines, see structural_hash()
+        self._hash_index = dict()  # hash: str -> set([varname: str])
+
         app = get_vistrails_application()
 
         # dat_new_variable(varname: str)
         app.create_notification('dat_new_variable')
-        # dat_removed_variable(varname: str)
-        app.create_notification('dat_removed_variable')
-
-        annotations = self._controller.vistrail.action_annotations
-
-        # Load variables from tagged versions
-        if self._controller.vistrail.has_tag_str('dat-vars'):
-            # Load all data provenance annotations
-            # Loading from known variables is not enough, we also need deleted
-            # variables to form the complete graph
-            for an in annotations:
-                if an.key == self._DATA_PROVENANCE_KEY:
-                    version = an.action_id
-                    provenance = data_provenance.read_from_annotation(an.value)
-                    self._data_provenance[version] = provenance
-
+        # dat_removed_variables(varnames: [str])
+        app.create_notification('dat_removed_variables')
+        # dat_renamed_variables(renamed: {old_name: str -> new_name: str})
+        app.create_notification('dat_renamed_variables')
+        # dat_redefined_variable(varname: str)
+        app.create_notification('dat_redefined_variable')
+
+        # Index of the DAT annotations, built in a single pass over the
+        # vistrail's annotations: key: str -> {version: int -> value: str}
+        # The values are only parsed when the version is needed
+        self._annotations = dict((key, dict()) for key in (
+            self._RECIPE_KEY, self._PORTMAP_KEY, self._DATA_PROVENANCE_KEY,
+            self._HASH_KEY, self._TYPE_KEY, self._CELL_KEY))
+        for an in self._controller.vistrail.action_annotations:
+            versions = self._annotations.get(an.key)
+            if versions is not None:
+                versions[an.action_id] = an.value
+
+        # Location of the cells: (row, col, sheet_id) -> version: int
+        # Only set when read from the cache, see _get_spreadsheet_tabs()
+        self._cached_cells = None
+
+        # List the variables, from the cache if it is up to date, or from the
+        # tagged versions
+        # [(varname: str, version: int, type: str, hash: str)]
+        cache = self._read_cache()
+        if cache is not None:
+            variables = cache['variables']
+            self._cached_cells = cache['cells']
+        elif self._controller.vistrail.has_tag_str('dat-vars'):
+            hashes = self._annotations[self._HASH_KEY]
+            types = self._annotations[self._TYPE_KEY]
             tagmap = self._controller.vistrail.get_tagMap()
-            for version, tag in tagmap.iteritems():
-                if tag.startswith('dat-var-'):
-                    varname = tag[8:]
-
-                    # Get the type from the OutputPort module's spec input port
-                    type = Variable.read_type(get_upgraded_pipeline(
-                        self._controller.vistrail,
-                        version))
-                    if type is None:
-                        warnings.warn("Found invalid DAT variable pipeline "
-                                      "%r, ignored" % tag)
-                        continue
-                    # Get the data provenance
-                    provenance = self._data_provenance.get(version)
-
-                    variable = Variable.VariableInformation(
-                        varname, self._controller, type, provenance)
-
-                    self._variables[varname] = variable
-                    self._add_variable(varname)
-
-        # Load mappings from annotations
-        # First, read the recipes
-        for an in annotations:
-            if an.key == self._RECIPE_KEY:
-                version = an.action_id
-                recipe, conn_map = self._read_recipe_annotation(self, an.value)
-                if recipe is not None:
-                    pipeline = PipelineInformation(
-                        version, recipe, conn_map,
-                        None)  # to be filled by the next block
-                    self._version_to_pipeline[version] = pipeline
-        # Then, read the port maps
-        for an in annotations:
-            if an.key == self._PORTMAP_KEY:
-                pipeline = self._version_to_pipeline[an.action_id]
-                if not pipeline:
-                    # Purge the lone port map
-                    warnings.warn("Found a DAT port map annotation with no "
-                                  "associated recipe -- removing")
-                    self._controller.vistrail.set_action_annotation(
-                        an.action_id,
-                        an.key,
-                        None)
-                else:
-                    port_map = self._read_portmap_annotation(an.value)
-                    if port_map is not None:
-                        pipeline.port_map = port_map
+            variables = [(tag[8:], version,
+                          types.get(version), hashes.get(version))
+                         for version, tag in tagmap.iteritems()
+                         if tag.startswith('dat-var-')]
+        else:
+            variables = []
+
+        # Register the variables; only their names are needed for the panels
+        # to be usable, their types and provenance are read in the
+        # background, see _load_steps()
+        for varname, version, type, structural_hash in variables:
+            variable = Variable.VariableInformation(
+                varname, self._controller, None, None,
+                structural_hash)
+            self._pending_variables[varname] = version, type
+
+            self._variables[varname] = variable
+            self._index_hash(variable)
+            self._add_variable(varname)
+
+        # The recipes are read when first needed, see _load_pipeline(), or in
+        # the background
+        recipes = self._annotations[self._RECIPE_KEY]
+        self._unread_recipes = set(recipes)  # set([version: int])
+
+        # Purge the lone port maps
+        for version in list(self._annotations[self._PORTMAP_KEY]):
+            if version not in recipes:
+                warnings.warn("Found a DAT port map annotation with no "
+                              "associated recipe -- removing")
+                self._set_annotation(version, self._PORTMAP_KEY, None)
+
+        # Load the rest from the event loop
+        self._loader = self._load_steps()
+        self._schedule_loading()
+
+    # Duration of the loading steps done in a single event loop iteration
+    _LOADING_SLICE = 0.05
+
+    def _schedule_loading(self):
+        ref = weakref.ref(self)
+
+        def step():
+            vistraildata = ref()
+            if vistraildata is not None:
+                vistraildata._loading_step()
+        QtCore.QTimer.singleShot(0, step)
+
+    def _loading_step(self):
+        """Runs the loading steps for a slice of time, reporting progress.
+
+        The VistrailData is loaded from the event loop rather than from a
+        thread, as the controller and the spreadsheet are not thread-safe. The
+        application stays responsive as only _LOADING_SLICE seconds are spent
+        in each iteration.
+        """
+        if self._loader is None:
+            return
+        deadline = time.time() + self._LOADING_SLICE
+        done, total = 0, 0
+        try:
+            while True:
+                done, total = next(self._loader)
+                if time.time() >= deadline:
+                    break
+        except StopIteration:
+            self._loader = None
+            done = total
+        get_vistrails_application().send_notification(
+            'dat_loading_progress',
+            self._controller,
+            done, total)
+        if self._loader is not None:
+            self._schedule_loading()
+
+    def _load_steps(self):
+        """Reads the state of the vistrail that is not needed right away.
+
+        This is a generator, doing one step each time it is resumed and
+        yielding the (done, total) number of steps. It reads, in order:
+          * the types and provenance of the variables,
+          * the recipes,
+          * the location of the pipelines saved without a location
+            annotation; these are shown in their cell if the spreadsheet tabs
+            have already been laid out.
+
+        Anything needed before it is reached is read on demand instead.
+        """
+        pending = list(self._pending_variables)
+        recipes = list(self._unread_recipes)
+        total = len(pending) + len(recipes)
+        done = 0
+
+        for varname in pending:
+            self._complete_variable(varname)
+            done += 1
+            yield done, total
+        if self._untyped:
+            self._schedule_backfill()
+
+        for version in recipes:
+            self._load_pipeline(version)
+            done += 1
+            yield done, total
+
+        locations = self._annotations[self._CELL_KEY]
+        unlocated = [
+            version
+            for version in self._version_to_pipeline
+            if self._read_cell_annotation(locations.get(version, '')) is None]
+        total += len(unlocated)
+        for version in unlocated:
+            pipeline = self._version_to_pipeline.get(version)
+            if pipeline is not None:  # Might have been removed meanwhile
+                self._locate_pipeline(pipeline)
+            done += 1
+            yield done, total
+
+    def _complete_variable(self, varname):
+        """Reads the type and provenance of a variable, if not done yet.
+        """
+        try:
+            version, type = self._pending_variables.pop(varname)
+        except KeyError:
+            return
+        variable = self._variables[varname]
+
+        # Get the type from the annotation; if there is none (file saved by an
+        # older version), it will be read from the OutputPort module's spec
+        # input port, in the background or when first needed
+        if not variable.type_known:
+            if type is not None:
+                try:
+                    variable.type = resolve_descriptor(str(type))
+                except ModuleRegistryException:
+                    pass
+            if not variable.type_known:
+                self._untyped.append(varname)
+
+        # Get the data provenance
+        variable.provenance = self.variable_provenance(version)
+
+    def _cache_filename(self):
+        """Gets the name of the sidecar cache file, or None.
+
+        The cache is stored next to the vistrail, if it is saved to a file.
+        """
+        locator = self._controller.locator
+        if isinstance(locator, (XMLFileLocator, ZIPFileLocator)):
+            return locator.name + '.dat-cache'
+        return None
+
+    def _cache_key(self):
+        """Gets a cheap summary of the state of the vistrail.
+
+        This is the key of the cache: the last action id, the number of
+        actions, the number of action annotations and the id of the last one.
+        VisTrails replaces an annotation by appending a new one, with a new id,
+        so changing, adding or removing an annotation changes the key.
+        """
+        vistrail = self._controller.vistrail
+        annotations = vistrail.action_annotations
+        return '%d:%d:%d:%d' % (
+            max(vistrail.actionMap) if vistrail.actionMap else 0,
+            len(vistrail.actionMap),
+            len(annotations),
+            annotations[-1].id if annotations else 0)
+
+    def _read_cache(self):
+        """Reads the sidecar cache, if there is one and it is up to date.
+
+        Returns a dict with 'variables', the list of (varname, version, type,
+        hash) for the variables, and 'cells', a dict mapping (row, col,
+        sheet_id) to the version shown there, or None if the layout wasn't
+        cached.
+        """
+        filename = self._cache_filename()
+        if filename is None or not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'rb') as fp:
+                data = json.load(fp)
+            if (data['v'] != self._CACHE_FORMAT or
+                    data['key'] != self._cache_key()):
+                return None
+            variables = [(str(varname), int(version), type, structural_hash)
+                         for varname, version, type, structural_hash
+                         in data['variables']]
+            if data['cells'] is None:
+                cells = None
+            else:
+                cells = dict(((int(row), int(col), int(sheet_id)),
+                              int(version))
+                             for row, col, sheet_id, version in data['cells'])
+        except (IOError, KeyError, ValueError, TypeError):
+            return None
+        return {'variables': variables, 'cells': cells}
+
+    def write_cache(self):
+        """Writes the sidecar cache, holding the state of this VistrailData.
+
+        Called when the vistrail is saved. The next time it is opened, the
+        cache will be used instead of reading the whole vistrail, if the
+        vistrail didn't change.
+        """
+        filename = self._cache_filename()
+        if filename is None:
+            return
+        key = self._cache_key()
+        for varname in list(self._pending_variables):
+            self._complete_variable(varname)
+        # Lazy variables that were never used are not in the file; we don't
+        # materialize them here, as that would change the vistrail
+        variables = [
+            [varname, variable.get_version(),
+             variable.type.sigstring if variable.type_known else None,
+             variable.structural_hash]
+            for varname, variable in self._variables.iteritems()
+            if variable.materialized]
+        if self._spreadsheet_tabs is None:
+            cells = None
+        else:
+            cells = []
+            for cellInfo, version in self._cell_to_version.iteritems():
+                sheet_id = self._spreadsheet_tabs_rev.get(cellInfo.tab)
+                if sheet_id is not None:
+                    cells.append([cellInfo.row, cellInfo.column, sheet_id,
+                                  version])
+        try:
+            with open(filename, 'wb') as fp:
+                json.dump({'v': self._CACHE_FORMAT,
+                           'key': key,
+                           'variables': variables,
+                           'cells': cells},
+                          fp, separators=(',', ':'))
+        except (IOError, OSError), e:
+            warnings.warn("Couldn't write DAT cache %r: %s" % (filename, e))
+
+    def _set_annotation(self, version, key, value):
+        """Sets (or removes, if value is None) an annotation on a version.
+
+        This updates the index of annotations along with the vistrail.
+        """
+        self._controller.vistrail.set_action_annotation(version, key, value)
+        if value is None:
+            self._annotations[key].pop(version, None)
+        else:
+            self._annotations[key][version] = value
+
+    def _load_pipeline(self, version):
+        """Reads the recipe and port map of a version, if not done yet.
+        """
+        if version not in self._unread_recipes:
+            return
+        self._unread_recipes.discard(version)
+        recipe, conn_map = self._read_recipe_annotation(
+            self, self._annotations[self._RECIPE_KEY][version])
+        if recipe is None:
+            return
+        port_map = None
+        value = self._annotations[self._PORTMAP_KEY].get(version)
+        if value is not None:
+            port_map = self._read_portmap_annotation(value)
+        self._add_pipeline(PipelineInformation(
+            version, recipe, conn_map, port_map))
+
+    def migrate_annotations(self):
+        """Rewrites the annotations still in the old format.
+
+        This is called before saving the vistrail from DAT. Recipes that can't
+        be read, or that refer to deleted variables, are left alone.
+        """
+        for version, value in self._annotations[self._RECIPE_KEY].items():
+            if value.startswith('{'):
+                continue
+            recipe, conn_map = self._read_recipe_annotation(self, value)
+            if recipe is None or any(
+                    param_val.type == RecipeParameterValue.VARIABLE and
+                    param_val.variable is None
+                    for param_values in recipe.parameters.itervalues()
+                    for param_val in param_values):
+                continue
+            self._set_annotation(
+                version, self._RECIPE_KEY,
+                self._build_recipe_annotation(recipe, conn_map))
+        for version, value in self._annotations[self._PORTMAP_KEY].items():
+            if value.startswith('{'):
+                continue
+            port_map = self._read_portmap_annotation(value)
+            if port_map is not None:
+                self._set_annotation(
+                    version, self._PORTMAP_KEY,
+                    self._build_portmap_annotation(port_map))
+
+    def _load_all_pipelines(self):
+        """Reads all the recipes not read yet.
+
+        This is needed before iterating on the pipelines, or querying the
+        index of the variables they use.
+        """
+        for version in list(self._unread_recipes):
+            self._load_pipeline(version)
 
     def _get_controller(self):
         return self._controller
@@ -387,33 +778,48 @@ class VistrailData(object):
             return None
         tab_controller = sh_window.tabController
 
-        # Get the cell location from the pipeline to fill in _cell_to_version
-        # and _cell_to_pipeline
+        # Get the cell locations, from the cache or the annotations, to fill
+        # in _cell_to_version and _cell_to_pipeline
+        # The pipelines saved without a location annotation by older versions
+        # are located in the background, see _locate_pipeline()
+        candidates = dict()  # (row, col, sheet_id) -> [version: int]
+        if self._cached_cells is not None:
+            for location, version in self._cached_cells.iteritems():
+                candidates[location] = [version]
+            self._cached_cells = None
+        else:
+            recipes = self._annotations[self._RECIPE_KEY]
+            for version, value in (
+                    self._annotations[self._CELL_KEY].iteritems()):
+                location = self._read_cell_annotation(value)
+                if location is not None and version in recipes:
+                    candidates.setdefault(location, []).append(version)
+                    self._unverified_cells.append(version)
+        if self._unverified_cells:
+            self._schedule_verification()
+
+        # Select the latest valid version for a given cell; only the recipes
+        # of these versions need to be read
         cells = dict()
+        for location, versions in candidates.iteritems():
+            for version in sorted(versions, reverse=True):
+                pipeline = self.get_pipeline(version)
+                if pipeline is not None:
+                    cells[location] = pipeline
+                    break
+
+        return self._create_spreadsheet_tabs(tab_controller, cells)
+
+    def _create_spreadsheet_tabs(self, tab_controller, cells):
+        """Creates the spreadsheet tabs, given the pipeline in each cell.
+
+        cells maps (row, col, sheet_id) to a pipelineInfo.
+        """
         sheet_sizes = dict()
-        for pipeline in self._version_to_pipeline.itervalues():
-            try:
-                row, col, sheetname_var = get_pipeline_location(
-                    self._controller,
-                    pipeline)
-                if sheetname_var.name.startswith('dat-sheet-'):
-                    sheet_id = int(sheetname_var.name[10:])
-                else:
-                    raise ValueError
-            except ValueError:
-                continue
-            try:
-                p = cells[(row, col, sheet_id)]
-            except KeyError:
-                cells[(row, col, sheet_id)] = pipeline
-                rowCount, colCount = sheet_sizes.get(sheet_id, (2, 2))
-                rowCount = max(rowCount, row + 1)
-                colCount = max(colCount, col + 1)
-                sheet_sizes[sheet_id] = (rowCount, colCount)
-            else:
-                if pipeline.version > p.version:
-                    # Select the latest version for a given cell
-                    cells[(row, col, sheet_id)] = pipeline
+        for row, col, sheet_id in cells:
+            rowCount, colCount = sheet_sizes.get(sheet_id, (2, 2))
+            sheet_sizes[sheet_id] = (max(rowCount, row + 1),
+                                     max(colCount, col + 1))
         self._spreadsheet_tabs = dict()
         self._spreadsheet_tabs_rev = dict()
         for (row, col, sheet_id), pipeline in cells.iteritems():
@@ -428,8 +834,7 @@ class VistrailData(object):
                     colCount,
                     sheet_id)[0]
             cellInfo = CellInformation(spreadsheet_tab, row, col)
-            self._cell_to_pipeline[cellInfo] = pipeline
-            self._cell_to_version[cellInfo] = pipeline.version
+            self._set_cell(cellInfo, pipeline)
 
         if not self._spreadsheet_tabs:
             self.new_tab(True, tab_controller)
@@ -437,6 +842,122 @@ class VistrailData(object):
         return self._spreadsheet_tabs
     spreadsheet_tabs = property(_get_spreadsheet_tabs)
 
+    @staticmethod
+    def _build_cell_annotation(row, col, sheet_id):
+        """Builds the cell location annotation value.
+        """
+        return '%d,%d,%d' % (row, col, sheet_id)
+
+    @staticmethod
+    def _read_cell_annotation(value):
+        """Reads (row, col, sheet_id) from an annotation value.
+
+        Returns None if the value can't be read.
+        """
+        try:
+            row, col, sheet_id = value.split(',')
+            return int(row), int(col), int(sheet_id)
+        except ValueError:
+            return None
+
+    def _read_pipeline_location(self, pipeline):
+        """Gets (row, col, sheet_id) from the modules of a pipeline.
+
+        This is a lot slower than reading the annotation, as the pipeline has
+        to be materialized. Returns None if the location can't be found.
+        """
+        try:
+            row, col, sheetname_var = get_pipeline_location(
+                self._controller,
+                pipeline)
+            if sheetname_var.name.startswith('dat-sheet-'):
+                return row, col, int(sheetname_var.name[10:])
+        except ValueError:
+            pass
+        return None
+
+    def _locate_pipeline(self, pipeline):
+        """Reads the location of a pipeline that has no annotation for it.
+
+        The annotation is added. If the spreadsheet tabs have already been
+        laid out, the pipeline is shown in its cell, unless that cell shows a
+        later version, and 'dat_loaded_cell' is sent.
+        """
+        location = self._read_pipeline_location(pipeline)
+        if location is None:
+            return
+        self._set_annotation(
+            pipeline.version,
+            self._CELL_KEY,
+            self._build_cell_annotation(*location))
+        if self._spreadsheet_tabs is None:
+            return  # Will be laid out from the annotation
+
+        row, col, sheet_id = location
+        spreadsheet_tab = self._spreadsheet_tabs.get(sheet_id)
+        if spreadsheet_tab is None:
+            sh_window = spreadsheetController.findSpreadsheetWindow(
+                create=False)
+            if sh_window is None:
+                return
+            spreadsheet_tab = self.new_tab(
+                True,
+                sh_window.tabController,
+                max(2, row + 1),
+                max(2, col + 1),
+                sheet_id)[0]
+        else:
+            rowCount, colCount = spreadsheet_tab.getDimension()
+            if row >= rowCount or col >= colCount:
+                spreadsheet_tab.setDimension(max(rowCount, row + 1),
+                                             max(colCount, col + 1))
+        cellInfo = CellInformation(spreadsheet_tab, row, col)
+        shown = self._cell_to_version.get(cellInfo)
+        if shown is not None and shown > pipeline.version:
+            return
+        self._set_cell(cellInfo, pipeline)
+        get_vistrails_application().send_notification(
+            'dat_loaded_cell',
+            self._controller,
+            cellInfo, pipeline)
+
+    def _schedule_verification(self):
+        ref = weakref.ref(self)
+
+        def step():
+            vistraildata = ref()
+            if vistraildata is not None:
+                vistraildata._verification_step()
+        QtCore.QTimer.singleShot(0, step)
+
+    def _verification_step(self):
+        """Checks a cell location annotation against its pipeline.
+
+        This is done one pipeline at a time, from the event loop, after the
+        spreadsheet tabs have been laid out from the annotations. An outdated
+        annotation is corrected, which will be reflected the next time the
+        file is opened.
+        """
+        while self._unverified_cells:
+            version = self._unverified_cells.pop()
+            pipeline = self._version_to_pipeline.get(version)
+            value = self._annotations[self._CELL_KEY].get(version)
+            if pipeline is None or value is None:
+                continue  # Removed meanwhile
+            location = self._read_pipeline_location(pipeline)
+            if (location is not None and
+                    location != self._read_cell_annotation(value)):
+                warnings.warn("DAT cell location annotation for version %d "
+                              "doesn't match the pipeline -- fixing" %
+                              version)
+                self._set_annotation(
+                    version,
+                    self._CELL_KEY,
+                    self._build_cell_annotation(*location))
+            break
+        if self._unverified_cells:
+            self._schedule_verification()
+
     def sheetname_var(self, tab):
         sheet_id = self._spreadsheet_tabs_rev[tab]
         return self.controller.get_vistrail_variable(
@@ -459,18 +980,77 @@ class VistrailData(object):
     def new_variable(self, varname, variable):
         """Register a new Variable with DAT.
 
-        This will materialize it in the pipeline and signal its creation.
+        This will materialize it in the pipeline and signal its creation. If
+        another variable has the same pipeline, a warning is issued: the new
+        variable is an alias of it (see get_duplicates()).
         """
         if varname in self._variables:
             raise ValueError("A variable named %s already exists!")
 
         # Materialize the Variable in the Vistrail
         variable = variable.materialize(varname)
+        self._record_variable(variable)
 
+        self._variables[varname] = variable
+        self._index_hash(variable)
+
+        duplicates = self.get_duplicates(varname)
+        if duplicates:
+            warnings.warn("Variable %r has the same pipeline as %s; they will "
+                          "share their value" % (
+                              varname,
+                              ", ".join(repr(name) for name in duplicates)))
+
+        self._variable_created(varname)
+
+    def new_lazy_variable(self, varname, op_tree):
+        """Register a new variable without creating its pipeline yet.
+
+        op_tree is the ComputeVariable that builds the variable. It will only
+        be executed and materialized in the pipeline when the variable is
+        first used, by a plot, an operation or get_variable_value(). Until
+        then, nothing is added to the Vistrail; a lazy variable that was never
+        used is not saved with it.
+
+        Its provenance is recorded right away. The variables it uses are looked
+        up by name when it is materialized, so it is materialized before any of
+        them is removed, renamed or redefined (see _materialize_dependents()).
+        """
+        if varname in self._variables:
+            raise ValueError("A variable named %s already exists!" % varname)
+
+        def materialize(variable_info):
+            variable = op_tree.execute(self._controller)
+            materialized = variable.materialize(variable_info.name)
+            variable_info.provenance = materialized.provenance
+            variable_info.structural_hash = materialized.structural_hash
+            self._record_variable(materialized)
+            self._index_hash(variable_info)
+
+        self._variables[varname] = Variable.LazyVariableInformation(
+            varname, self._controller, op_tree.type, materialize,
+            provenance=op_tree.provenance(self),
+            sources=op_tree.variables())
+
+        self._variable_created(varname)
+
+    def _materialize_dependents(self, varnames, skip=()):
+        """Materializes the lazy variables that use one of these variables.
+
+        This is done before these variables change, so that the lazy variables
+        are built from the current definitions. The variables in skip are left
+        alone.
+        """
+        varnames = set(varnames)
+        for varname, variable in sorted(self._variables.iteritems()):
+            if (varname not in skip and not variable.materialized and
+                    variable.sources & varnames):
+                variable.get_version()
+
+    def _record_variable(self, variable):
         # Record the data provenance in an annotation
-        version = self.controller.vistrail.get_version_number(
-            'dat-var-%s' % varname)
-        self.controller.vistrail.set_action_annotation(
+        version = variable.get_version()
+        self._set_annotation(
             version,
             self._DATA_PROVENANCE_KEY,
             data_provenance.save_to_annotation(variable.provenance))
@@ -478,70 +1058,223 @@ class VistrailData(object):
         # Add a record in our map of provenance data
         self._data_provenance[version] = variable.provenance
 
-        self._variables[varname] = variable
+        # Record the structural hash, so duplicates are known on reopening
+        self._set_annotation(
+            version,
+            self._HASH_KEY,
+            variable.structural_hash)
+
+        # Record the type, so the pipeline needn't be read on reopening
+        self._set_annotation(
+            version,
+            self._TYPE_KEY,
+            variable.type.sigstring)
+
+    def _schedule_backfill(self):
+        ref = weakref.ref(self)
 
-        self._add_variable(varname)
-
-    def _add_variable(self, varname, renamed_from=None):
-        if renamed_from is not None:
-            # Variable was renamed -- reflect this change on the annotations
-            for pipeline in self._version_to_pipeline.itervalues():
-                if any(
-                        p.type == RecipeParameterValue.VARIABLE and
-                        p.variable.name == varname
-                        for p_values in pipeline.recipe.parameters.itervalues()
-                        for p in p_values):
-                    self._controller.vistrail.set_action_annotation(
-                        pipeline.version,
-                        self._RECIPE_KEY,
-                        self._build_recipe_annotation(
-                            pipeline.recipe,
-                            pipeline.conn_map))
+        def step():
+            vistraildata = ref()
+            if vistraildata is not None:
+                vistraildata._backfill_step()
+        QtCore.QTimer.singleShot(0, step)
+
+    def _backfill_step(self):
+        """Reads the type of a variable opened without a type annotation.
+
+        This is done one variable at a time, from the event loop, so that the
+        application remains responsive. The type annotation is added, so that
+        the pipeline doesn't need to be read the next time the file is
+        opened. Invalid variables are dropped.
+        """
+        while self._untyped:
+            varname = self._untyped.pop()
+            variable = self._variables.get(varname)
+            if variable is None or variable.type_known:
+                continue  # Removed, or type read on demand meanwhile
+            if variable.type is None:
+                warnings.warn("Found invalid DAT variable pipeline %r, "
+                              "ignored" % ('dat-var-%s' % varname))
+                del self._variables[varname]
+                self._unindex_hash(variable)
+                get_vistrails_application().send_notification(
+                    'dat_removed_variables',
+                    self._controller,
+                    [varname])
+            else:
+                self._set_annotation(
+                    variable.get_version(),
+                    self._TYPE_KEY,
+                    variable.type.sigstring)
+            break
+        if self._untyped:
+            self._schedule_backfill()
+
+    def _index_hash(self, variable):
+        if variable.structural_hash is not None:
+            self._hash_index.setdefault(
+                variable.structural_hash, set()).add(variable.name)
+
+    def _unindex_hash(self, variable):
+        names = self._hash_index.get(variable.structural_hash)
+        if names is not None:
+            names.discard(variable.name)
+            if not names:
+                del self._hash_index[variable.structural_hash]
+
+    def _variable_created(self, varname):
+        if self._transaction is not None:
+            self._transaction.append(varname)
+        else:
+            self._add_variable(varname)
+
+    def redefine_variable(self, varname, variable):
+        """Replaces the pipeline of an existing variable.
+
+        The Variable is materialized as a new version, which gets the
+        'dat-var-<varname>' tag; the previous one stays in the vistrail. The
+        new VariableInformation is returned.
+
+        The pipelines using this variable are not changed. Observers get a
+        'dat_redefined_variable' notification, as the type and provenance of
+        the variable can be different.
+        """
+        self._complete_variable(varname)
+        self._materialize_dependents([varname])
+        old_variable = self._variables[varname]
+        old_version = old_variable.get_version()
+
+        # Move the tag to the new version
+        self._controller.vistrail.set_tag(old_version, '')
+        try:
+            new_variable = variable.materialize(varname)
+        except Exception:
+            self._controller.vistrail.set_tag(old_version,
+                                              'dat-var-%s' % varname)
+            raise
+        self._record_variable(new_variable)
+
+        self._unindex_hash(old_variable)
+        self._variables[varname] = new_variable
+        self._index_hash(new_variable)
 
         get_vistrails_application().send_notification(
-            'dat_new_variable',
+            'dat_redefined_variable',
             self._controller,
-            varname,
-            renamed_from=renamed_from)
+            varname)
+        return new_variable
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Groups the creation of several variables.
+
+        The notifications for the variables created in the block are only sent
+        at the end, all at once. If an exception escapes the block, these
+        variables are removed from the vistrail instead, and observers never
+        hear about them.
+
+        Nested transactions are merged into the outermost one.
+        """
+        if self._transaction is not None:
+            yield
+            return
+
+        self._transaction = []
+        try:
+            yield
+        except Exception:
+            created, self._transaction = self._transaction, None
+            for varname in reversed(created):
+                variable = self._variables.pop(varname)
+                self._unindex_hash(variable)
+                if variable.materialized:
+                    version = variable.get_version()
+                    for key in (self._DATA_PROVENANCE_KEY, self._HASH_KEY,
+                                self._TYPE_KEY):
+                        self._set_annotation(version, key, None)
+                    self._data_provenance.pop(version, None)
+                variable.remove()
+            raise
+        else:
+            created, self._transaction = self._transaction, None
+            for varname in created:
+                self._add_variable(varname)
+
+    @staticmethod
+    def _recipe_variables(recipe):
+        """Gets the names of the variables used by a recipe.
+        """
+        return set(p.variable.name
+                   for p_values in recipe.parameters.itervalues()
+                   for p in p_values
+                   if p.type == RecipeParameterValue.VARIABLE)
 
-    def _remove_variable(self, varname, renamed_to=None):
+    def _add_pipeline(self, pipeline):
+        """Registers a PipelineInformation, indexing the variables it uses.
+        """
+        old_pipeline = self._version_to_pipeline.get(pipeline.version)
+        if old_pipeline is not None:
+            self._unindex_pipeline(old_pipeline)
+        self._version_to_pipeline[pipeline.version] = pipeline
+        for varname in self._recipe_variables(pipeline.recipe):
+            self._variable_to_versions.setdefault(varname, set()).add(
+                pipeline.version)
+
+    def _unindex_pipeline(self, pipeline):
+        for varname in self._recipe_variables(pipeline.recipe):
+            versions = self._variable_to_versions.get(varname)
+            if versions is not None:
+                versions.discard(pipeline.version)
+                if not versions:
+                    del self._variable_to_versions[varname]
+
+    def _set_cell(self, cellInfo, pipeline):
+        """Records that a cell shows a pipeline.
+        """
+        old_version = self._cell_to_version.get(cellInfo)
+        if old_version is not None:
+            cells = self._version_to_cells[old_version]
+            cells.discard(cellInfo)
+            if not cells:
+                del self._version_to_cells[old_version]
+        self._cell_to_version[cellInfo] = pipeline.version
+        self._cell_to_pipeline[cellInfo] = pipeline
+        self._version_to_cells.setdefault(pipeline.version, set()).add(
+            cellInfo)
+
+    def get_variable_uses(self, varname):
+        """Gets the pipelines and cells that use a variable.
+
+        Returns the set of the versions of the pipelines, and the set of the
+        CellInformation of the cells showing one of them.
+        """
+        self._load_all_pipelines()
+        versions = set(self._variable_to_versions.get(varname, ()))
+        cells = set()
+        for version in versions:
+            cells.update(self._version_to_cells.get(version, ()))
+        return versions, cells
+
+    def _add_variable(self, varname):
         get_vistrails_application().send_notification(
-            'dat_removed_variable',
+            'dat_new_variable',
             self._controller,
-            varname,
-            renamed_to=renamed_to)
-
-        if renamed_to is None:
-            # A variable was removed!
-            # We'll remove all the mappings that used it
-            to_remove = set([])
-            for pipeline in self._version_to_pipeline.itervalues():
-                if any(
-                        p.type == RecipeParameterValue.VARIABLE and
-                        p.variable.name == varname
-                        for p_values in pipeline.recipe.parameters.itervalues()
-                        for p in p_values):
-                    to_remove.add(pipeline.version)
-            if to_remove:
-                warnings.warn(
-                    "Variable %r was used in %d pipelines!" % (
-                        varname, len(to_remove)))
-            for version in to_remove:
-                del self._version_to_pipeline[version]
-
-                # Remove the annotations from the vistrail
-                for key in (
-                        self._RECIPE_KEY, self._PORTMAP_KEY):
-                    self._controller.vistrail.set_action_annotation(
-                        version,
-                        key,
-                        None)
-
-            cell_to_remove = []
-            for cellInfo, version in self._cell_to_version.iteritems():
-                if version in to_remove:
-                    cell_to_remove.append(cellInfo)
-            for cellInfo in cell_to_remove:
+            varname)
+
+    def _forget_pipelines(self, versions):
+        """Forgets the pipelines of some versions, and their annotations.
+
+        This is used when the variables they use are removed.
+        """
+        for version in versions:
+            self._unindex_pipeline(self._version_to_pipeline.pop(version))
+
+            # Remove the annotations from the vistrail
+            for key in (
+                    self._RECIPE_KEY, self._PORTMAP_KEY, self._CELL_KEY):
+                self._set_annotation(version, key, None)
+
+            for cellInfo in self._version_to_cells.pop(version, ()):
                 del self._cell_to_version[cellInfo]
                 del self._cell_to_pipeline[cellInfo]
 
@@ -551,32 +1284,147 @@ class VistrailData(object):
         This will remove the associated version in the vistrail and signal its
         destruction.
         """
-        self._remove_variable(varname)
+        self.remove_variables([varname])
 
-        variable = self._variables.pop(varname)
-        variable.remove()
+    def remove_variables(self, varnames):
+        """Remove several Variables from DAT at once.
+
+        The versions of the variables are pruned from the vistrail in a single
+        operation, and the pipelines using them are forgotten in a single pass.
+        Observers get a single 'dat_removed_variables' notification.
+        """
+        varnames = list(varnames)
+        for varname in varnames:
+            if varname not in self._variables:
+                raise KeyError(varname)
+        self._materialize_dependents(varnames, skip=varnames)
+
+        get_vistrails_application().send_notification(
+            'dat_removed_variables',
+            self._controller,
+            varnames)
+
+        # We'll remove all the mappings that used them
+        self._load_all_pipelines()
+        to_remove = set()
+        for varname in varnames:
+            to_remove.update(self._variable_to_versions.get(varname, ()))
+        if to_remove:
+            warnings.warn(
+                "Variables %s were used in %d pipelines!" % (
+                    ', '.join(repr(varname) for varname in varnames),
+                    len(to_remove)))
+        self._forget_pipelines(to_remove)
+
+        to_prune = []
+        for varname in varnames:
+            self._pending_variables.pop(varname, None)
+            variable = self._variables.pop(varname)
+            self._unindex_hash(variable)
+            if variable.materialized:
+                to_prune.append(variable.get_version())
+            else:
+                variable.remove()
+        if to_prune:
+            self._controller.prune_versions(to_prune)
 
     def rename_variable(self, old_varname, new_varname):
         """Rename a Variable.
 
         This will update the tag on the associated version.
-
-        Observers will get notified that a Variable was deleted and another
-        added.
         """
-        self._remove_variable(old_varname, renamed_to=new_varname)
+        self.rename_variables({old_varname: new_varname})
 
-        variable = self._variables.pop(old_varname)
-        self._variables[new_varname] = variable
-        variable.rename(new_varname)
+    def rename_variables(self, renamed):
+        """Rename several Variables at once.
 
-        self._add_variable(new_varname, renamed_from=old_varname)
+        renamed maps the current names to the new ones. The new names must not
+        be in use.
+
+        The tags are moved, then the recipes using these variables are updated
+        in a single pass. Observers get a single 'dat_renamed_variables'
+        notification.
+        """
+        renamed = dict(renamed)
+        for old_varname, new_varname in renamed.iteritems():
+            if old_varname not in self._variables:
+                raise KeyError(old_varname)
+            if new_varname in self._variables:
+                raise ValueError("A variable named %s already exists!" %
+                                 new_varname)
+        if len(set(renamed.itervalues())) != len(renamed):
+            raise ValueError("Several variables would get the same name")
+        self._materialize_dependents(renamed)
+
+        # The recipes refer to the variables by name, read them before it
+        # changes
+        self._load_all_pipelines()
+
+        versions = set()
+        for old_varname, new_varname in renamed.iteritems():
+            self._complete_variable(old_varname)
+            variable = self._variables.pop(old_varname)
+            self._unindex_hash(variable)
+            self._variables[new_varname] = variable
+            variable.rename(new_varname)
+            self._index_hash(variable)
+
+            uses = self._variable_to_versions.pop(old_varname, set())
+            if uses:
+                self._variable_to_versions.setdefault(
+                    new_varname, set()).update(uses)
+                versions.update(uses)
+
+        # Reflect this change on the annotations
+        for version in versions:
+            pipeline = self._version_to_pipeline[version]
+            self._set_annotation(
+                pipeline.version,
+                self._RECIPE_KEY,
+                self._build_recipe_annotation(
+                    pipeline.recipe,
+                    pipeline.conn_map))
+
+        get_vistrails_application().send_notification(
+            'dat_renamed_variables',
+            self._controller,
+            renamed)
 
     def get_variable(self, varname):
         if not isinstance(varname, str):
             raise ValueError
+        self._complete_variable(varname)
         return self._variables.get(varname)
 
+    def get_duplicates(self, varname):
+        """Gets the other variables that have the same pipeline as this one.
+
+        Such variables are aliases: they share their cached value, and their
+        identical pipelines share the results cached by the interpreter.
+        """
+        variable = self._variables[varname]
+        if variable.structural_hash is None:
+            return []
+        return sorted(name
+                      for name in self._hash_index[variable.structural_hash]
+                      if name != varname)
+
+    def get_variable_value(self, varname):
+        """Gets the value of a variable, i.e. the result of its pipeline.
+
+        The values are cached by structural hash (or by pipeline version for
+        variables whose hash is unknown), so the pipeline of a variable is
+        only executed again if it changed, and not at all if a duplicate was
+        already computed.
+        """
+        variable = self._variables[varname]
+        version = variable.get_version()
+        key = variable.structural_hash or version
+        if key in self._value_cache:
+            return self._value_cache.get(key)
+        value = self._value_cache[key] = get_variable_value(variable)
+        return value
+
     def _get_variables(self):
         return self._variables.iterkeys()
     variables = property(_get_variables)
@@ -587,8 +1435,19 @@ class VistrailData(object):
         This is similar to get_variable(...).provenance except that it also
         works for variables that have been deleted (VisTrails keeps every
         version, along with their annotations excepts for tags).
+
+        The annotation is only parsed the first time the version is asked for.
         """
-        return self._data_provenance.get(version)
+        try:
+            return self._data_provenance[version]
+        except KeyError:
+            pass
+        value = self._annotations[self._DATA_PROVENANCE_KEY].get(version)
+        if value is None:
+            return None
+        provenance = self._data_provenance[version] = (
+            data_provenance.read_from_annotation(value))
+        return provenance
 
     def created_pipeline(self, cellInfo, pipeline):
         """Registers a new pipeline as being the result of a DAT recipe.
@@ -599,6 +1458,7 @@ class VistrailData(object):
         The version will get annotated with the DAT metadata, allowing it to be
         updated later.
         """
+        self._load_pipeline(pipeline.version)
         try:
             p = self._version_to_pipeline[pipeline.version]
             if p == pipeline:
@@ -615,60 +1475,65 @@ class VistrailData(object):
                     pipeline.recipe))
         except KeyError:
             pass
-        self._cell_to_version[cellInfo] = pipeline.version
-        self._version_to_pipeline[pipeline.version] = pipeline
-        self._cell_to_pipeline[cellInfo] = pipeline
+        self._add_pipeline(pipeline)
+        self._set_cell(cellInfo, pipeline)
 
         # Add the annotation in the vistrail
-        self._controller.vistrail.set_action_annotation(
+        self._set_annotation(
             pipeline.version,
             self._RECIPE_KEY,
             self._build_recipe_annotation(pipeline.recipe,
                                           pipeline.conn_map))
 
-        self._controller.vistrail.set_action_annotation(
+        self._set_annotation(
             pipeline.version,
             self._PORTMAP_KEY,
             self._build_portmap_annotation(pipeline.port_map))
 
-    def _infer_pipelineinfo(self, version, cellInfo):
-        """Try to make up a pipelineInfo for a version and store it.
+        sheet_id = self._spreadsheet_tabs_rev.get(cellInfo.tab)
+        if sheet_id is not None:
+            self._set_annotation(
+                pipeline.version,
+                self._CELL_KEY,
+                self._build_cell_annotation(cellInfo.row, cellInfo.column,
+                                            sheet_id))
 
-        Returns the new pipelineInfo, or None if we failed.
-        """
-        # This ensures that we don't try to infer a DAT recipe from the same
-        # pipeline over and over again
-        if version in self._failed_infer_calls:
-            return None
-
-        def fail():
-            self._failed_infer_calls.add(version)
-            return None
-
-        # Recursively obtains the parent version's pipelineInfo
-        try:
-            parentId = self._controller.vistrail.actionMap[version].prevId
-        except KeyError:
-            return fail()
-        parentInfo = self.get_pipeline(parentId, infer_for_cell=cellInfo)
-        if parentInfo is None:
-            return fail()
-
-        # Here we loop on modules/connections to check that the required things
-        # from the old pipeline are still here
+    @staticmethod
+    def _apply_operations(operations, module_ids, connection_ids):
+        """Updates the sets of module and connection ids of a pipeline.
 
-        pipeline = get_upgraded_pipeline(
-            self._controller.vistrail,
-            version)
+        This applies the operations of an action, without materializing the
+        pipeline.
+        """
+        for op in operations:
+            if op.what == 'module':
+                ids = module_ids
+            elif op.what == 'connection':
+                ids = connection_ids
+            else:
+                continue
+            if op.vtType == 'add':
+                ids.add(op.objectId)
+            elif op.vtType == 'delete':
+                ids.discard(op.objectId)
+            elif op.vtType == 'change':
+                ids.discard(op.oldObjId)
+                ids.add(op.newObjId)
 
-        new_parameters = dict()
-        new_conn_map = dict()
+    @staticmethod
+    def _derive_pipelineinfo(parentInfo, version, module_ids, connection_ids):
+        """Makes up the pipelineInfo of a child version from its parent's.
 
+        Returns None if the plot is gone.
+        """
         # Check that the plot is still there by finding the plot ports
         for name, port_list in parentInfo.port_map.iteritems():
             for mod_id, portname in port_list:
-                if mod_id not in pipeline.modules:
-                    return fail()
+                if mod_id not in module_ids:
+                    return None
+
+        new_parameters = dict()
+        new_conn_map = dict()
 
         # Loop on parameters to check they are still there
         for name, parameter_list in parentInfo.recipe.parameters.iteritems():
@@ -677,7 +1542,7 @@ class VistrailData(object):
             new_conn_list = []
             for parameter, conns in itertools.izip(parameter_list, conn_list):
                 if all(
-                        conn_id in pipeline.connections
+                        conn_id in connection_ids
                         for conn_id in conns):
                     new_parameter_list.append(parameter)
                     new_conn_list.append(conns)
@@ -685,9 +1550,60 @@ class VistrailData(object):
             new_conn_map[name] = new_conn_list
 
         new_recipe = DATRecipe(parentInfo.recipe.plot, new_parameters)
-        pipelineInfo = PipelineInformation(version, new_recipe,
-                                           new_conn_map, parentInfo.port_map)
-        self.created_pipeline(cellInfo, pipelineInfo)
+        return PipelineInformation(version, new_recipe,
+                                   new_conn_map, parentInfo.port_map)
+
+    def _infer_pipelineinfo(self, version, cellInfo):
+        """Try to make up a pipelineInfo for a version and store it.
+
+        The nearest ancestor with a known recipe is found, and its recipe is
+        carried down to the version, checking at each step that the plot and
+        the parameters' connections are still there. Only the ancestor's
+        pipeline is materialized; the module and connection ids are then
+        updated from the actions. A pipelineInfo is stored for each
+        intermediate version.
+
+        Returns the new pipelineInfo, or None if we failed.
+        """
+        vistrail = self._controller.vistrail
+
+        # Walk up to the nearest ancestor with a recipe
+        path = []  # [version: int], from the version to the ancestor
+        ancestor = version
+        while True:
+            # This ensures that we don't try to infer a DAT recipe from the
+            # same pipeline over and over again
+            if ancestor in self._failed_infer_calls:
+                self._failed_infer_calls.update(path)
+                return None
+            self._load_pipeline(ancestor)
+            if ancestor in self._version_to_pipeline:
+                break
+            path.append(ancestor)
+            try:
+                ancestor = vistrail.actionMap[ancestor].prevId
+            except KeyError:
+                self._failed_infer_calls.update(path)
+                return None
+
+        # Walk down, carrying the recipe
+        pipelineInfo = self._version_to_pipeline[ancestor]
+        pipeline = vistrail.getPipeline(ancestor)
+        module_ids = set(pipeline.modules)
+        connection_ids = set(pipeline.connections)
+        del pipeline
+        while path:
+            child = path.pop()
+            self._apply_operations(vistrail.actionMap[child].operations,
+                                   module_ids, connection_ids)
+            pipelineInfo = self._derive_pipelineinfo(
+                pipelineInfo, child, module_ids, connection_ids)
+            if pipelineInfo is None:
+                # The descendants can't be inferred either
+                self._failed_infer_calls.add(child)
+                self._failed_infer_calls.update(path)
+                return None
+            self.created_pipeline(cellInfo, pipelineInfo)
         return pipelineInfo
 
     def get_pipeline(self, param, infer_for_cell=None):
@@ -701,6 +1617,7 @@ class VistrailData(object):
         where this pipeline was found.
         """
         if isinstance(param, (int, long)):
+            self._load_pipeline(param)
             pipelineInfo = self._version_to_pipeline.get(param, None)
             if pipelineInfo is not None or infer_for_cell is None:
                 return pipelineInfo
@@ -710,6 +1627,7 @@ class VistrailData(object):
             return self._cell_to_pipeline.get(param, None)
 
     def _get_all_pipelines(self):
+        self._load_all_pipelines()
         return self._version_to_pipeline.itervalues()
     all_pipelines = property(_get_all_pipelines)
 
@@ -742,6 +1660,11 @@ class VistrailManager(object):
         issues.
         """
         app = get_vistrails_application()
+        # dat_loading_progress(done: int, total: int)
+        app.create_notification('dat_loading_progress')
+        # dat_loaded_cell(cellInfo: CellInformation,
+        #                 pipelineInfo: PipelineInformation)
+        app.create_notification('dat_loaded_cell')
         app.register_notification(
             'controller_changed',
             lambda c: self.set_controller(c, _auto=True))
@@ -751,6 +1674,9 @@ class VistrailManager(object):
         app.register_notification(
             'vistrail_saved',
             self.controller_name_changed)
+        app.register_notification(
+            'vistrail_saved',
+            self.vistrail_saved)
         self.initialized = True
 
     def set_controller(self, controller, register=False,
@@ -839,6 +1765,11 @@ class VistrailManager(object):
 
         vistraildata.update_spreadsheet_tabs()
 
+    def vistrail_saved(self):
+        vistraildata = self()
+        if vistraildata is not None:
+            vistraildata.write_cache()
+
     def from_spreadsheet_tab(self, tab):
         try:
             vistraildata, sheet_id = self._tabs[tab]
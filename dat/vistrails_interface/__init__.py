@@ -44,8 +44,7 @@ def get_variable_value(variable):
     """
     def pipeline_from_info(variableinfo):
         controller = variableinfo._controller
-        version = controller.vistrail.get_version_number(
-            'dat-var-%s' % variable.name)
+        version = variableinfo.get_version()
         return controller.vistrail.getPipeline(version), version
 
     def pipeline_from_generator(variable_gen):
@@ -208,7 +207,7 @@ def apply_operation_subworkflow(controller, op, subworkflow, args):
 
     # Add the parameter subworkflows
     for i in xrange(len(args)):
-        generator.append_operations(args[i]._generator.operations)
+        generator.append_operations(args[i]._generator.log)
         o_mod = args[i]._output_module
         o_port = args[i]._outputport_name
         for i_mod, i_port in operation_params.get(op.parameters[i].name, []):
@@ -505,8 +504,10 @@ def get_plot_modules(pipelineInfo, pipeline):
 def add_variable_subworkflow_typecast(generator, variable, plot_ports,
                                       expected_type, typecast):
     if issubclass(variable.type.module, expected_type.module):
+        var_pipeline = get_upgraded_pipeline(generator.controller.vistrail,
+                                             variable.get_version())
         return (add_variable_subworkflow(generator,
-                                         variable.name,
+                                         var_pipeline,
                                          plot_ports),
                 RecipeParameterValue(variable=variable))
     else:
@@ -518,7 +519,7 @@ def add_variable_subworkflow_typecast(generator, variable, plot_ports,
             generator.controller, var_pipeline,
             variable.type, expected_type)
 
-        generator.append_operations(var_pipeline._generator.operations)
+        generator.append_operations(var_pipeline._generator.log)
         if plot_ports:
             connection_ids = []
             for var_output_mod, var_output_port in plot_ports:
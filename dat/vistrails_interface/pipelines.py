@@ -9,32 +9,139 @@ from vistrails.core.vistrail.module import Module as PipelineModule
 from dat.vistrails_interface.utils import delete_linked
 
 
+class OperationLog(object):
+    """An append-only sequence of VisTrails operations that can share others.
+
+    Appending another log only stores a reference to it, with its current
+    length; because logs only grow, this is a snapshot of it. Composing the
+    Variables of a nested expression is then O(1) at each level, instead of
+    copying every operation from the levels below. The operations are only
+    gathered by flatten(), when the action gets created.
+    """
+    def __init__(self):
+        # Either operations, or (OperationLog, length) references
+        self._parts = []
+
+    def __len__(self):
+        return len(self._parts)
+
+    def append(self, op):
+        self._parts.append(op)
+
+    def extend(self, operations):
+        self._parts.extend(operations)
+
+    def append_log(self, log):
+        if log is not self and len(log) > 0:
+            self._parts.append((log, len(log)))
+
+    def flatten(self):
+        """Gets the list of the operations, in order.
+
+        A log can be reached several times, when a subexpression is shared;
+        its operations are only listed once. Modules are also only added
+        once, even if the same module was added by different operations.
+        """
+        operations = []
+        seen = set()
+        walked = {self: len(self._parts)}  # OperationLog -> parts walked
+        # Iterative depth-first walk, expressions can be deeply nested
+        stack = [[self, 0, len(self._parts)]]
+        while stack:
+            top = stack[-1]
+            log, pos, end = top
+            if pos >= end:
+                stack.pop()
+                continue
+            top[1] = pos + 1
+            part = log._parts[pos]
+            if isinstance(part[0], OperationLog):
+                sub, length = part
+                start = walked.get(sub, 0)
+                if length > start:
+                    walked[sub] = length
+                    stack.append([sub, start, length])
+                continue
+            if part[0] == 'add' and isinstance(part[1], PipelineModule):
+                key = 'module', part[1].id
+            else:
+                key = id(part)
+            if key not in seen:
+                seen.add(key)
+                operations.append(part)
+        return operations
+
+
 class PipelineGenerator(object):
     """A wrapper for simple operations that keeps a list of all modules.
 
     This wraps simple operations on the pipeline and keeps the list of
-    VisTrails ops internally. It also keeps a list of all modules needed by
+    VisTrails ops internally, as an OperationLog that can share the logs of
+    other generators. It also keeps a list of all modules needed by
     VisTrails's layout function.
     """
     def __init__(self, controller):
         self.controller = controller
         self._version = controller.current_version
-        self.operations = []
-        self.all_modules = set(controller.current_pipeline.module_list)
-        self.all_connections = set(controller.current_pipeline.connection_list)
+        self.log = OperationLog()
+        self._pipeline_modules = set(controller.current_pipeline.module_list)
+        self._pipeline_connections = set(
+            controller.current_pipeline.connection_list)
+        # Modules that are not laid out, and deleted module ids
+        self._not_laid_out = set()
+        self._deleted_ids = set()
+
+    @property
+    def operations(self):
+        """The list of the operations, including appended ones.
+        """
+        return self.log.flatten()
+
+    def _get_added(self, operations):
+        modules = set(self._pipeline_modules)
+        connections = set(self._pipeline_connections)
+        for op in operations:
+            if op[0] == 'add':
+                if isinstance(op[1], PipelineModule):
+                    if op[1] not in self._not_laid_out:
+                        modules.add(op[1])
+                elif (isinstance(op[1], Connection) and
+                        op[1] not in self._not_laid_out):
+                    connections.add(op[1])
+        modules = set(m for m in modules if m.id not in self._deleted_ids)
+        connections = set(
+            c
+            for c in connections
+            if (c.source.moduleId not in self._deleted_ids and
+                c.destination.moduleId not in self._deleted_ids))
+        return modules, connections
+
+    @property
+    def all_modules(self):
+        return self._get_added(self.operations)[0]
+
+    @property
+    def all_connections(self):
+        return self._get_added(self.operations)[1]
 
     def _ensure_version(self):
         if self.controller.current_version != self._version:
             self.controller.change_selected_version(self._version)
 
     def append_operations(self, operations):
-        for op in operations:
-            if op[0] == 'add':
-                if isinstance(op[1], PipelineModule):
-                    self.all_modules.add(op[1])
-                elif isinstance(op[1], Connection):
-                    self.all_connections.add(op[1])
-        self.operations.extend(operations)
+        """Appends operations from another generator.
+
+        operations is the OperationLog of the other generator, which gets
+        shared rather than copied; a plain list of operations is also
+        accepted. Operations that this generator already has are skipped
+        when flattening; this happens when a subexpression is shared, the
+        operations of its Variable being then appended through each of the
+        Variables using it.
+        """
+        if isinstance(operations, OperationLog):
+            self.log.append_log(operations)
+        else:
+            self.log.extend(operations)
 
     def copy_module(self, module):
         """Copy a VisTrails module to this controller.
@@ -42,21 +149,18 @@ class PipelineGenerator(object):
         Returns the new module (that is not yet created in the vistrail!)
         """
         module = module.do_copy(True, self.controller.vistrail.idScope, {})
-        self.operations.append(('add', module))
-        self.all_modules.add(module)
+        self.log.append(('add', module))
         return module
 
     def add_module(self, module):
-        self.operations.append(('add', module))
-        self.all_modules.add(module)
+        self.log.append(('add', module))
 
     def connect_modules(self, src_mod, src_port, dest_mod, dest_port):
         self._ensure_version()
         new_conn = self.controller.create_connection(
             src_mod, src_port,
             dest_mod, dest_port)
-        self.operations.append(('add', new_conn))
-        self.all_connections.add(new_conn)
+        self.log.append(('add', new_conn))
         return new_conn.id
 
     def connect_var(self, vt_var, dest_module, dest_portname):
@@ -73,18 +177,20 @@ class PipelineGenerator(object):
                 var_type_desc,
                 x, y,
                 vt_var.uuid)
-            self.operations.append(('add', var_module))
+            self.log.append(('add', var_module))
+            self._not_laid_out.add(var_module)
         elif self.controller.check_vistrail_var_connected(var_module,
                                                           dest_module,
                                                           dest_portname):
             return
         connection = self.controller.create_connection(
             var_module, 'value', dest_module, dest_portname)
-        self.operations.append(('add', connection))
+        self.log.append(('add', connection))
+        self._not_laid_out.add(connection)
 
     def update_function(self, module, portname, values):
         self._ensure_version()
-        self.operations.extend(self.controller.update_function_ops(
+        self.log.extend(self.controller.update_function_ops(
             module, portname, values))
 
     def delete_linked(self, modules, **kwargs):
@@ -94,17 +200,11 @@ class PipelineGenerator(object):
         and updates the internal list of all modules to be layout.
         """
         self._ensure_version()
+        operations = []
         deleted_ids = delete_linked(
-            self.controller, modules, self.operations, **kwargs)
-        self.all_modules = set(
-            m
-            for m in self.all_modules
-            if m.id not in deleted_ids)
-        self.all_connections = set(
-            c
-            for c in self.all_connections
-            if (c.source.moduleId not in deleted_ids and
-                c.destination.moduleId not in deleted_ids))
+            self.controller, modules, operations, **kwargs)
+        self.log.extend(operations)
+        self._deleted_ids.update(deleted_ids)
 
     def delete_modules(self, modules):
         self.delete_linked(modules, depth=0)
@@ -116,19 +216,21 @@ class PipelineGenerator(object):
 
         pipeline = self.controller.current_pipeline
 
-        self.operations.extend(self.controller.layout_modules_ops(
+        operations = self.operations
+        all_modules, all_connections = self._get_added(operations)
+        operations.extend(self.controller.layout_modules_ops(
             old_modules=[m
-                         for m in self.all_modules
+                         for m in all_modules
                          if m.id in pipeline.modules],
             new_modules=[m
-                         for m in self.all_modules
+                         for m in all_modules
                          if m.id not in pipeline.modules],
             new_connections=[c
-                             for c in self.all_connections
+                             for c in all_connections
                              if c.id not in pipeline.connections],
             preserve_order=True))
 
-        action = create_action(self.operations)
+        action = create_action(operations)
         self.controller.add_new_action(action)
         return self.controller.perform_action(action)
 
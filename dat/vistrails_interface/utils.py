@@ -1,6 +1,7 @@
 """General low-level utilities for VisTrails interaction.
 """
 
+import hashlib
 import sys
 
 from vistrails.core.modules.basic_modules import Constant
@@ -38,6 +39,34 @@ def resolve_descriptor(param, package_identifier=None):
                         "subclass or str object, not '%s'" % type(param))
 
 
+def _fill_parent_modules_map(mod, parents, level):
+    # Recursively walks the inheritance tree of 'mod', adding it to the map if
+    # Module is a parent
+    # Returns True if Module is a parent, so that the caller can add it to the
+    # map and return True itself
+    top_hit = False
+    for parent in mod.__bases__:
+        if parent == Module:
+            parents[mod] = level
+            return True
+        else:
+            if _fill_parent_modules_map(parent, parents, level + 1):
+                parents[mod] = level
+                top_hit = True
+    return top_hit
+
+
+def parent_modules(mod):
+    """Get the parent Modules of a Module subclass.
+
+    Returns a dict mapping each Module subclass to an int, that goes up from 0
+    (for the given 'mod') to the class that directly inherits Module.
+    """
+    parents = dict()
+    _fill_parent_modules_map(mod, parents, 0)
+    return parents
+
+
 def get_upgraded_pipeline(vistrail, version=None):
     """This is similar to Vistrail#getPipeline() but performs upgrades.
 
@@ -217,3 +246,44 @@ def find_modules_by_type(pipeline, moduletypes):
         if issubclass(desc.module, moduletypes):
             result.append(module)
     return result
+
+
+def structural_hash(pipeline, module_id):
+    """Computes a hash of the part of a pipeline that feeds a module.
+
+    It covers the types of the modules, their functions, and the way they are
+    connected, but not the module ids or their layout. Subpipelines that were
+    built separately but compute the same thing get the same hash.
+    """
+    upstream = dict()  # module id -> [connection]
+    for connection in pipeline.connection_list:
+        upstream.setdefault(connection.destination.moduleId, []).append(
+            connection)
+
+    hashes = dict()  # module id -> str
+    # Iterative post-order walk, the pipeline can be deep
+    stack = [module_id]
+    while stack:
+        mod_id = stack[-1]
+        if mod_id in hashes:
+            stack.pop()
+            continue
+        missing = [c.source.moduleId
+                   for c in upstream.get(mod_id, ())
+                   if c.source.moduleId not in hashes]
+        if missing:
+            stack.extend(missing)
+            continue
+        stack.pop()
+        module = pipeline.modules[mod_id]
+        functions = sorted(
+            (function.name, tuple(param.strValue
+                                  for param in function.params))
+            for function in module.functions)
+        connections = sorted(
+            (c.destination.name, c.source.name, hashes[c.source.moduleId])
+            for c in upstream.get(mod_id, ()))
+        hashes[mod_id] = hashlib.sha1(repr((
+            module.package, module.name, module.namespace,
+            functions, connections))).hexdigest()
+    return hashes[module_id]
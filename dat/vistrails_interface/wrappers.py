@@ -14,13 +14,16 @@ from vistrails.core.db.action import create_action
 from vistrails.core.db.locator import XMLFileLocator
 from vistrails.core.modules.basic_modules import Constant
 from vistrails.core.modules.module_registry import get_module_registry
+from vistrails.core.modules.port_spec import PortSpec
 from vistrails.core.modules.sub_module import InputPort
+from vistrails.core.vistrail.annotation import Annotation
 from vistrails.core.vistrail.pipeline import Pipeline
 from vistrails.gui.modules.utils import get_widget_class
 
 from dat.vistrails_interface.pipelines import PipelineGenerator
 from dat.vistrails_interface.utils import resolve_descriptor, \
-    get_upgraded_pipeline, get_function, read_port_specs, find_modules_by_type
+    get_upgraded_pipeline, get_function, read_port_specs, \
+    find_modules_by_type, structural_hash
 
 
 class ModuleWrapper(object):
@@ -73,6 +76,27 @@ class ModuleWrapper(object):
             inputport_name,
             value)
 
+    def add_port(self, port_type, port_name, vt_type):
+        """Add a port to this module.
+
+        This is for modules with user-defined ports, such as PythonSource.
+        port_type is either 'input' or 'output'; vt_type is resolvable to a
+        VisTrails module type.
+        """
+        if port_type not in ('input', 'output'):
+            raise ValueError("add_port() port type should be 'input' or "
+                             "'output'")
+        descriptor = resolve_descriptor(vt_type)
+        controller = self._variable._generator.controller
+        port_spec = PortSpec(
+            id=controller.vistrail.idScope.getNewId(PortSpec.vtType),
+            name=port_name,
+            type=port_type,
+            sigstring='(%s)' % descriptor.sigstring)
+        # The module is not yet in the vistrail, so the port spec is added to
+        # it directly and will be created along with it
+        self._module.add_port_spec(port_spec)
+
     def connect_outputport_to(self, outputport_name,
                               other_module, inputport_name):
         """Create a connection between ports of two modules.
@@ -108,35 +132,112 @@ class Variable(object):
         the Variable has been materialized in the pipeline, this is the actual
         class of the object we store. It is created by
         Variable#materialize().
+
+        structural_hash identifies the content of the pipeline, see
+        structural_hash(); it is None if it is not known yet.
+
+        type can be None, in which case it is read from the pipeline when
+        first needed (see Variable#read_type()); it is then None if the
+        pipeline is invalid.
         """
-        def __init__(self, name, controller, type, provenance=None):
+        def __init__(self, name, controller, type, provenance=None,
+                     structural_hash=None):
             self.name = name
             self._controller = controller
-            self.type = type
+            self._type = type
             self.provenance = provenance
+            self.structural_hash = structural_hash
+
+        # VariableInformation objects always have a pipeline in the Vistrail
+        materialized = True
+
+        @property
+        def type_known(self):
+            """Indicates whether the type is known without reading the
+            pipeline.
+            """
+            return self._type is not None
+
+        def _get_type(self):
+            if self._type is None:
+                self._type = Variable.read_type(get_upgraded_pipeline(
+                    self._controller.vistrail,
+                    self.get_version()))
+            return self._type
+
+        def _set_type(self, type):
+            self._type = type
+
+        type = property(_get_type, _set_type)
+
+        def get_version(self):
+            """Gets the version of the pipeline of this variable.
+            """
+            return self._controller.vistrail.get_version_number(
+                'dat-var-%s' % self.name)
 
         def remove(self):
             """Delete the pipeline from the Vistrail.
 
             This is called by the VistrailData when the Variable is removed.
             """
-            controller = self._controller
-            version = controller.vistrail.get_version_number(
-                'dat-var-%s' % self.name)
-            controller.prune_versions([version])
+            self._controller.prune_versions([self.get_version()])
 
         def rename(self, new_varname):
             """Change the tag on this version in the Vistrail.
 
             This is called by the VistrailData when the Variable is renamed.
             """
-            controller = self._controller
-            version = controller.vistrail.get_version_number(
-                'dat-var-%s' % self.name)
-            controller.vistrail.set_tag(version, 'dat-var-%s' % new_varname)
+            self._controller.vistrail.set_tag(self.get_version(),
+                                              'dat-var-%s' % new_varname)
 
             self.name = new_varname
 
+    class LazyVariableInformation(VariableInformation):
+        """A DAT variable whose pipeline might not have been created yet.
+
+        The pipeline is only added to the Vistrail when it is first needed,
+        i.e. when get_version() is called. This is done by the materialize
+        callback, which is given this object.
+
+        It is created by VistrailData#new_lazy_variable(). sources are the
+        names of the variables it is computed from, which are looked up when
+        it is materialized.
+        """
+        def __init__(self, name, controller, type, materialize,
+                     provenance=None, sources=()):
+            Variable.VariableInformation.__init__(self, name, controller, type,
+                                                  provenance)
+            self._materialize = materialize
+            self.sources = set(sources)
+
+        @property
+        def materialized(self):
+            return self._materialize is None
+
+        def get_version(self):
+            if self._materialize is not None:
+                materialize, self._materialize = self._materialize, None
+                try:
+                    materialize(self)
+                except Exception:
+                    self._materialize = materialize
+                    raise
+            return Variable.VariableInformation.get_version(self)
+
+        def remove(self):
+            if self._materialize is None:
+                Variable.VariableInformation.remove(self)
+            else:
+                # Nothing was added to the Vistrail
+                self._materialize = None
+
+        def rename(self, new_varname):
+            if self._materialize is None:
+                Variable.VariableInformation.rename(self, new_varname)
+            else:
+                self.name = new_varname
+
     @staticmethod
     def _get_variables_root(controller=None):
         """Create or get the version tagged 'dat-vars'
@@ -208,6 +309,15 @@ class Variable(object):
 
         self.type = resolve_descriptor(type)
 
+    @property
+    def materialized_info(self):
+        """The VariableInformation this Variable was materialized as.
+
+        This is None if the Variable is not in the Vistrail, i.e. it is an
+        intermediate result.
+        """
+        return self._materialized
+
     def add_module(self, module_type):
         """Add a new module to the pipeline and return a wrapper.
         """
@@ -251,6 +361,53 @@ class Variable(object):
         self._output_module = module._module
         self._outputport_name = outputport_name
 
+    def select_slice_port(self, module, inputport_name):
+        """Select the input port that receives slices of this Variable.
+
+        A loader that can read only part of its data calls this to declare
+        that the given input port of the given module accepts a slice, as a
+        string such as '1000:5000,::4' (the format of Python's subscripts).
+        Slicing the variable in an expression, as in 'A[1000:5000, ::4]',
+        then sets this port instead of slicing the whole data afterwards.
+
+        The slice is only given to that module if it is the one whose output
+        port is the output of the Variable (see select_output_port()), as the
+        modules after it could need all the data.
+
+        The choice is stored in the pipeline, as an annotation of the module.
+        """
+        if module._variable is not self:
+            raise ValueError("select_slice_port() designated a module from a "
+                             "different Variable")
+        try:
+            module._module.get_port_spec(inputport_name, 'input')
+        except Exception:
+            raise ValueError("select_slice_port() designated a non-existent "
+                             "port")
+        controller = self._generator.controller
+        module._module.add_annotation(Annotation(
+            id=controller.vistrail.idScope.getNewId(Annotation.vtType),
+            key='dat-slice-port',
+            value=inputport_name))
+
+    def push_down_slice(self, descriptor):
+        """Give a slice to the module that declared it can read one.
+
+        Returns False if the output module of the Variable isn't such a
+        module, or if a slice was already given to it, in which case nothing
+        is changed. A module further upstream never gets the slice: the
+        operations applied after it would then run on truncated data.
+        """
+        module = self._output_module
+        if (module is None or
+                not module.has_annotation_with_key('dat-slice-port')):
+            return False
+        port = module.get_annotation_by_key('dat-slice-port').value
+        if get_function(module, port) is not None:
+            return False
+        self._generator.update_function(module, port, [descriptor])
+        return True
+
     def materialize(self, name):
         """Materialize this Variable in the Vistrail.
 
@@ -287,7 +444,9 @@ class Variable(object):
             name,
             controller,
             self.type,
-            self.provenance)
+            self.provenance,
+            structural_hash(controller.current_pipeline,
+                            self._output_module_id))
         self._materialized = variable_info
         return variable_info
 
@@ -314,10 +473,9 @@ class Variable(object):
         """Reads back a Variable from a pipeline, given a VariableInformation.
         """
         controller = variable_info._controller
-        varname = variable_info.name
         pipeline = get_upgraded_pipeline(
             controller.vistrail,
-            'dat-var-%s' % varname)
+            variable_info.get_version())
 
         generator = PipelineGenerator(controller)
         output = add_variable_subworkflow(generator, pipeline)
@@ -342,7 +500,7 @@ class ArgumentWrapper(object):
         generator = module._variable._generator
         if not self._copied:
             # First, we need to copy this pipeline into the new Variable
-            generator.append_operations(self._variable._generator.operations)
+            generator.append_operations(self._variable._generator.log)
             self._copied = True
         generator.connect_modules(
             self._variable._output_module,
@@ -653,9 +811,16 @@ class VariableOperation(object):
     symmetric means that the function will be called if the arguments are
     backwards; this only works for operations with 2 arguments of different
     types. It is useful for operators such as * and +.
+    evaluate is an optional function computing the result directly from the
+    values of the operands (passed as keywords, like for callback). It allows
+    expressions to be previewed without building and executing a pipeline.
+    pure indicates that evaluate is quick and has no side-effect. When all the
+    operands are constants, the result is then computed when the expression
+    is resolved, and added to the pipeline as a constant.
     """
     def __init__(self, name, args=None, return_type=None, callback=None,
-                 subworkflow=None, symmetric=False, wizard=None):
+                 subworkflow=None, symmetric=False, wizard=None,
+                 evaluate=None, pure=False):
         self.name = name
         self.package_identifier = None
         self.parameters = args
@@ -683,6 +848,8 @@ class VariableOperation(object):
                 raise TypeError("missing parameter 'return_type")
         self.symmetric = symmetric
         self.wizard = wizard
+        self.evaluate = evaluate
+        self.pure = pure and evaluate is not None
 
 
 class OperationArgument(object):